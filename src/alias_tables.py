@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Alias tables (Walker's method, built as in Vose's variant) for weighted sampling in O(1).
+# Many small distributions (e.g. the words of every class) are stored together in the CSR
+# layout of CompiledGrammar: the options of distribution i are positions offsets[i] to
+# offsets[i + 1] of a flat weights array, and draws return positions of that array, as
+# rng.randrange(offsets[i], offsets[i + 1]) does for uniform draws.
+
+import numpy as np
+
+
+class AliasTables:
+    """
+    Alias tables of the distributions given by a flat array of positive weights and its offsets.
+    Each position keeps the probability of drawing itself when its column is chosen (prob), and
+    the position drawn otherwise (alias).
+    """
+    def __init__(self, weights, offsets):
+        """
+        :param weights:     Weight of every option, grouped by distribution
+        :param offsets:     Options of distribution i are weights[offsets[i]:offsets[i + 1]]
+        """
+        weights = np.asarray(weights, dtype=np.float64).tolist()
+        self.offsets = np.asarray(offsets, dtype=np.int64).tolist()
+        self.prob = [1.0] * len(weights)
+        self.alias = list(range(len(weights)))
+        for start, stop in zip(self.offsets, self.offsets[1:]):
+            size = stop - start
+            if size < 2:
+                continue
+            total = sum(weights[start:stop])
+            scaled = [weight * size / total for weight in weights[start:stop]]
+            small = [i for i, p in enumerate(scaled) if p < 1]
+            large = [i for i, p in enumerate(scaled) if p >= 1]
+            while small and large:
+                less = small.pop()
+                more = large.pop()
+                self.prob[start + less] = scaled[less]
+                self.alias[start + less] = start + more
+                scaled[more] += scaled[less] - 1
+                (small if scaled[more] < 1 else large).append(more)
+            # Options left have probability 1, up to rounding errors
+        # Arrays for batch draws
+        self.offsets_array = np.array(self.offsets, dtype=np.int64)
+        self.prob_array = np.array(self.prob, dtype=np.float64)
+        self.alias_array = np.array(self.alias, dtype=np.int64)
+
+    def draw(self, segment, rng):
+        """
+        Returns the position of an option of distribution segment, drawn with one rng.random() call
+        :param rng:     random.Random instance to draw from
+        """
+        start = self.offsets[segment]
+        size = self.offsets[segment + 1] - start
+        if size <= 0:
+            raise ValueError(f"Distribution {segment} has no options")
+        column = rng.random() * size
+        pos = int(column)
+        if pos == size:  # rounding of random() close to 1
+            pos -= 1
+        return start + pos if column - pos < self.prob[start + pos] else self.alias[start + pos]
+
+    def draw_batch(self, segments, rng):
+        """
+        Returns an array with the position of an option drawn from each distribution in segments
+        :param rng:     numpy Generator to draw from
+        """
+        segments = np.asarray(segments, dtype=np.int64)
+        starts = self.offsets_array[segments]
+        sizes = self.offsets_array[segments + 1] - starts
+        if np.any(sizes <= 0):
+            raise ValueError("Can't draw from distributions without options")
+        columns = rng.random(len(segments)) * sizes
+        pos = np.minimum(columns.astype(np.int64), sizes - 1)
+        chosen = starts + pos
+        return np.where(columns - pos < self.prob_array[chosen], chosen, self.alias_array[chosen])
@@ -0,0 +1,439 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Baseline parsers of generated corpora, to compare other parsers against: sequential and random
+# projective trees, and MST parses scored by the mutual information of word pairs co-occurring
+# within a window. Parses are written in ULL format, ready for parse_evaluator.py.
+
+import sys
+import getopt
+import random as rand
+from itertools import islice
+import numpy as np
+
+FINAL_PUNCTUATION = "."  # added by GrammarSampler to every sentence, and never linked
+CHUNK_SIZE = 10000  # Sentences processed at once
+WORD_BITS = 24  # Pair keys pack (distance - 1, left word id, right word id) in an int64
+WORD_MASK = (1 << WORD_BITS) - 1
+PAIR_BITS = 2 * WORD_BITS
+PAIR_MASK = (1 << PAIR_BITS) - 1
+BASELINES = ("sequential", "random", "mst")
+
+
+def main(argv):
+    """
+        Baselines parses a corpus with a baseline method, and writes the parses in ULL format.
+
+        "Usage: baselines.py -i <corpus_file> -o <outfile> [-m <method> --seed <seed>
+                             --win_observe <win_observe> --win_parse <win_parse> --distance_weight]"
+
+        corpus_file         Corpus to parse, one sentence per line, e.g. written by corpus_generator
+        outfile             File to write the parses to
+        method              One of (default: 'sequential'):
+                            'sequential' links each word to the next one;
+                            'random' draws a random projective tree (no crossings, no loops);
+                            'mst' builds the exact maximum spanning tree without crossings of the
+                            word pairs' mutual information, counted over the corpus itself
+        seed                Random seed of the 'random' method (default: random)
+        win_observe         Max distance of word pairs counted for mutual information (default: 6)
+        win_parse           Max distance of word pairs linked by the 'mst' method (default: 6)
+        distance_weight     Weight pairs counts by the inverse of their distance
+    """
+    corpus_file = ''
+    outfile = ''
+    method = 'sequential'
+    seed = None
+    win_observe = 6
+    win_parse = 6
+    distance_weight = False
+
+    usage = '''Usage: baselines.py -i <corpus_file> -o <outfile> [-m <method> --seed <seed>
+                             --win_observe <win_observe> --win_parse <win_parse> --distance_weight]'''
+    try:
+        opts, args = getopt.getopt(argv, "hi:o:m:", ["input=", "outfile=", "method=", "seed=", "win_observe=",
+                                                     "win_parse=", "distance_weight"])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-i", "--input"):
+            corpus_file = arg
+        elif opt in ("-o", "--outfile"):
+            outfile = arg
+        elif opt in ("-m", "--method"):
+            if arg not in BASELINES:
+                raise getopt.GetoptError(f"Method must be one of {BASELINES}")
+            method = arg
+        elif opt == "--seed":
+            seed = int(arg)
+        elif opt == "--win_observe":
+            win_observe = int(arg)
+        elif opt == "--win_parse":
+            win_parse = int(arg)
+        elif opt == "--distance_weight":
+            distance_weight = True
+
+    if corpus_file == '' or outfile == '':
+        raise getopt.GetoptError("Corpus and output files must be specified")
+
+    parser = make_parser(method, corpus_file, seed=seed, win_observe=win_observe, win_parse=win_parse,
+                         distance_weight=distance_weight)
+    num_parses = parse_corpus(parser, corpus_file, outfile)
+    print(f"Wrote {num_parses} {method} parses to {outfile}")
+
+
+def make_parser(method: str, corpus_file: str = None, seed: int = None, win_observe: int = 6, win_parse: int = 6,
+                distance_weight: bool = False, counts=None):
+    """
+    Returns the baseline parser of method. The 'mst' parser uses counts, a CooccurrenceCounts with
+    at least win_observe distances, or counts them over corpus_file.
+    """
+    if method == 'sequential':
+        return SequentialParser()
+    if method == 'random':
+        return RandomParser(rand.Random(seed))
+    if method == 'mst':
+        if counts is None:
+            counts = CooccurrenceCounts(win_observe)
+            counts.count_corpus(read_corpus(corpus_file))
+        return MSTParser(counts.pair_scores(win_observe, distance_weight), win_parse)
+    raise ValueError(f"Unknown baseline method '{method}'")
+
+
+def read_corpus(corpus_file):
+    """
+    Yields the sentences of a corpus file, skipping blank lines
+    """
+    with open(corpus_file, 'r') as fi:
+        for line in fi:
+            line = line.strip()
+            if line:
+                yield line
+
+
+def sentence_words(sentence):
+    """
+    Returns the words of sentence to parse, without its final punctuation
+    """
+    words = sentence.split()
+    if len(words) > 1 and words[-1] == FINAL_PUNCTUATION:
+        words.pop()
+    return words
+
+
+def format_parse(words, links):
+    """
+    Returns links, as (left, right) positions of words, in ULL format
+    """
+    return "\n".join(f"{left} {words[left - 1]} {right} {words[right - 1]}" for left, right in sorted(links))
+
+
+def parse_corpus(parser, corpus_file: str, outfile: str, chunk_size: int = CHUNK_SIZE):
+    """
+    Parses every sentence of corpus_file with parser, writes them to outfile in ULL format,
+    and returns their number
+    """
+    sentences = read_corpus(corpus_file)
+    num_parses = 0
+    with open(outfile, 'w') as fo:
+        for chunk in iter(lambda: list(islice(sentences, chunk_size)), []):
+            chunk_words = [sentence_words(sentence) for sentence in chunk]
+            for sentence, words, links in zip(chunk, chunk_words, parser.parse_batch(chunk_words)):
+                fo.write(sentence + '\n')
+                fo.write(format_parse(words, links) + '\n\n')
+            num_parses += len(chunk)
+    return num_parses
+
+
+class BaselineParser:
+    """
+    Base class of baseline parsers
+    """
+    def parse(self, words):
+        """
+        Returns the links of a sentence, given as a list of words, as (left, right) word positions from 1
+        """
+        raise NotImplementedError
+
+    def parse_batch(self, sentences):
+        """
+        Returns the links of each sentence of a list
+        """
+        return [self.parse(words) for words in sentences]
+
+
+class SequentialParser(BaselineParser):
+    """
+    Links every word to the next one
+    """
+    def parse(self, words):
+        return [(i, i + 1) for i in range(1, len(words))]
+
+
+class RandomParser(BaselineParser):
+    """
+    Draws random projective trees: the head of a span of words is chosen at random,
+    and the spans left and right of it are attached to it the same way
+    """
+    def __init__(self, rng=None):
+        """
+        :param rng:     random.Random instance to draw from; uses the global random state if None
+        """
+        self.rng = rand if rng is None else rng
+
+    def parse(self, words):
+        links = []
+        spans = [(1, len(words), None)]  # (first, last, head of the parent span)
+        while spans:
+            first, last, parent = spans.pop()
+            if first > last:
+                continue
+            head = self.rng.randint(first, last)
+            if parent is not None:
+                links.append((min(head, parent), max(head, parent)))
+            spans.append((first, head - 1, head))
+            spans.append((head + 1, last, head))
+        return links
+
+
+class CooccurrenceCounts:
+    """
+    Sparse counts of ordered word pairs found at each distance, up to max_window, in a corpus.
+    Counts are kept as a sorted array of pair keys, ((distance - 1), left id, right id) packed in
+    an int64, and an array of their counts; they are accumulated chunk by chunk in one pass.
+    """
+    def __init__(self, max_window: int):
+        self.max_window = max_window
+        self.word_ids = {}
+        self.vocab = []
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.pending = []  # (keys, counts) of chunks not merged yet
+
+    def word_array(self, sentences, add=False):
+        """
+        Returns the word ids of sentences (lists of words) concatenated, and the sentence index
+        of each one. Unknown words get id -1, unless add is set.
+        """
+        ids = []
+        for words in sentences:
+            for word in words:
+                word_id = self.word_ids.get(word, -1)
+                if word_id < 0 and add:
+                    word_id = self.word_ids[word] = len(self.vocab)
+                    self.vocab.append(word)
+                ids.append(word_id)
+        if len(self.vocab) > WORD_MASK:
+            raise ValueError(f"Vocabulary is bigger than {WORD_MASK} words")
+        sentence = np.repeat(np.arange(len(sentences)), [len(words) for words in sentences])
+        return np.array(ids, dtype=np.int64), sentence
+
+    def count_corpus(self, sentences, chunk_size: int = CHUNK_SIZE):
+        """
+        Adds the pairs of all sentences (strings) to the counts
+        """
+        for chunk in iter(lambda: list(islice(sentences, chunk_size)), []):
+            self.count_chunk([sentence_words(sentence) for sentence in chunk])
+        self.merge()
+
+    def count_chunk(self, sentences):
+        """
+        Adds the pairs of sentences (lists of words) to the counts
+        """
+        ids, sentence = self.word_array(sentences, add=True)
+        keys = []
+        for distance in range(1, self.max_window + 1):
+            same = sentence[distance:] == sentence[:-distance]
+            keys.append(((distance - 1) << PAIR_BITS) | (ids[:-distance][same] << WORD_BITS) | ids[distance:][same])
+        self.pending.append(sum_by_key(np.concatenate(keys), None))
+        # Merge when the pending counts are as big as the merged ones, to keep merging cost linear
+        if sum(len(chunk_keys) for chunk_keys, chunk_counts in self.pending) >= len(self.keys):
+            self.merge()
+
+    def merge(self):
+        if self.pending:
+            self.keys, self.counts = sum_by_key(np.concatenate([self.keys] + [k for k, c in self.pending]),
+                                                np.concatenate([self.counts] + [c for k, c in self.pending]))
+            self.pending = []
+
+    def pair_scores(self, window: int, distance_weight: bool = False):
+        """
+        Returns the PairScores of the mutual information of word pairs counted within window words
+        :param distance_weight:     Weight counts by the inverse of the pairs' distance
+        """
+        if window > self.max_window:
+            raise ValueError(f"Pairs were only counted up to distance {self.max_window}")
+        self.merge()
+        end = np.searchsorted(self.keys, window << PAIR_BITS)  # keys are sorted by distance first
+        counts = self.counts[:end].astype(float)
+        if distance_weight:
+            counts /= (self.keys[:end] >> PAIR_BITS) + 1
+        pairs, counts = sum_by_key(self.keys[:end] & PAIR_MASK, counts)
+        left = pairs >> WORD_BITS
+        right = pairs & WORD_MASK
+        left_counts = np.bincount(left, weights=counts, minlength=len(self.vocab))
+        right_counts = np.bincount(right, weights=counts, minlength=len(self.vocab))
+        mi = np.log2(counts * counts.sum() / (left_counts[left] * right_counts[right]))
+        return PairScores(self.word_ids, pairs, mi)
+
+
+def sum_by_key(keys, counts):
+    """
+    Returns the sorted distinct keys, and the sum of counts (or number of occurrences, if None) of each
+    """
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1]))) if len(keys) else np.zeros(0, int)
+    if counts is None:
+        sums = np.diff(np.append(starts, len(keys)))
+    else:
+        sums = np.add.reduceat(counts[order], starts) if len(keys) else counts[:0]
+    return keys[starts], sums
+
+
+class PairScores:
+    """
+    Scores of ordered word pairs: pairs are sorted int64 keys (left id, right id), as in CooccurrenceCounts
+    """
+    def __init__(self, word_ids, pairs, scores):
+        self.word_ids = word_ids
+        self.pairs = pairs
+        self.scores = scores
+
+    def lookup(self, left, right):
+        """
+        Returns the scores of the pairs of id arrays left and right, NaN for pairs never seen
+        """
+        if not len(self.pairs):
+            return np.full(len(left), np.nan)
+        keys = (left << WORD_BITS) | right
+        pos = np.minimum(np.searchsorted(self.pairs, keys), len(self.pairs) - 1)
+        return np.where((left >= 0) & (right >= 0) & (self.pairs[pos] == keys), self.scores[pos], np.nan)
+
+
+class MSTParser(BaselineParser):
+    """
+    Links the words of a sentence with the maximum spanning tree of their pair scores among the trees
+    without crossing links, considering pairs up to window words apart. If some pairs were never seen,
+    the parse is the non-crossing forest with the most links, and the highest score among those.
+
+    Non-crossing spanning trees are the projective dependency trees rooted at the first word, so the
+    best one is found exactly by Eisner's O(n^3) dynamic programming, run on all the sentences of the
+    same length at once. Unseen and distant pairs may be used as arcs, but score nothing and are left
+    out of the parse; every seen pair scores LINK_BONUS more than its mutual information.
+    """
+    LINK_BONUS = 1e6  # Larger than any sum of pair scores of a sentence, so that more links always win
+
+    def __init__(self, scores, window: int = 6):
+        """
+        :param scores:  PairScores, e.g. from CooccurrenceCounts.pair_scores()
+        """
+        self.scores = scores
+        self.window = window
+        self.word_ids = scores.word_ids
+
+    def parse(self, words):
+        return self.parse_batch([words])[0]
+
+    def parse_batch(self, sentences):
+        # Score the candidate pairs of all sentences at once
+        ids = np.array([self.word_ids.get(word, -1) for words in sentences for word in words], dtype=np.int64)
+        lengths = np.array([len(words) for words in sentences], dtype=np.int64)
+        sentence = np.repeat(np.arange(len(sentences)), lengths)
+        position = np.arange(len(ids)) - np.repeat(np.cumsum(lengths) - lengths, lengths)  # from 0
+        candidates = []
+        for distance in range(1, self.window + 1):
+            same = sentence[distance:] == sentence[:-distance]
+            score = self.scores.lookup(ids[:-distance][same], ids[distance:][same])
+            seen = ~np.isnan(score)
+            candidates.append((sentence[distance:][same][seen], position[:-distance][same][seen],
+                               position[distance:][same][seen], score[seen]))
+        cand_sentence, cand_left, cand_right, cand_score = (np.concatenate(column) for column in zip(*candidates))
+
+        parses = [[] for _ in sentences]
+        for length in np.unique(lengths[lengths > 1]).tolist():
+            group = np.flatnonzero(lengths == length)
+            row = np.full(len(sentences), -1)
+            row[group] = np.arange(len(group))
+            chosen = row[cand_sentence] >= 0
+            # Arc values of every (head, dependent) pair of positions of each sentence of the group
+            arcs = np.zeros((len(group), length, length))
+            seen = np.zeros((len(group), length, length), dtype=bool)
+            index = (row[cand_sentence[chosen]], cand_left[chosen], cand_right[chosen])
+            arcs[index] = self.LINK_BONUS + cand_score[chosen]
+            seen[index] = True
+            arcs = np.maximum(arcs, arcs.transpose(0, 2, 1))
+            arcs[:, :, 0] = -np.inf  # the first word is the root
+            for k, heads in zip(group.tolist(), projective_trees(arcs)):
+                parses[k] = [(min(head, dep) + 1, max(head, dep) + 1) for dep, head in enumerate(heads)
+                             if head >= 0 and seen[row[k], min(head, dep), max(head, dep)]]
+        return parses
+
+
+def projective_trees(arcs):
+    """
+    Eisner's algorithm for a batch of sentences of n words: returns, for each sentence, the head of every
+    word (-1 for the root) in the projective dependency tree rooted at word 0 with the highest sum of arc
+    values, given by arcs[sentence, head, dependent] (-inf for forbidden arcs)
+    """
+    num, n, _ = arcs.shape
+    # Best spans i..j: complete ones headed at i (right) or j (left), and incomplete ones
+    # with an arc from i to j (right) or from j to i (left), with the split point of each
+    complete = np.full((2, num, n, n), -np.inf)
+    incomplete = np.full((2, num, n, n), -np.inf)
+    complete_split = np.zeros((2, num, n, n), dtype=np.int64)
+    incomplete_split = np.zeros((num, n, n), dtype=np.int64)
+    right, left = 0, 1
+    for i in range(n):
+        complete[:, :, i, i] = 0
+    batch = np.arange(num)
+    for width in range(1, n):
+        for i in range(n - width):
+            j = i + width
+            # Incomplete: two complete halves facing each other, joined by the arc between i and j
+            halves = complete[right, :, i, i:j] + complete[left, :, i + 1:j + 1, j]
+            split = halves.argmax(axis=1)
+            best = halves[batch, split]
+            incomplete[right, :, i, j] = best + arcs[:, i, j]
+            incomplete[left, :, i, j] = best + arcs[:, j, i]
+            incomplete_split[:, i, j] = i + split
+            # Complete: an incomplete span and a complete one continuing in the same direction
+            spans = incomplete[right, :, i, i + 1:j + 1] + complete[right, :, i + 1:j + 1, j]
+            split = spans.argmax(axis=1)
+            complete[right, :, i, j] = spans[batch, split]
+            complete_split[right, :, i, j] = i + 1 + split
+            spans = complete[left, :, i, i:j] + incomplete[left, :, i:j, j]
+            split = spans.argmax(axis=1)
+            complete[left, :, i, j] = spans[batch, split]
+            complete_split[left, :, i, j] = i + split
+
+    trees = []
+    for b in range(num):
+        heads = [-1] * n
+        stack = [(True, right, 0, n - 1)]  # (complete, direction, i, j)
+        while stack:
+            is_complete, direction, i, j = stack.pop()
+            if i == j:
+                continue
+            if is_complete:
+                k = int(complete_split[direction, b, i, j])
+                if direction == right:
+                    stack += [(False, right, i, k), (True, right, k, j)]
+                else:
+                    stack += [(True, left, i, k), (False, left, k, j)]
+            else:
+                if direction == right:
+                    heads[j] = i
+                else:
+                    heads[i] = j
+                k = int(incomplete_split[b, i, j])
+                stack += [(True, right, i, k), (True, left, k + 1, j)]
+        trees.append(heads)
+    return trees
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Benchmark suite: throughput of grammar loading, sentence sampling (on every grammar of data/,
+# and on generated grammars of growing sentence length and vocabulary size), end-to-end corpus
+# generation and the CoNLL converters of utils/. Every measurement draws the same work from fixed
+# seeds, so results written by different runs (JSON, see run_benchmarks()) can be compared.
+
+import sys
+import os
+import getopt
+import glob
+import json
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+from contextlib import redirect_stdout
+import numpy as np
+from sentence_generator import Grammar, GrammarSampler
+from length_sampler import LengthSampler
+from grammar_analysis import analyzer_for
+from grammar_generator import generate_grammar
+from corpus_generator import generate_corpus
+
+BENCHMARK_FORMAT = 1  # Version of the results files; only results of the same version are compared
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+DATA_DIR = os.path.join(REPO_DIR, "data")
+UTILS_DIR = os.path.join(REPO_DIR, "utils")
+BENCHMARKS = ("grammar_load", "sampler", "length_scaling", "vocab_scaling", "corpus", "converters")
+REPEAT = 3  # Runs of every case; results keep the best rate, the least disturbed by other load on the machine
+TIME_BUDGET = 2.0  # Seconds after which a run stops early, for slow cases; its rate is still comparable
+SEED = 0
+# Work of each run, divided by QUICK_FACTOR with --quick
+LOADS = 100
+SENTENCES = 20000
+CORPUS_SENTENCES = 20000
+CONLL_SENTENCES = 20000
+QUICK_FACTOR = 10
+# Generated grammars are recursive with these parameters, so they have sentences of every length
+GENERATED_PARAMS = {"num_words": 1000, "num_classes": 30, "num_class_connectors": 80}
+LENGTHS = (5, 10, 20, 40)
+VOCAB_SIZES = (100, 1000, 10000, 100000)
+VOCAB_LENGTH = 10  # Sentence length of the vocabulary scaling benchmark
+# Grammars of the corpus benchmark: files of data/, or generated grammar parameters, with their max_length
+CORPUS_GRAMMARS = (("handgram8.grammar", 1000), (GENERATED_PARAMS, 25))
+THRESHOLD = 0.1  # Relative slowdown reported as a regression by compare_results()
+
+
+def main(argv):
+    """
+        Benchmark measures the throughput of rangram and writes it to a JSON file, optionally comparing
+        it to a previous run.
+
+        "Usage: benchmark.py [-o <results_file> -i <results_file> -c <baseline_file> --only <benchmarks>
+                             --repeat <num_runs> --quick --threshold <threshold>]"
+
+        results_file        File to write the results to, in JSON format (default: stdout). With -i, results
+                            are read from this file instead of running the benchmarks
+        baseline_file       Results of a previous run to compare to. Cases slower than the baseline by more
+                            than threshold (default: 0.1, i.e. 10%) are listed as regressions, and the exit
+                            status is 1 if there are any
+        benchmarks          Comma-separated benchmarks to run (default: all): grammar_load, sampler,
+                            length_scaling, vocab_scaling, corpus, converters
+        num_runs            Runs of every case, whose best rate is kept (default: 3)
+        quick               Do a tenth of the work in every run, e.g. for smoke tests. Rates of quick runs
+                            are noisier, but can still be compared
+    """
+    results_file = None
+    input_file = None
+    baseline_file = None
+    benchmarks = BENCHMARKS
+    repeat = REPEAT
+    quick = False
+    threshold = THRESHOLD
+
+    usage = '''Usage: benchmark.py [-o <results_file> -i <results_file> -c <baseline_file> --only <benchmarks>
+                             --repeat <num_runs> --quick --threshold <threshold>]'''
+    try:
+        opts, args = getopt.getopt(argv, "ho:i:c:", ["outfile=", "input=", "compare=", "only=", "repeat=", "quick",
+                                                    "threshold="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-o", "--outfile"):
+            results_file = arg
+        elif opt in ("-i", "--input"):
+            input_file = arg
+        elif opt in ("-c", "--compare"):
+            baseline_file = arg
+        elif opt == "--only":
+            benchmarks = tuple(arg.split(','))
+            unknown = set(benchmarks) - set(BENCHMARKS)
+            if unknown:
+                raise getopt.GetoptError(f"Unknown benchmarks {sorted(unknown)}, must be among {BENCHMARKS}")
+        elif opt == "--repeat":
+            repeat = int(arg)
+        elif opt == "--quick":
+            quick = True
+        elif opt == "--threshold":
+            threshold = float(arg)
+
+    if input_file is not None:
+        with open(input_file, 'r') as fi:
+            results = json.load(fi)
+    else:
+        results = run_benchmarks(benchmarks, repeat, quick)
+        if results_file is None:
+            print(json.dumps(results, indent=2))
+        else:
+            with open(results_file, 'w') as fo:
+                json.dump(results, fo, indent=2)
+    if baseline_file is not None:
+        with open(baseline_file, 'r') as fb:
+            baseline = json.load(fb)
+        rows = compare_results(results, baseline, threshold)
+        print(format_comparison(rows))
+        regressions = sum(row["regression"] for row in rows)
+        print(f"{regressions} regressions beyond {threshold:.0%}, out of {len(rows)} cases compared")
+        if regressions:
+            sys.exit(1)
+
+
+def run_benchmarks(benchmarks=BENCHMARKS, repeat=REPEAT, quick=False):
+    """
+    Runs the given benchmarks, and returns their results: the environment they ran in, and a list with
+    the "benchmark", "case", "unit" and best rate ("value", higher is better) of every case, with
+    the rates of all its "runs"
+    """
+    scale = QUICK_FACTOR if quick else 1
+    results = {"format": BENCHMARK_FORMAT, "environment": environment(), "quick": quick, "repeat": repeat,
+               "results": []}
+    with tempfile.TemporaryDirectory(prefix="rangram_benchmark_") as work_dir:
+        for benchmark in benchmarks:
+            for case, unit, run in BENCHMARK_CASES[benchmark](work_dir, scale):
+                runs = [run() for _ in range(repeat)]
+                results["results"].append({"benchmark": benchmark, "case": case, "unit": unit,
+                                           "value": max(runs), "runs": runs})
+                print(f"{benchmark}\t{case}\t{results['results'][-1]['value']:.1f} {unit}", file=sys.stderr)
+    return results
+
+
+def environment():
+    """
+    Describes the machine and code the benchmarks run on
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "numpy": np.__version__,
+            "platform": platform.platform(), "processor": platform.processor(), "cpus": os.cpu_count(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+
+
+def timed_rate(step, amount):
+    """
+    Calls step() until it has done amount units of work or TIME_BUDGET seconds have passed, and
+    returns the units done per second. step() returns the units it did.
+    """
+    done = 0
+    start = time.perf_counter()
+    while done < amount:
+        done += step()
+        if time.perf_counter() - start > TIME_BUDGET:
+            break
+    return done / (time.perf_counter() - start)
+
+
+def data_grammars():
+    return sorted(glob.glob(os.path.join(DATA_DIR, "*.grammar")) + glob.glob(os.path.join(DATA_DIR, "*.dict")))
+
+
+def grammar_load_cases(work_dir, scale):
+    """
+    Grammar files of data/ parsed per second, and loaded per second from their compiled cache file
+    """
+    cache_dir = os.path.join(work_dir, "grammar_cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    for grammar_file in data_grammars():
+        name = os.path.basename(grammar_file)
+        yield name, "loads/s", lambda f=grammar_file: loading_rate(f, LOADS // scale)
+        Grammar(grammar_file, cache_dir=cache_dir)  # compiled once before timing
+        yield name + " (cached)", "loads/s", lambda f=grammar_file: loading_rate(f, LOADS // scale, cache_dir)
+
+
+def loading_rate(grammar_file, loads, cache_dir=None):
+    def step():
+        Grammar(grammar_file, cache_dir=cache_dir)
+        return 1
+    return timed_rate(step, loads)
+
+
+def sampling_rate(sampler, sentences):
+    """
+    Sentences per second generated by sampler with generate_parse(), from a fixed seed
+    """
+    sampler.rng = random.Random(SEED)
+
+    def step():
+        sampler.generate_parse()
+        return 1
+    return timed_rate(step, sentences)
+
+
+def sampler_cases(work_dir, scale):
+    """
+    GrammarSampler.generate_parse() sentences per second, on every grammar of data/
+    """
+    for grammar_file in data_grammars():
+        sampler = GrammarSampler(Grammar(grammar_file))
+        yield os.path.basename(grammar_file), "sentences/s", lambda s=sampler: sampling_rate(s, SENTENCES // scale)
+
+
+def length_sampler(grammar, length):
+    """
+    LengthSampler of grammar for sentences of length words, with its count tables computed before timing,
+    or None if grammar has no such sentences
+    """
+    if not analyzer_for(grammar, lexical=False).count_by_length(length)[length]:
+        return None
+    return LengthSampler(grammar, length)
+
+
+def length_scaling_cases(work_dir, scale):
+    """
+    LengthSampler sentences per second for growing sentence lengths, on a generated grammar
+    """
+    grammar = generate_grammar(**GENERATED_PARAMS, seed=SEED)
+    for length in LENGTHS:
+        sampler = length_sampler(grammar, length)
+        if sampler is not None:
+            yield f"length={length}", "sentences/s", lambda s=sampler: sampling_rate(s, SENTENCES // scale)
+
+
+def vocab_scaling_cases(work_dir, scale):
+    """
+    LengthSampler sentences per second for growing vocabulary sizes, on generated grammars, with
+    sentences of VOCAB_LENGTH words so that only the vocabulary changes the work
+    """
+    for num_words in VOCAB_SIZES:
+        sampler = length_sampler(generate_grammar(**{**GENERATED_PARAMS, "num_words": num_words}, seed=SEED),
+                                 VOCAB_LENGTH)
+        if sampler is not None:
+            yield f"num_words={num_words}", "sentences/s", lambda s=sampler: sampling_rate(s, SENTENCES // scale)
+
+
+def corpus_cases(work_dir, scale):
+    """
+    generate_corpus() draws per second, writing the corpus, its parses and index, from a grammar of data/
+    and a generated one
+    """
+    outfile = os.path.join(work_dir, "corpus.txt")
+    for grammar, max_length in CORPUS_GRAMMARS:
+        if isinstance(grammar, dict):
+            case = "generate:" + ",".join(f"{name}={value}" for name, value in sorted(grammar.items()))
+            args = ('generate', outfile, '', grammar, max_length)
+        else:
+            case = grammar
+            args = ('existing', outfile, os.path.join(DATA_DIR, grammar), None, max_length)
+        yield f"{case} (max_length={max_length})", "sentences/s", \
+            lambda a=args: corpus_rate(*a, CORPUS_SENTENCES // scale)
+
+
+def corpus_rate(grammar_mode, outfile, input_grammar, grammar_params, max_length, corpus_size):
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        generate_corpus(grammar_mode, corpus_size, outfile, input_grammar, max_length=max_length, seed=SEED,
+                        grammar_params=grammar_params)
+    return corpus_size / (time.perf_counter() - start)
+
+
+def write_conll(path, num_sentences, rng):
+    """
+    Writes num_sentences random dependency trees in CoNLL-U format, with some punctuation tokens
+    """
+    with open(path, 'w') as fo:
+        for index in range(num_sentences):
+            length = int(rng.integers(3, 30))
+            fo.write(f"# sent_id = {index}\n")
+            heads = [int(rng.integers(0, position)) for position in range(1, length + 1)]
+            for position, head in enumerate(heads, 1):
+                punct = position == length or rng.random() < 0.05
+                word, tag = (".", "PUNCT") if punct else (f"Word{int(rng.zipf(1.5)) % 5000}", "NOUN")
+                relation = "punct" if punct else "dep"
+                fo.write(f"{position}\t{word}\t{word.lower()}\t{tag}\t_\t_\t{head}\t{relation}\t_\t_\n")
+            fo.write("\n")
+
+
+def converters_cases(work_dir, scale):
+    """
+    MB of synthetic CoNLL input converted per second by conll2ull and conll2crfae
+    """
+    if UTILS_DIR not in sys.path:
+        sys.path.append(UTILS_DIR)
+    import conll2ull
+    import conll2crfae
+    conll_file = os.path.join(work_dir, "synthetic.conllu")
+    write_conll(conll_file, CONLL_SENTENCES // scale, np.random.default_rng(SEED))
+    megabytes = os.path.getsize(conll_file) / 2 ** 20
+    for module in (conll2ull, conll2crfae):
+        yield module.__name__, "MB/s", lambda m=module: converter_rate(m, conll_file, megabytes, work_dir)
+
+
+def converter_rate(module, conll_file, megabytes, work_dir):
+    newdir = os.path.join(work_dir, module.__name__) + '/'
+    shutil.rmtree(newdir, ignore_errors=True)
+    os.makedirs(newdir + 'GS')
+    os.makedirs(newdir + 'corpus')
+    start = time.perf_counter()
+    module.convert_file(conll_file, newdir, True, 1000, True)
+    return megabytes / (time.perf_counter() - start)
+
+
+BENCHMARK_CASES = {"grammar_load": grammar_load_cases, "sampler": sampler_cases,
+                   "length_scaling": length_scaling_cases, "vocab_scaling": vocab_scaling_cases,
+                   "corpus": corpus_cases, "converters": converters_cases}
+
+
+def compare_results(results, baseline, threshold=THRESHOLD):
+    """
+    Compares the cases found in both results and baseline (as returned by run_benchmarks()), and returns
+    a row per case with both values, their ratio (above 1 is faster) and whether it is a regression,
+    i.e. slower than baseline by more than threshold
+    """
+    if results["format"] != baseline["format"]:
+        raise ValueError("Results were written by incompatible versions of the benchmark")
+    baseline_values = {(row["benchmark"], row["case"], row["unit"]): row["value"] for row in baseline["results"]}
+    rows = []
+    for row in results["results"]:
+        key = (row["benchmark"], row["case"], row["unit"])
+        if key in baseline_values:
+            ratio = row["value"] / baseline_values[key] if baseline_values[key] else float("inf")
+            rows.append({"benchmark": key[0], "case": key[1], "unit": key[2], "baseline": baseline_values[key],
+                         "value": row["value"], "ratio": ratio, "regression": ratio < 1 - threshold})
+    return rows
+
+
+def format_comparison(rows):
+    """
+    Returns the rows of compare_results() as a tab-separated table with a header
+    """
+    lines = ["benchmark\tcase\tunit\tbaseline\tvalue\tratio\tregression"]
+    for row in rows:
+        lines.append(f"{row['benchmark']}\t{row['case']}\t{row['unit']}\t{row['baseline']:.2f}\t{row['value']:.2f}"
+                     f"\t{row['ratio']:.3f}\t{'REGRESSION' if row['regression'] else ''}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
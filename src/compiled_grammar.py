@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Compiled, integer-interned form of a Grammar.
+# Classes, connectors, conjuncts and words are replaced by small integer ids stored
+# in compact NumPy arrays, so that samplers never handle strings until writing output.
+# Compiled grammars can be saved to a binary file and memory-mapped back, to skip parsing.
+
+import json
+import os
+import tempfile
+import numpy as np
+
+ID_TYPE = np.int32
+RIGHT = 1  # Direction of "+" connectors
+LEFT = -1  # Direction of "-" connectors
+
+# Binary file layout: magic, header size (little-endian uint64), JSON header padded to a multiple of
+# ALIGNMENT bytes, then every array at an aligned offset from there, as described in the header
+MAGIC = b"RANGRAM\x01"
+ALIGNMENT = 64
+ARRAY_FIELDS = ("conn_dir", "conj_conns", "conj_offsets", "class_conj_offsets", "class_words", "class_word_offsets",
+                "link_classes", "link_offsets", "link_conjs", "link_slots", "link_conj_offsets",
+                "word_weights", "conj_weights", "class_weights")
+
+
+class CompiledGrammar:
+    """
+    Integer-interned grammar, built from the dictionaries and matching index of a Grammar object.
+
+    Variable-length lists are stored as a flat array plus an offsets array (CSR layout):
+    items of list i are flat[offsets[i]:offsets[i + 1]].
+
+    conn_names          Connector strings, indexed by connector id
+    conn_dir            Direction of each connector (RIGHT or LEFT)
+    conj_offsets        Offsets into conj_conns, per conjunct id
+    conj_conns          Connector ids of every conjunct, in rule order
+    class_conj_offsets  Conjunct ids of class k are range(class_conj_offsets[k], class_conj_offsets[k + 1])
+    vocab               Word strings, indexed by word id (words shared by several classes are interned once)
+    class_word_offsets  Offsets into class_words, per class
+    class_words         Word ids of every class
+    link_offsets        Offsets into link_classes, per connector id
+    link_classes        Classes that each connector can link to. Each position in this array is a "link entry"
+    link_conj_offsets   Offsets into link_conjs, per link entry
+    link_conjs          Conjuncts of the entry's class that accept a link from the entry's connector
+    link_slots          Position, inside each of those conjuncts, of the connector that accepts the link
+    word_weights        Sampling weight of each word of class_words
+    conj_weights        Sampling weight of each conjunct, among those of its class
+    class_weights       Sampling weight of each class, among those a connector links to or as the sentence root
+    """
+    def __init__(self, grammar=None):
+        """
+        Compile the given Grammar object. If no grammar is given, an empty object is returned,
+        to be filled by the caller.
+        """
+        self.num_classes = 0
+        self.conn_names = []
+        self.conn_ids = {}
+        self.vocab = []
+        self.word_ids = {}
+        self.path = None  # File the arrays are mapped from, if loaded from one
+        self.metadata = {}
+        if grammar is not None:
+            self.compile(grammar)
+
+    def compile(self, grammar):
+        """
+        Intern connectors, conjuncts and words of grammar, and translate its matching index to ids
+        """
+        classes = sorted(grammar.disj_dict)
+        self.num_classes = len(classes)
+
+        # Intern connectors
+        for gram_class in classes:
+            for conj in grammar.disj_dict[gram_class]:
+                for conn in conj:
+                    self.intern_connector(conn)
+        for conn in sorted(grammar.conn_dict):  # connectors of classes that are not expanded
+            self.intern_connector(conn)
+        self.conn_dir = np.array([RIGHT if conn[-1] == '+' else LEFT for conn in self.conn_names], dtype=np.int8)
+
+        # Conjuncts are stored grouped by class
+        conj_conns = []
+        conj_offsets = [0]
+        class_conj_offsets = [0]
+        conj_ids = {}  # (class, position in disjunct) -> conjunct id
+        for gram_class in classes:
+            for pos, conj in enumerate(grammar.disj_dict[gram_class]):
+                conj_ids[(gram_class, pos)] = len(conj_offsets) - 1
+                conj_conns.extend(self.conn_ids[conn] for conn in conj)
+                conj_offsets.append(len(conj_conns))
+            class_conj_offsets.append(len(conj_offsets) - 1)
+        self.conj_conns = np.array(conj_conns, dtype=ID_TYPE)
+        self.conj_offsets = np.array(conj_offsets, dtype=ID_TYPE)
+        self.class_conj_offsets = np.array(class_conj_offsets, dtype=ID_TYPE)
+        self.conj_weights = np.array([weight for gram_class in classes for weight in
+                                      grammar.disj_weights.get(gram_class, [1] * len(grammar.disj_dict[gram_class]))],
+                                     dtype=np.float64)
+        self.class_weights = np.array([grammar.class_weights.get(gram_class, 1) for gram_class in classes],
+                                      dtype=np.float64)
+
+        # Intern words
+        class_words = []
+        class_word_offsets = [0]
+        word_weights = []
+        for gram_class in classes:
+            words = grammar.word_dict.get(gram_class, [])
+            class_words.extend(self.intern_word(word) for word in words)
+            class_word_offsets.append(len(class_words))
+            word_weights.extend(grammar.word_weights.get(gram_class, [1] * len(words)))
+        self.class_words = np.array(class_words, dtype=ID_TYPE)
+        self.class_word_offsets = np.array(class_word_offsets, dtype=ID_TYPE)
+        self.word_weights = np.array(word_weights, dtype=np.float64)
+
+        # Translate matching index
+        link_classes = []
+        link_offsets = [0]
+        link_conjs = []
+        link_slots = []
+        link_conj_offsets = [0]
+        for conn in self.conn_names:
+            accepting = grammar.accepting_conjuncts(conn)
+            for gram_class in grammar.linked_classes[conn]:
+                link_classes.append(gram_class)
+                for pos, slot in accepting.get(gram_class, ()):
+                    link_conjs.append(conj_ids[(gram_class, pos)])
+                    link_slots.append(slot)
+                link_conj_offsets.append(len(link_conjs))
+            link_offsets.append(len(link_classes))
+        self.link_classes = np.array(link_classes, dtype=ID_TYPE)
+        self.link_offsets = np.array(link_offsets, dtype=ID_TYPE)
+        self.link_conjs = np.array(link_conjs, dtype=ID_TYPE)
+        self.link_slots = np.array(link_slots, dtype=ID_TYPE)
+        self.link_conj_offsets = np.array(link_conj_offsets, dtype=ID_TYPE)
+
+    def intern_connector(self, connector):
+        """
+        Returns the id of connector string, assigning a new one if needed
+        """
+        if connector not in self.conn_ids:
+            self.conn_ids[connector] = len(self.conn_names)
+            self.conn_names.append(connector)
+        return self.conn_ids[connector]
+
+    def intern_word(self, word):
+        """
+        Returns the id of word string, assigning a new one if needed
+        """
+        if word not in self.word_ids:
+            self.word_ids[word] = len(self.vocab)
+            self.vocab.append(word)
+        return self.word_ids[word]
+
+    @property
+    def num_connectors(self):
+        return len(self.conn_names)
+
+    @property
+    def num_conjuncts(self):
+        return len(self.conj_offsets) - 1
+
+    @property
+    def num_words(self):
+        return len(self.vocab)
+
+    @property
+    def weighted(self):
+        """
+        Whether any word, conjunct or class has a sampling weight other than 1
+        """
+        return any(np.any(getattr(self, name) != 1) for name in ("word_weights", "conj_weights", "class_weights"))
+
+    def class_conjuncts(self, gram_class):
+        """
+        Returns the range of conjunct ids belonging to gram_class
+        """
+        return range(self.class_conj_offsets[gram_class], self.class_conj_offsets[gram_class + 1])
+
+    def conjunct(self, conj):
+        """
+        Returns the connector ids of conjunct conj
+        """
+        return self.conj_conns[self.conj_offsets[conj]:self.conj_offsets[conj + 1]]
+
+    def conjunct_names(self, conj):
+        """
+        Returns the connector strings of conjunct conj, as in the grammar file
+        """
+        return [self.conn_names[conn] for conn in self.conjunct(conj)]
+
+    def rule_ids(self, rule):
+        """
+        Translates a rule given as a list of connector strings into connector ids
+        """
+        return [self.conn_ids[conn] for conn in rule]
+
+    def save(self, path, metadata=None):
+        """
+        Writes the compiled grammar to a binary file, with optional JSON-serializable metadata.
+        The file is written under a temporary name and then renamed, so concurrent readers never
+        see a partial file.
+        """
+        header = {"num_classes": self.num_classes, "conn_names": self.conn_names, "vocab": self.vocab,
+                  "metadata": metadata or {}, "arrays": {}}
+        arrays = [np.ascontiguousarray(getattr(self, name)) for name in ARRAY_FIELDS]
+        # Array offsets are relative to the start of data, right after the header padded to ALIGNMENT
+        offset = 0
+        for name, array in zip(ARRAY_FIELDS, arrays):
+            header["arrays"][name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+            offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+        header_bytes = json.dumps(header).encode()
+        data_start = -(-(len(MAGIC) + 8 + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+        header_bytes += b' ' * (data_start - len(MAGIC) - 8 - len(header_bytes))
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".rangram_", dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as fc:
+                fc.write(MAGIC)
+                fc.write(len(header_bytes).to_bytes(8, "little"))
+                fc.write(header_bytes)
+                for name, array in zip(ARRAY_FIELDS, arrays):
+                    fc.seek(data_start + header["arrays"][name]["offset"])
+                    fc.write(array.tobytes())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a compiled grammar saved by save(). Arrays are memory-mapped read-only, so processes
+        loading the same file share its pages. Raises ValueError if path is not a compiled grammar.
+        """
+        with open(path, 'rb') as fc:
+            if fc.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a compiled grammar file")
+            header_size = int.from_bytes(fc.read(8), "little")
+            header = json.loads(fc.read(header_size))
+        data_start = len(MAGIC) + 8 + header_size
+
+        compiled = cls()
+        compiled.path = path
+        compiled.metadata = header["metadata"]
+        compiled.num_classes = header["num_classes"]
+        compiled.conn_names = header["conn_names"]
+        compiled.conn_ids = {conn: i for i, conn in enumerate(compiled.conn_names)}
+        compiled.vocab = header["vocab"]
+        compiled.word_ids = {word: i for i, word in enumerate(compiled.vocab)}
+        for name in ARRAY_FIELDS:
+            info = header["arrays"][name]
+            shape = tuple(info["shape"])
+            if shape[0]:
+                array = np.memmap(path, dtype=np.dtype(info["dtype"]), mode='r',
+                                  offset=data_start + info["offset"], shape=shape)
+            else:  # empty arrays can't be mapped
+                array = np.zeros(shape, dtype=np.dtype(info["dtype"]))
+            setattr(compiled, name, array)
+        return compiled
+
+    def __getstate__(self):
+        # Grammars loaded from a file are sent to other processes as their path, to map the same pages
+        if self.path is not None:
+            return {"path": self.path}
+        return self.__dict__
+
+    def __setstate__(self, state):
+        if set(state) == {"path"}:
+            state = CompiledGrammar.load(state["path"]).__dict__
+        self.__dict__.update(state)
@@ -5,8 +5,37 @@
 # ASuMa, Aug 2019
 
 import sys
+import os
 import getopt
-from sentence_generator import GrammarSampler, Grammar
+import json
+import shutil
+import hashlib
+import logging
+import random as rand
+from itertools import count, islice
+from multiprocessing import Pool
+import numpy as np
+from sentence_generator import GrammarSampler, Grammar, DerivationBudgetError, read_weights, MAX_LENGTH
+from dedup import make_dedup, load_dedup, DEDUP_BACKENDS
+from corpus_writer import CorpusWriter, ShuffledCorpusWriter
+from grammar_analysis import analyzer_for, enumerate_parses
+from length_sampler import LengthSampler, UniformSampler, parse_length_histogram, enumerate_length_parses
+from grammar_generator import generate_grammar, grammar_text, GRAMMAR_PARAMS
+from skeleton_cache import SkeletonCache
+
+CHUNK_SIZE = 1000  # Sentences drawn per generation task; each task has its own random stream
+STREAM_CHUNKS = 0  # Keys of the random streams derived from the master seed
+STREAM_SHUFFLE = 1
+STREAM_LENGTHS = 2
+STREAM_GRAMMAR = 3
+STREAM_SKELETONS = 4
+ENUMERATE_LIMIT = 10 ** 6  # Saturate mode enumerates the language if it has at most this many derivations
+ENUMERATE_FACTOR = 4  # Saturate and lengths modes don't enumerate over this many derivations per sentence requested
+STALL_LIMIT = 10 ** 5  # Saturate and lengths modes stop after this many chunk-unique draws without new sentences
+CHECKPOINT_SUFFIX = ".ckpt"
+CHECKPOINT_FORMAT = 1  # Version of the checkpoint files
+
+_worker_sampler = None  # Sampler of the current worker process
 
 
 def main(argv):
@@ -15,24 +44,89 @@ def main(argv):
 
         "Usage: corpus_generator.py -o <outfile>
                                     [-g <grammar_mode> -s <corpus_size> -i <input_grammar> 
-                                    -v <vocab_size>]"
+                                    -v <vocab_size> -l <max_length> -d <max_depth> --verbose
+                                    --workers <num_workers> --seed <seed>
+                                    --dedup <dedup_backend> --dedup_dir <dedup_dir>
+                                    --shuffle --shuffle_bucket <bucket_size> --saturate
+                                    --lengths <length_histogram> --uniform --grammar_cache <cache_dir>
+                                    --weights <weights_file>
+                                    --num_classes <num_classes> --num_relations <num_relations>
+                                    --connectors_limit <connectors_limit> --save_grammar <grammar_file>
+                                    --checkpoint <num_chunks> --resume --append <num_sentences>
+                                    --skeletons <skeleton_draws>]"
 
-        outfile             File to output resulting corpus.
+        outfile             File to output resulting corpus. Its gold-standard parses go to outfile.ull,
+                            and the offset index of both to outfile.idx (see corpus_index.py).
         [
         grammar_mode        Either "existing" or "generate". Specifies if using existing
                             grammar file (in which case it should be given via "-i") or
                             if a random grammar should be generated (default grammar parameters
                             can be altered via the corresponding flags below). (default: 'existing')
-                            TODO: implement "generate" mode
         corpus_size         Number of sentences to create for the corpus. (default: 10)
         input_grammar       File with given hand-coded grammar.
                             If "existing" mode is used, the grammar parameters are ignored 
                             since no random grammar is generated.
-        GRAMMAR PARAMS: *** TODO: NOT IMPLEMENTED YET
+        max_length          Max number of words in a sentence; longer derivations are
+                            abandoned and resampled, and dropped after 100
+                            resamples. 0 means no limit (default: 100)
+        max_depth           Max depth of a sentence's parse tree; deeper derivations are
+                            abandoned and resampled. 0 means no limit (default: 0)
+        verbose             Log every generated sentence and parse
+        workers             Number of processes generating sentences (default: 1)
+        seed                Master random seed. The same seed always produces the same
+                            corpus, whatever the number of workers (default: random)
+        dedup_backend       How to detect repeated sentences (default: 'exact'):
+                            'exact' keeps every sentence in memory; 'hash' keeps 64-bit
+                            hashes in memory (16 bytes per sentence, tiny collision risk);
+                            'disk' keeps 64-bit hashes in an on-disk index, for corpora
+                            bigger than RAM
+        dedup_dir           Directory for the 'disk' dedup index (default: temporary dir)
+        shuffle             Write corpus and ULL parses in random order (aligned with each other),
+                            instead of first-generated first, which puts simple sentences on top
+        bucket_size         Sentences per on-disk bucket of the shuffle; bounds its memory use
+                            (default: 100000)
+        saturate            corpus_size is the number of unique sentences wanted. If the grammar
+                            admits few enough derivations (up to max_length words) and no more
+                            than corpus_size sentences, the whole language is written directly by
+                            enumeration; otherwise sentences are sampled until corpus_size are
+                            unique, or no new ones appear
+        length_histogram    Number of unique sentences wanted per sentence length, as comma-separated
+                            "<length>:<count>" or "<min>-<max>:<count>" items, e.g. "3-25:100".
+                            Sentences of each length are drawn directly with that number of words
+                            (no rejection of off-length sentences), until count are unique or no
+                            new ones appear. Replaces corpus_size; max_length and max_depth are ignored
+        uniform             Draw parse trees uniformly at random among all derivations (words included)
+                            of at most max_length words, or of each length of length_histogram, instead
+                            of choosing uniformly at each step, which favours short, simple derivations.
+                            Needs max_length for recursive grammars, whose derivations are then mostly
+                            close to max_length words long
+        cache_dir           Directory of compiled grammar files. The input grammar is loaded from its compiled
+                            file there, skipping parsing, or parsed and saved there for later runs
+        weights_file        JSON file of sampling weights of words, disjuncts and classes (see read_weights() in
+                            sentence_generator.py), overriding the "%weights" annotations of the input grammar.
+                            Draws follow the weights, except those of classes and disjuncts in length_histogram
+                            runs, and all of them with uniform
+        GRAMMAR PARAMS (see grammar_generator.py); the grammar is drawn from the master seed:
         vocab_size          Size of vocabulary for generated grammar [default: 20]
-        num_classes         Number of grammatical classes in generated grammar [default: 4]
-        num_relations       Max number of relations to create between grammatical classes [def: 7]
-        connectors_limit    Max number of connectors allowed per word [deault: 2]
+        num_classes         Number of grammatical classes in generated grammar [default: 8]
+        num_relations       Max number of relations to create between grammatical classes [default: 20]
+        connectors_limit    Max number of connectors in a conjunct [default: 3]
+        grammar_file        File to save the generated grammar to, in Link Grammar format
+        CHECKPOINTS (only when sampling, without shuffle, saturate or length_histogram):
+        num_chunks          Checkpoint the run to outfile.ckpt every num_chunks chunks of draws, and when done:
+                            the position in the random streams, the dedup index (in outfile.ckpt-*.dedup, or
+                            in dedup_dir, by default outfile.dedup, for 'disk') and the number of sentences
+        resume              Go on with the checkpointed run of outfile after its last checkpoint, with the
+                            options it was started with; other options but workers and cache_dir are ignored
+        num_sentences       Append num_sentences new unique sentences to the checkpointed corpus outfile,
+                            drawn further along its random streams, without reading the corpus again
+        SKELETONS (only when sampling, without uniform, saturate, length_histogram or checkpoints):
+        skeleton_draws      Draw corpus_size sentences from a cache of class-level derivations (skeletons),
+                            filled with words in vectorized batches, instead of deriving every sentence.
+                            The cache holds every skeleton, with its exact probability, if the grammar has
+                            at most 10^6 of them (up to max_length words) and no class or disjunct weights;
+                            otherwise it holds the skeletons of skeleton_draws sampled derivations, with
+                            their frequencies. Uses a single process
         ]
     """
 
@@ -41,22 +135,59 @@ def main(argv):
     input_grammar = ''
     grammar_mode = 'existing'
     corpus_size = 10
+    max_length = MAX_LENGTH
+    max_depth = None
+    workers = 1
+    seed = None
+    dedup = 'exact'
+    dedup_dir = None
+    shuffle = False
+    shuffle_bucket = 100000
+    saturate = False
+    lengths = None
+    uniform = False
+    grammar_cache = None
+    weights_file = None
+    grammar_params = {}
+    save_grammar = None
+    checkpoint = None
+    resume = False
+    append = None
+    skeletons = None
 
+    usage = '''Usage: corpus_generator.py -o <outfile>
+                            [-g <grammar_mode> -s <corpus_size> -i <input_grammar>
+                            -v <vocab_size> -l <max_length> -d <max_depth> --verbose
+                            --workers <num_workers> --seed <seed>
+                            --dedup <dedup_backend> --dedup_dir <dedup_dir>
+                            --shuffle --shuffle_bucket <bucket_size> --saturate
+                            --lengths <length_histogram> --uniform --grammar_cache <cache_dir>
+                            --weights <weights_file>
+                            --num_classes <num_classes> --num_relations <num_relations>
+                            --connectors_limit <connectors_limit> --save_grammar <grammar_file>
+                            --checkpoint <num_chunks> --resume --append <num_sentences>
+                            --skeletons <skeleton_draws>]'''
     try:
-        opts, args = getopt.getopt(argv, "hg:s:o:i:", ["grammar_mode=",
-                                                       "corpus_size=", "outfile=", "input_grammar="])
+        opts, args = getopt.getopt(argv, "hg:s:o:i:l:d:v:", ["grammar_mode=", "corpus_size=", "outfile=",
+                                                             "input_grammar=", "max_length=", "max_depth=",
+                                                             "verbose", "workers=", "seed=", "dedup=",
+                                                             "dedup_dir=", "shuffle", "shuffle_bucket=",
+                                                             "saturate", "lengths=", "uniform",
+                                                             "grammar_cache=", "weights=", "vocab_size=",
+                                                             "num_classes=",
+                                                             "num_relations=", "connectors_limit=",
+                                                             "save_grammar=", "checkpoint=", "resume",
+                                                             "append=", "skeletons="])
     except getopt.GetoptError:
-        print('''Usage: corpus_generator.py -o <outfile>
-                                    [-g <grammar_mode> -s <corpus_size> -i <input_grammar> -v <vocab_size>]''')
+        print(usage)
         sys.exit(2)
     for opt, arg in opts:
         if opt == '-h':
-            print('''Usage: corpus_generator.py -o <outfile>
-                                        [-g <grammar_mode> -s <corpus_size> -i <input_grammar> -v <vocab_size>]''')
+            print(usage)
             sys.exit()
         elif opt in ("-g", "--grammar_mode"):
-            if opt != "existing":
-                raise getopt.GetoptError("Only 'existing' mode is currently implemented")
+            if arg not in ("existing", "generate"):
+                raise getopt.GetoptError("Grammar mode must be 'existing' or 'generate'")
             grammar_mode = arg
         elif opt in ("-s", "--corpus_size"):
             corpus_size = int(arg)
@@ -64,33 +195,516 @@ def main(argv):
             outfile = arg
         elif opt in ("-i", "--input_grammar"):
             input_grammar = arg
+        elif opt in ("-l", "--max_length"):
+            max_length = int(arg) or None
+        elif opt in ("-d", "--max_depth"):
+            max_depth = int(arg) or None
+        elif opt == "--verbose":
+            logging.basicConfig(level=logging.DEBUG, format="%(message)s")
+        elif opt == "--workers":
+            workers = int(arg)
+        elif opt == "--seed":
+            seed = int(arg)
+        elif opt == "--dedup":
+            if arg not in DEDUP_BACKENDS:
+                raise getopt.GetoptError(f"Dedup backend must be one of {DEDUP_BACKENDS}")
+            dedup = arg
+        elif opt == "--dedup_dir":
+            dedup_dir = arg
+        elif opt == "--shuffle":
+            shuffle = True
+        elif opt == "--shuffle_bucket":
+            shuffle_bucket = int(arg)
+        elif opt == "--saturate":
+            saturate = True
+        elif opt == "--lengths":
+            try:
+                lengths = parse_length_histogram(arg)
+            except ValueError:
+                raise getopt.GetoptError(f"Invalid length histogram '{arg}'")
+        elif opt == "--uniform":
+            uniform = True
+        elif opt == "--grammar_cache":
+            grammar_cache = arg
+        elif opt == "--weights":
+            weights_file = arg
+        elif opt in ("-v", "--vocab_size"):
+            grammar_params["num_words"] = int(arg)
+        elif opt == "--num_classes":
+            grammar_params["num_classes"] = int(arg)
+        elif opt == "--num_relations":
+            grammar_params["num_class_connectors"] = int(arg)
+        elif opt == "--connectors_limit":
+            grammar_params["connectors_limit"] = int(arg)
+        elif opt == "--save_grammar":
+            save_grammar = arg
+        elif opt == "--checkpoint":
+            checkpoint = int(arg)
+        elif opt == "--resume":
+            resume = True
+        elif opt == "--append":
+            append = int(arg)
+        elif opt == "--skeletons":
+            skeletons = int(arg)
+
+    if resume or append is not None:
+        try:
+            resume_corpus(outfile, append, workers=workers, grammar_cache=grammar_cache)
+        except DerivationBudgetError as error:
+            print(f"ERROR: {error}")
+            sys.exit(1)
+        return
 
     # Check input grammar file was specified
-    if input_grammar == '':
+    if grammar_mode == 'existing' and input_grammar == '':
         raise getopt.GetoptError("No grammar file specified")
 
-    generate_corpus(grammar_mode, corpus_size, outfile, input_grammar)
+    try:
+        generate_corpus(grammar_mode, corpus_size, outfile, input_grammar, max_length=max_length,
+                        max_depth=max_depth, workers=workers, seed=seed, dedup=dedup, dedup_dir=dedup_dir,
+                        shuffle=shuffle, shuffle_bucket=shuffle_bucket, saturate=saturate, lengths=lengths,
+                        uniform=uniform, grammar_cache=grammar_cache, grammar_params=grammar_params,
+                        save_grammar=save_grammar, checkpoint=checkpoint, weights_file=weights_file,
+                        skeletons=skeletons)
+    except DerivationBudgetError as error:
+        print(f"ERROR: {error}")
+        sys.exit(1)
+
+
+def generate_corpus(grammar_mode: str, corpus_size: int, outfile: str, input_grammar: str,
+                    max_length: int = MAX_LENGTH, max_depth: int = None, workers: int = 1, seed: int = None,
+                    dedup: str = 'exact', dedup_dir: str = None, shuffle: bool = False,
+                    shuffle_bucket: int = 100000, saturate: bool = False, lengths: list = None,
+                    uniform: bool = False, grammar_cache: str = None, grammar_params: dict = None,
+                    save_grammar: str = None, checkpoint: int = None, weights_file: str = None,
+                    skeletons: int = None):
+    """
+    Corpus generator. Uses class GrammarSampler in sentence_generator.py, or LengthSampler
+    when lengths, a list of (length, number of sentences) pairs, is given. If uniform, trees are
+    drawn uniformly with UniformSampler, or LengthSampler following lexical counts.
+    In "generate" grammar_mode, the grammar is drawn by generate_grammar() with grammar_params,
+    instead of read from input_grammar, and written to save_grammar if given. Sampling weights are read
+    from the grammar's annotations and weights_file, if given.
+    If checkpoint is given, the run is checkpointed every checkpoint chunks (see extend_corpus()),
+    so that resume_corpus() can resume or extend it.
+    If skeletons is given, sentences are drawn from a skeleton cache (see skeleton_parses()).
+    """
+
+    if checkpoint is not None and (shuffle or saturate or lengths is not None):
+        raise ValueError("Checkpoints are only supported when sampling, without shuffle, saturate or lengths")
+    if skeletons is not None and (uniform or saturate or lengths is not None or checkpoint is not None):
+        raise ValueError("Skeletons are only supported when sampling, without uniform, saturate, lengths "
+                         "or checkpoints")
+    remove_checkpoint(outfile)  # the corpus it was taken from is overwritten
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+        print(f"Using random seed {seed}")
+    if grammar_mode == 'generate':
+        grammar_params = {**GRAMMAR_PARAMS, **(grammar_params or {})}
+    grammar = make_grammar(grammar_mode, input_grammar, seed, grammar_params, grammar_cache, weights_file)
+    if grammar_mode == 'generate' and save_grammar:
+        with open(save_grammar, 'w') as fo:
+            fo.write(grammar_text(grammar, grammar_params))
+    sampler_args = {"max_length": max_length, "max_depth": max_depth}
+    if checkpoint is not None and dedup == 'disk' and dedup_dir is None:
+        dedup_dir = outfile + ".dedup"  # kept with the checkpoints
+        shutil.rmtree(dedup_dir, ignore_errors=True)
+    sentences = make_dedup(dedup, dedup_dir)  # keeps track of unique sentences
+    dropped = []  # draws dropped by each chunk for exceeding the derivation budgets
+    if lengths is not None:
+        corpus_size = sum(number for length, number in lengths)
+
+    if shuffle:
+        writer = ShuffledCorpusWriter(outfile, stream_rng(seed, STREAM_SHUFFLE), corpus_size, shuffle_bucket)
+    else:
+        writer = CorpusWriter(outfile)
+
+    with writer:
+        if lengths is not None:
+            counts = analyzer_for(grammar).count_by_length(lengths[-1][0])
+            analyzer = analyzer_for(grammar, lexical=uniform)
+            for length, number in lengths:
+                if not counts[length]:
+                    print(f"Grammar has no sentences of {length} words, skipping")
+                    continue
+                parses = length_parses(grammar, length, number, seed, workers, analyzer)
+                # There can't be more distinct sentences than derivations
+                written = write_unique(parses, sentences, writer, min(number, counts[length]))
+                if written < number:
+                    print(f"Only {written} unique sentences of {length} words were found, out of {number} requested")
+        elif saturate:
+            write_unique(saturate_parses(grammar, corpus_size, seed, workers, sampler_args, uniform, dropped),
+                         sentences, writer, corpus_size)
+        elif checkpoint is not None:
+            # Absolute paths, so that the run can be resumed from any directory
+            input_path = os.path.abspath(input_grammar) if grammar_mode != 'generate' else None
+            weights_path = os.path.abspath(weights_file) if weights_file is not None else None
+            run = {"format": CHECKPOINT_FORMAT, "seed": seed, "grammar_mode": grammar_mode,
+                   "input_grammar": input_path, "weights_file": weights_path,
+                   "grammar_hash": grammar_hash(input_path, weights_path), "grammar_params": grammar_params,
+                   "sampler_args": sampler_args,
+                   "uniform": uniform, "dedup": dedup, "draws": corpus_size, "target": None,
+                   "checkpoint": checkpoint, "chunk": 0, "skip": 0, "stalled": 0}
+            extend_corpus(outfile, grammar, run, sentences, writer, workers, dropped)
+        elif skeletons is not None:
+            write_unique(skeleton_parses(grammar, corpus_size, seed, skeletons, sampler_args), sentences, writer)
+        else:
+            chunks = sample_chunks(grammar, corpus_size, seed, workers, sampler_args,
+                                   analyzer=analyzer_for(grammar) if uniform else None, dropped=dropped)
+            for parses in chunks:  # deduplicated a chunk at a time, which the hash backend vectorizes
+                for (sentence, parse), new in zip(parses, sentences.add_batch([sentence for sentence, _ in parses])):
+                    if new:
+                        writer.write(sentence, parse)
+    report_dropped(dropped, sampler_args)
+    print(f"Generated {writer.num_sentences} unique sentences, out of {corpus_size} requested")
+    print(sentences.report() + "\n")
+    sentences.close()
+
+
+def make_grammar(grammar_mode: str, input_grammar: str, seed: int, grammar_params: dict = None,
+                 grammar_cache: str = None, weights_file: str = None):
+    """
+    Returns the grammar of a run: drawn from seed with grammar_params in "generate" grammar_mode, else read
+    from input_grammar; with the sampling weights of weights_file, if given
+    """
+    if grammar_mode == 'generate':
+        weights = read_weights(weights_file) if weights_file is not None else None
+        return generate_grammar(**grammar_params, seed=np.random.SeedSequence(seed, spawn_key=(STREAM_GRAMMAR,)),
+                                weights=weights)
+    return Grammar(input_grammar, cache_dir=grammar_cache, weights_file=weights_file)
+
+
+def grammar_hash(input_grammar: str = None, weights_file: str = None):
+    """
+    Returns the SHA-256 hex digest of the contents of the grammar and weights files of a run, given or not
+    """
+    key = hashlib.sha256()
+    for path in (input_grammar, weights_file):
+        if path is not None:
+            with open(path, 'rb') as fi:
+                key.update(fi.read())
+        key.update(b"\0")
+    return key.hexdigest()
 
 
-def generate_corpus(grammar_mode: str, corpus_size: int, outfile: str, input_grammar: str):
+def resume_corpus(outfile: str, append: int = None, workers: int = 1, grammar_cache: str = None):
     """
-    Corpus generator. Uses class GrammarSampler in sentence_generator.py
+    Goes on with the checkpointed run of outfile after its last checkpoint: sentences written after it
+    are dropped and drawn again, so the corpus ends up as if the run had not stopped. If append is given,
+    the run instead goes on until append more unique sentences are written after the checkpointed ones.
     """
+    checkpoint_file = outfile + CHECKPOINT_SUFFIX
+    if not os.path.exists(checkpoint_file):
+        raise ValueError(f"{outfile} has no checkpoint, generate it with checkpoints to resume or extend it")
+    with open(checkpoint_file, 'r') as fc:
+        run = json.load(fc)
+    if run["format"] != CHECKPOINT_FORMAT:
+        raise ValueError(f"{checkpoint_file} was written by an incompatible version of corpus_generator")
+    digest = grammar_hash(run["input_grammar"], run.get("weights_file"))
+    if run.get("grammar_hash", digest) != digest:
+        raise ValueError(f"The grammar or weights file of {outfile} changed since it was generated, "
+                         "it can't be resumed")
+    grammar = make_grammar(run["grammar_mode"], run["input_grammar"], run["seed"], run["grammar_params"],
+                           grammar_cache, run.get("weights_file"))
+    sentences = load_dedup(run["dedup"], os.path.join(os.path.dirname(checkpoint_file), run["dedup_state"]))
+    if append is not None:
+        run["target"] = run["sentences"] + append
+        run["stalled"] = 0
+    print(f"Resuming {outfile} after {run['sentences']} sentences")
+    dropped = []
+    with CorpusWriter(outfile, keep=run["sentences"]) as writer:
+        extend_corpus(outfile, grammar, run, sentences, writer, workers, dropped)
+        report_dropped(dropped, run["sampler_args"])
+        print(f"{outfile} has {writer.num_sentences} unique sentences")
+    print(sentences.report() + "\n")
+    sentences.close()
 
-    grammar = Grammar(input_grammar)
-    sampler = GrammarSampler(grammar)
-    sentences = set()  # keeps unique sentences
 
-    with open(outfile, 'w') as fcorpus:
-        with open(outfile + ".ull", 'w') as fparses:
-            for counter in range(0, corpus_size):
-                sentence, parse = sampler.generate_parse()
-                if sentence not in sentences:
-                    sentences.add(sentence)
-                    fcorpus.write(sentence + '\n')
-                    fparses.write(sentence + '\n')
-                    fparses.write(parse + '\n\n')
-    print(f"Generated {len(sentences)} unique sentences, out of {corpus_size} requested\n")
+def extend_corpus(outfile: str, grammar, run: dict, sentences, writer, workers: int = 1, dropped: list = None):
+    """
+    Writes the new sentences of the sampling streams of run (a dictionary of the options of a checkpointed
+    run and of its state), from its position on: chunk run["chunk"], after its first run["skip"] parses.
+    The run takes run["draws"] draws in total, or goes on until the corpus has run["target"] sentences if
+    that is given. It is checkpointed every run["checkpoint"] chunks, and when done.
+    Draws dropped for exceeding the derivation budgets are counted in dropped (see sample_chunks()).
+    """
+    target = run["target"]
+    draws = run["draws"] if target is None else None
+    analyzer = analyzer_for(grammar) if run["uniform"] else None
+    chunks = sample_chunks(grammar, draws, run["seed"], workers, run["sampler_args"], analyzer=analyzer,
+                           first_chunk=run["chunk"], dropped=dropped)
+    done = target is not None and (writer.num_sentences >= target or run["stalled"] == STALL_LIMIT)
+    since_checkpoint = 0
+    for chunk, parses in enumerate(chunks if not done else [], run["chunk"]):
+        position = run["skip"] if chunk == run["chunk"] else 0
+        while position < len(parses) and not done:
+            sentence, parse = parses[position]
+            position += 1
+            if sentences.add(sentence):
+                writer.write(sentence, parse)
+                run["stalled"] = 0
+            else:
+                run["stalled"] += 1
+            if target is not None:
+                done = writer.num_sentences == target or run["stalled"] == STALL_LIMIT
+        # A chunk is only done with once all of its CHUNK_SIZE draws are used
+        chunk_draws = CHUNK_SIZE if draws is None else min(CHUNK_SIZE, draws - chunk * CHUNK_SIZE)
+        if position == len(parses) and chunk_draws == CHUNK_SIZE:
+            run["chunk"], run["skip"] = chunk + 1, 0
+        else:
+            run["chunk"], run["skip"] = chunk, position
+        since_checkpoint += 1
+        if done:
+            break
+        if since_checkpoint == run["checkpoint"]:
+            save_checkpoint(outfile, run, sentences, writer)
+            since_checkpoint = 0
+    if target is not None and run["stalled"] == STALL_LIMIT:
+        print(f"No new sentences in {STALL_LIMIT} draws, stopping")
+    save_checkpoint(outfile, run, sentences, writer)
+
+
+def save_checkpoint(outfile: str, run: dict, sentences, writer):
+    """
+    Saves the state of run to outfile.ckpt, once the corpus written so far and the dedup index are on disk.
+    The checkpoint file is replaced atomically, so it always describes a consistent state.
+    """
+    writer.flush()
+    state_file = f"{outfile}{CHECKPOINT_SUFFIX}-{writer.num_sentences}.dedup"
+    sentences.save(state_file + ".tmp")
+    os.replace(state_file + ".tmp", state_file)
+    previous = run.get("dedup_state")
+    run.update(sentences=writer.num_sentences, dedup_state=os.path.basename(state_file))
+    with open(outfile + CHECKPOINT_SUFFIX + ".tmp", 'w') as fc:
+        json.dump(run, fc, indent=2)
+    os.replace(outfile + CHECKPOINT_SUFFIX + ".tmp", outfile + CHECKPOINT_SUFFIX)
+    if previous is not None and previous != run["dedup_state"]:
+        os.remove(os.path.join(os.path.dirname(state_file), previous))
+
+
+def remove_checkpoint(outfile: str):
+    """
+    Removes the checkpoint of outfile, and its dedup state, if any
+    """
+    checkpoint_file = outfile + CHECKPOINT_SUFFIX
+    if os.path.exists(checkpoint_file):
+        with open(checkpoint_file, 'r') as fc:
+            state_file = os.path.join(os.path.dirname(checkpoint_file), json.load(fc)["dedup_state"])
+        if os.path.exists(state_file):
+            os.remove(state_file)
+        os.remove(checkpoint_file)
+
+
+def report_dropped(dropped: list, sampler_args: dict):
+    """
+    Warns about the draws dropped for exceeding the derivation budgets of sampler_args, if any
+    """
+    if sum(dropped):
+        print(f"Dropped {sum(dropped)} draws whose derivations exceeded the budgets ({budgets_text(sampler_args)})")
+
+
+def budgets_text(sampler_args: dict):
+    """
+    Text of the derivation budgets set in sampler_args, e.g. "max_length 100"
+    """
+    return ", ".join(f"{name} {value}" for name, value in (sampler_args or {}).items() if value is not None)
+
+
+def write_unique(parses, sentences, writer, wanted: int = None):
+    """
+    Writes the parses whose sentences are new to the sentences dedup object, and returns their number.
+    If wanted is given, stops once that many are written, or after STALL_LIMIT draws without a new sentence.
+    """
+    written = 0
+    stalled = 0  # draws since the last new sentence
+    for sentence, parse in parses:
+        if sentences.add(sentence):
+            writer.write(sentence, parse)
+            written += 1
+            stalled = 0
+            if written == wanted:
+                break
+        elif wanted is not None:
+            stalled += 1
+            if stalled == STALL_LIMIT:
+                print(f"No new sentences in {STALL_LIMIT} draws, stopping")
+                break
+    return written
+
+
+def saturate_parses(grammar, corpus_size: int, seed: int, workers: int = 1, sampler_args: dict = None,
+                    uniform: bool = False, dropped: list = None):
+    """
+    If grammar has at most ENUMERATE_FACTOR times corpus_size derivations (up to the sampler's max_length,
+    and at most ENUMERATE_LIMIT) and at most corpus_size distinct sentences, returns the whole language by
+    enumeration. Otherwise returns an endless stream of sampled parses (uniform over derivations if
+    uniform), to draw a random subset of the language from, counting dropped draws in dropped.
+    """
+    analyzer = analyzer_for(grammar)
+    max_length = sampler_args.get("max_length")
+    limit = min(ENUMERATE_LIMIT, ENUMERATE_FACTOR * corpus_size)
+    num_derivations = analyzer.count_derivations(max_length, limit)
+    if num_derivations <= limit:
+        language = {}
+        for sentence, parse in enumerate_parses(grammar, max_length):
+            language.setdefault(sentence, parse)
+        if len(language) <= corpus_size:
+            print(f"Grammar admits {len(language)} distinct sentences, writing all of them")
+            return iter(language.items())
+        print(f"Grammar admits {len(language)} distinct sentences, sampling {corpus_size} of them")
+    else:
+        print(f"Grammar has over {limit} derivations, sampling")
+    return sample_parses(grammar, None, seed, workers, sampler_args, analyzer=analyzer if uniform else None,
+                         dropped=dropped)
+
+
+def skeleton_parses(grammar, num_draws: int, seed: int, skeleton_draws: int, sampler_args: dict = None):
+    """
+    Draws num_draws (sentence, parse) pairs from a SkeletonCache of grammar, in batches of CHUNK_SIZE.
+    If grammar has at most ENUMERATE_LIMIT class-level derivations (up to the sampler's max_length) and no
+    class or disjunct weights, the cache holds all of them with their exact probabilities, so sentences
+    follow the same distribution as GrammarSampler's. Otherwise, it holds the skeletons of skeleton_draws
+    derivations sampled from the stream (seed, STREAM_SKELETONS, 0), with their frequencies.
+    Skeletons and words are drawn from the stream (seed, STREAM_SKELETONS, 1).
+    """
+    sampler_args = sampler_args or {}
+    max_length = sampler_args.get("max_length")
+    cache = SkeletonCache(grammar)
+    cg = grammar.compiled
+    weighted = np.any(cg.conj_weights != 1) or np.any(cg.class_weights != 1)
+    if not weighted and analyzer_for(grammar, lexical=False).count_derivations(max_length, ENUMERATE_LIMIT) \
+            <= ENUMERATE_LIMIT:
+        cache.enumerate(max_length)
+        print(f"Grammar has {len(cache)} skeletons")
+    else:
+        cache.sample(GrammarSampler(grammar, rng=stream_rng(seed, STREAM_SKELETONS, 0), **sampler_args),
+                     skeleton_draws)
+        print(f"Sampled {len(cache)} distinct skeletons out of {skeleton_draws} draws")
+    if not len(cache):
+        raise DerivationBudgetError(f"No skeleton fits in the derivation budgets ({budgets_text(sampler_args)}), "
+                                    f"raise them to sample this grammar")
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(STREAM_SKELETONS, 1)))
+    for start in range(0, num_draws, CHUNK_SIZE):
+        batch = cache.draw(min(CHUNK_SIZE, num_draws - start), rng)
+        for index in range(len(batch)):
+            yield batch.parse(index)
+
+
+def length_parses(grammar, length: int, number: int, seed: int, workers: int = 1, analyzer=None):
+    """
+    Like saturate_parses(), for sentences of exactly length words: if there are at most ENUMERATE_FACTOR
+    times number derivations of that length, enumerates them, and returns all their sentences if there
+    are at most number of them. Otherwise returns an endless stream of parses of that length sampled
+    following the counts of analyzer.
+    """
+    if analyzer_for(grammar).count_by_length(length)[length] <= min(ENUMERATE_LIMIT, ENUMERATE_FACTOR * number):
+        language = {}
+        for sentence, parse in enumerate_length_parses(grammar, length):
+            language.setdefault(sentence, parse)
+        if len(language) <= number:
+            return iter(language.items())
+    return sample_parses(grammar, None, seed, workers, length=length, analyzer=analyzer)
+
+
+def sample_parses(grammar, num_draws: int, seed: int, workers: int = 1, sampler_args: dict = None,
+                  length: int = None, analyzer=None, dropped: list = None):
+    """
+    Draws num_draws (sentence, parse) pairs from grammar (endlessly if None), split in chunks of
+    CHUNK_SIZE draws. Chunk k draws from its own random stream, derived from (seed, k), and chunks
+    are yielded in order, so the result only depends on seed, not on the number of workers.
+    Repeated sentences inside a chunk are dropped by the worker.
+    If length is given, all sentences have that number of words, drawn with a LengthSampler
+    from the streams derived from (seed, length, k). Otherwise, if a GrammarAnalyzer with lexical
+    counts is given, trees are drawn uniformly with a UniformSampler.
+    Count tables are computed once here, and shipped to the workers with the grammar.
+    Draws that exceed the derivation budgets are dropped, and counted in dropped (see sample_chunks()).
+    """
+    for parses in sample_chunks(grammar, num_draws, seed, workers, sampler_args, length, analyzer,
+                                dropped=dropped):
+        yield from parses
+
+
+def sample_chunks(grammar, num_draws: int, seed: int, workers: int = 1, sampler_args: dict = None,
+                  length: int = None, analyzer=None, first_chunk: int = 0, dropped: list = None):
+    """
+    Like sample_parses(), but yields the list of parses of each chunk, from chunk first_chunk on.
+    Draws whose derivations still exceed the sampler's budgets after all its resamples are dropped,
+    and the number dropped by each chunk is appended to dropped, if given. Raises DerivationBudgetError
+    if a chunk has no parses before any chunk had one, i.e. if no derivation seems to fit in the budgets.
+    """
+    stream = (STREAM_CHUNKS,) if length is None else (STREAM_LENGTHS, length)
+    if num_draws is None:
+        tasks = ((seed, stream + (chunk,), CHUNK_SIZE) for chunk in count(first_chunk))
+    else:
+        tasks = ((seed, stream + (chunk,), min(CHUNK_SIZE, num_draws - chunk * CHUNK_SIZE))
+                 for chunk in range(first_chunk, (num_draws + CHUNK_SIZE - 1) // CHUNK_SIZE))
+
+    def results():
+        _init_worker(grammar, sampler_args, length, analyzer)  # also fills the count tables
+        if workers > 1:
+            with Pool(workers, initializer=_init_worker, initargs=(grammar, sampler_args, length, analyzer)) as pool:
+                # Submit a few tasks per worker at a time, so endless streams don't queue unbounded work
+                while True:
+                    batch = list(islice(tasks, 4 * workers))
+                    if not batch:
+                        break
+                    yield from pool.imap(_sample_chunk, batch)
+        else:
+            for task in tasks:
+                yield _sample_chunk(task)
+
+    fitted = False  # whether any draw fitted in the budgets
+    for parses, failed in results():
+        if dropped is not None:
+            dropped.append(failed)
+        if not parses and not fitted:
+            raise DerivationBudgetError(f"None of {failed} draws fits in the derivation budgets "
+                                        f"({budgets_text(sampler_args)}), raise them to sample this grammar")
+        fitted = True
+        yield parses
+
+
+def stream_rng(seed: int, *key: int):
+    """
+    Returns the random generator of the stream identified by key, independent from all
+    other streams derived from the master seed
+    """
+    state = np.random.SeedSequence(seed, spawn_key=key).generate_state(4)
+    return rand.Random(int.from_bytes(state.tobytes(), "little"))
+
+
+def _init_worker(grammar, sampler_args, length=None, analyzer=None):
+    global _worker_sampler
+    sampler_args = sampler_args or {}
+    if length is not None:
+        _worker_sampler = LengthSampler(grammar, length, analyzer)
+        _worker_sampler.analyzer.extend(length)
+    elif analyzer is not None:
+        _worker_sampler = UniformSampler(grammar, sampler_args.get("max_length"), analyzer=analyzer)
+    else:
+        _worker_sampler = GrammarSampler(grammar, **sampler_args)
+
+
+def _sample_chunk(task):
+    """
+    Generation task run by workers: draws a chunk of parses, without repeated sentences.
+    Returns them with the number of draws dropped for exceeding the derivation budgets.
+    """
+    seed, stream, num_draws = task
+    _worker_sampler.rng = stream_rng(seed, *stream)
+    seen = set()
+    parses = []
+    failed = 0
+    for _ in range(num_draws):
+        try:
+            sentence, parse = _worker_sampler.generate_parse()
+        except DerivationBudgetError:
+            failed += 1
+            continue
+        if sentence not in seen:
+            seen.add(sentence)
+            parses.append((sentence, parse))
+    return parses, failed
 
 
 if __name__ == "__main__":
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Random access to a corpus and its gold-standard parses, kept aligned by an offset index
+# written by CorpusWriter next to them (<corpus>.idx): a header, then the byte offsets
+# (uint64 pairs) where each sentence starts in the corpus file and its record in the ULL
+# file, and a last pair with the sizes of both files.
+
+import sys
+import os
+import getopt
+import numpy as np
+
+INDEX_MAGIC = b"RGIDX\x00\x00\x01"
+INDEX_SUFFIX = ".idx"
+SCAN_BLOCK = 1 << 26  # Bytes scanned at once when building an index from existing files
+NEWLINE = ord('\n')
+
+
+def main(argv):
+    """
+        Corpus_index builds the offset index of a corpus written without one, or writes a subset of an indexed corpus.
+
+        "Usage: corpus_index.py -i <corpus_file> [-o <subset_file> --start <start> --stop <stop>
+                                --sample <sample_size> --seed <seed>]"
+
+        corpus_file         Corpus, with its gold standard in <corpus_file>.ull. Its index is built if missing.
+        subset_file         File to write the subset to (with its .ull and .idx files); the subset
+                            is the sentences from start (default: 0) to stop (default: end), or a
+                            random sample of sample_size of them if given, in corpus order
+    """
+    corpus_file = ''
+    subset_file = None
+    start = 0
+    stop = None
+    sample_size = None
+    seed = None
+
+    usage = '''Usage: corpus_index.py -i <corpus_file> [-o <subset_file> --start <start> --stop <stop>
+                                --sample <sample_size> --seed <seed>]'''
+    try:
+        opts, args = getopt.getopt(argv, "hi:o:", ["input=", "outfile=", "start=", "stop=", "sample=", "seed="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-i", "--input"):
+            corpus_file = arg
+        elif opt in ("-o", "--outfile"):
+            subset_file = arg
+        elif opt == "--start":
+            start = int(arg)
+        elif opt == "--stop":
+            stop = int(arg)
+        elif opt == "--sample":
+            sample_size = int(arg)
+        elif opt == "--seed":
+            seed = int(arg)
+
+    if corpus_file == '':
+        raise getopt.GetoptError("No corpus file specified")
+
+    if not os.path.exists(corpus_file + INDEX_SUFFIX):
+        build_index(corpus_file)
+    corpus = IndexedCorpus(corpus_file)
+    print(f"{corpus_file} has {len(corpus)} sentences")
+    if subset_file is not None:
+        if sample_size is not None:
+            indexes = corpus.sample(sample_size, np.random.default_rng(seed))
+        else:
+            indexes = range(*slice(start, stop).indices(len(corpus)))
+        corpus.write_subset(indexes, subset_file)
+        print(f"Wrote {len(indexes)} sentences to {subset_file}")
+
+
+def write_index(index_file, offsets):
+    """
+    Writes an index file from an array of (corpus offset, ULL offset) rows
+    """
+    with open(index_file, 'wb') as fo:
+        fo.write(INDEX_MAGIC)
+        fo.write(np.asarray(offsets, dtype='<u8').tobytes())
+
+
+def read_offsets(index_file, index):
+    """
+    Returns the (corpus, ULL) offsets of record index in index_file; those of the record after the
+    last one are the sizes of the files
+    """
+    offsets = np.fromfile(index_file, dtype='<u8', count=2, offset=len(INDEX_MAGIC) + 16 * index)
+    if len(offsets) < 2:
+        raise ValueError(f"{index_file} has no record {index}")
+    return int(offsets[0]), int(offsets[1])
+
+
+def build_index(corpus_file):
+    """
+    Builds the index of a corpus (one sentence per line) and its ULL file, e.g. written before indexes existed
+    """
+    corpus_starts = _scan_starts(corpus_file, 1)
+    ull_starts = _scan_starts(corpus_file + ".ull", 2)
+    if len(corpus_starts) != len(ull_starts):
+        raise ValueError(f"{corpus_file} has {len(corpus_starts) - 1} sentences, "
+                         f"but its ULL file has {len(ull_starts) - 1}")
+    write_index(corpus_file + INDEX_SUFFIX, np.column_stack((corpus_starts, ull_starts)))
+
+
+def _scan_starts(path, newlines):
+    """
+    Returns the offsets of the non-blank lines of file path that follow newlines line ends (or the
+    file start), i.e. start a record, and the file size. Scans the file by blocks.
+    """
+    size = os.path.getsize(path)
+    if not size:
+        return np.zeros(1, dtype=np.uint64)
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+    starts = []
+    for begin in range(0, size, SCAN_BLOCK):
+        end = min(begin + SCAN_BLOCK, size)
+        # Line ends from newlines bytes before the block on; the file start counts as line ends
+        line_ends = data[max(begin - newlines, 0):end] == NEWLINE
+        line_ends = np.concatenate((np.ones(newlines - min(begin, newlines), dtype=bool), line_ends))
+        start = ~line_ends[newlines:]  # non-blank
+        for back in range(1, newlines + 1):
+            start &= line_ends[newlines - back:newlines - back + end - begin]
+        starts.append(np.flatnonzero(start) + begin)
+    return np.concatenate(starts + [np.array([size])]).astype(np.uint64)
+
+
+class IndexedCorpus:
+    """
+    Memory-mapped corpus and ULL files with their offset index, giving any sentence and its parse,
+    or any subset of them, without reading the rest of the files
+    """
+    def __init__(self, corpus_file):
+        self.corpus_file = corpus_file
+        with open(corpus_file + INDEX_SUFFIX, 'rb') as fi:
+            if fi.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                raise ValueError(f"{corpus_file + INDEX_SUFFIX} is not a corpus index")
+        self.offsets = np.memmap(corpus_file + INDEX_SUFFIX, dtype='<u8', mode='r',
+                                 offset=len(INDEX_MAGIC)).reshape(-1, 2)
+        self.corpus = self._map(corpus_file, self.offsets[-1, 0])
+        self.ull = self._map(corpus_file + ".ull", self.offsets[-1, 1])
+
+    @staticmethod
+    def _map(path, size):
+        if os.path.getsize(path) != size:
+            raise ValueError(f"{path} doesn't match its corpus index")
+        return np.memmap(path, dtype=np.uint8, mode='r') if size else np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def sentence(self, index):
+        """
+        Returns sentence index of the corpus
+        """
+        start, end = self.offsets[index:index + 2, 0]
+        return self.corpus[start:end].tobytes().decode().rstrip('\n')
+
+    def parse(self, index):
+        """
+        Returns the ULL record of sentence index: the sentence line followed by its link lines
+        """
+        start, end = self.offsets[index:index + 2, 1]
+        return self.ull[start:end].tobytes().decode().rstrip('\n')
+
+    def __getitem__(self, index):
+        """
+        Returns the (sentence, ULL record) pair of index, or the list of pairs of a slice or sequence of indexes
+        """
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if np.ndim(index):
+            return [self[i] for i in np.asarray(index).tolist()]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Sentence index {index} out of range")
+        return self.sentence(index), self.parse(index)
+
+    def sample(self, size, rng=None):
+        """
+        Returns the sorted indexes of a random sample of size sentences, without replacement
+        :param rng:     numpy Generator to draw from
+        """
+        rng = np.random.default_rng() if rng is None else rng
+        return np.sort(rng.choice(len(self), size=size, replace=False))
+
+    def write_subset(self, indexes, outfile):
+        """
+        Writes the sentences of indexes, with their parses and index, as a new corpus outfile
+        """
+        indexes = np.asarray(indexes, dtype=np.int64)
+        starts = self.offsets[indexes]
+        ends = self.offsets[indexes + 1]
+        # Consecutive indexes are copied in one go
+        breaks = np.flatnonzero(np.diff(indexes) != 1) + 1
+        runs = np.split(np.arange(len(indexes)), breaks) if len(indexes) else []
+        with open(outfile, 'wb') as fc, open(outfile + ".ull", 'wb') as fu:
+            for run in runs:
+                first, last = run[0], run[-1]
+                fc.write(self.corpus[starts[first, 0]:ends[last, 0]].tobytes())
+                fu.write(self.ull[starts[first, 1]:ends[last, 1]].tobytes())
+        sizes = (ends.astype(np.int64) - starts.astype(np.int64))
+        write_index(outfile + INDEX_SUFFIX, np.vstack((np.zeros((1, 2), dtype=np.int64), np.cumsum(sizes, axis=0))))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Writers for generated corpora: the plain corpus file (one sentence per line) and its
+# gold-standard parses in ULL format (sentence, links, blank line), kept aligned, and the
+# offset index of both (see corpus_index.py).
+
+import os
+import shutil
+import tempfile
+import struct
+from corpus_index import INDEX_MAGIC, INDEX_SUFFIX, read_offsets
+
+INDEX_ROW = struct.Struct('<QQ')  # (corpus, ULL) end offsets of a record
+
+
+class CorpusWriter:
+    """
+    Writes sentences and parses in the order they are given, and the byte offsets of every
+    record in both files to the index file outfile.idx, as they are written
+    """
+    def __init__(self, outfile, keep: int = None):
+        """
+        :param keep:    If given, reopens existing outfile and keeps its first keep records (as
+                        listed in its index), dropping anything written after them, to append to it
+        """
+        self.outfile = outfile
+        if keep is None:
+            self.num_sentences = 0
+            self.corpus_size, self.parses_size = 0, 0
+            self.fcorpus = open(outfile, 'w', encoding='utf-8')
+            self.fparses = open(outfile + ".ull", 'w', encoding='utf-8')
+            self.findex = open(outfile + INDEX_SUFFIX, 'wb')
+            self.findex.write(INDEX_MAGIC)
+            self.findex.write(INDEX_ROW.pack(0, 0))
+        else:
+            self.num_sentences = keep
+            self.corpus_size, self.parses_size = read_offsets(outfile + INDEX_SUFFIX, keep)
+            os.truncate(outfile, self.corpus_size)
+            os.truncate(outfile + ".ull", self.parses_size)
+            os.truncate(outfile + INDEX_SUFFIX, len(INDEX_MAGIC) + INDEX_ROW.size * (keep + 1))
+            self.fcorpus = open(outfile, 'a', encoding='utf-8')
+            self.fparses = open(outfile + ".ull", 'a', encoding='utf-8')
+            self.findex = open(outfile + INDEX_SUFFIX, 'ab')
+
+    def write(self, sentence, parse):
+        sentence_line = sentence + '\n'
+        self.fcorpus.write(sentence_line)
+        self.fparses.write(sentence_line)
+        self.fparses.write(parse + '\n\n')
+        sentence_bytes = len(sentence_line.encode('utf-8'))
+        self.corpus_size += sentence_bytes
+        self.parses_size += sentence_bytes + len(parse.encode('utf-8')) + 2
+        self.findex.write(INDEX_ROW.pack(self.corpus_size, self.parses_size))
+        self.num_sentences += 1
+
+    def flush(self):
+        """
+        Makes everything written so far durable, e.g. before checkpointing
+        """
+        for fo in (self.fcorpus, self.fparses, self.findex):
+            fo.flush()
+            os.fsync(fo.fileno())
+
+    def close(self):
+        self.fcorpus.close()
+        self.fparses.close()
+        self.findex.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ShuffledCorpusWriter(CorpusWriter):
+    """
+    Writes sentences and parses in a uniformly random order, using bounded memory.
+    Every record first goes to a random bucket file on disk; on close, each bucket is
+    loaded, shuffled in memory and appended to the outputs, so corpus and ULL files
+    stay aligned. Only one bucket is held in memory at a time.
+    """
+    def __init__(self, outfile, rng, expected_size, bucket_size=100000):
+        """
+        :param rng:             random.Random instance deciding the order
+        :param expected_size:   Upper bound on the number of records, used to size the buckets
+        :param bucket_size:     Expected number of records per bucket
+        """
+        super().__init__(outfile)
+        self.rng = rng
+        self.tmpdir = tempfile.mkdtemp(prefix="rangram_shuffle_", dir=os.path.dirname(os.path.abspath(outfile)))
+        num_buckets = max(1, -(-expected_size // bucket_size))
+        self.buckets = [open(os.path.join(self.tmpdir, f"bucket{i:05d}"), 'w', encoding='utf-8')
+                        for i in range(num_buckets)]
+
+    def write(self, sentence, parse):
+        # One record per two lines; links are tab-separated so empty parses survive the round trip
+        self.buckets[self.rng.randrange(len(self.buckets))].write(sentence + '\n' + parse.replace('\n', '\t') + '\n')
+
+    def close(self):
+        for bucket in self.buckets:
+            bucket.close()
+        try:
+            for bucket in self.buckets:
+                with open(bucket.name, 'r', encoding='utf-8') as fb:
+                    lines = fb.read().split('\n')
+                records = list(zip(lines[0:-1:2], lines[1:-1:2]))
+                self.rng.shuffle(records)
+                for sentence, parse in records:
+                    super().write(sentence, parse.replace('\t', '\n'))
+                os.remove(bucket.name)
+        finally:
+            super().close()
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Deduplication backends for corpus generation.
+# All backends share the same interface: add(sentence) returns True only the first
+# time a sentence is seen, add_batch(sentences) does the same for a list of them,
+# and report() describes memory use and collision risk.
+# save(path) writes the state of a backend to a file, from which its load(path) restores it.
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import sqlite3
+import sys
+import tempfile
+import numpy as np
+
+DEDUP_BACKENDS = ("exact", "hash", "disk")
+
+
+def sentence_hash(sentence):
+    """
+    Returns a 64-bit hash of sentence, stable across runs and processes
+    """
+    return int.from_bytes(hashlib.blake2b(sentence.encode(), digest_size=8).digest(), "little")
+
+
+def collision_probability(num_items, bits=64):
+    """
+    Birthday bound on the probability that any two of num_items distinct sentences share a hash
+    """
+    return -np.expm1(-num_items * (num_items - 1) / 2 ** (bits + 1))
+
+
+def make_dedup(backend, path=None):
+    """
+    Returns a deduplication object of the given backend ("exact", "hash" or "disk").
+    path is the directory holding the index of the "disk" backend (default: temporary directory)
+    """
+    if backend == "exact":
+        return ExactDedup()
+    elif backend == "hash":
+        return HashDedup()
+    elif backend == "disk":
+        return DiskDedup(path)
+    raise ValueError(f"Unknown dedup backend '{backend}', use one of {DEDUP_BACKENDS}")
+
+
+def load_dedup(backend, state_file):
+    """
+    Returns a deduplication object of the given backend, restored from the state_file it was saved to
+    """
+    if backend not in DEDUP_BACKENDS:
+        raise ValueError(f"Unknown dedup backend '{backend}', use one of {DEDUP_BACKENDS}")
+    return {"exact": ExactDedup, "hash": HashDedup, "disk": DiskDedup}[backend].load(state_file)
+
+
+class ExactDedup:
+    """
+    Keeps every unique sentence in a set. No collisions; memory grows with the text of the corpus.
+    """
+    def __init__(self):
+        self.sentences = set()
+
+    def add(self, sentence):
+        if sentence in self.sentences:
+            return False
+        self.sentences.add(sentence)
+        return True
+
+    def add_batch(self, sentences):
+        """
+        Like add() for each of sentences in order, returns a list of booleans
+        """
+        return [self.add(sentence) for sentence in sentences]
+
+    def __len__(self):
+        return len(self.sentences)
+
+    def memory_bytes(self):
+        return sys.getsizeof(self.sentences) + sum(sys.getsizeof(s) for s in self.sentences)
+
+    def collision_probability(self):
+        return 0.0
+
+    def report(self):
+        return f"exact dedup: {len(self)} sentences, {self.memory_bytes() / 2 ** 20:.1f} MiB, no collisions"
+
+    def save(self, path):
+        with open(path, 'wb') as fo:
+            pickle.dump(self.sentences, fo, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        dedup = cls()
+        with open(path, 'rb') as fi:
+            dedup.sentences = pickle.load(fi)
+        return dedup
+
+    def close(self):
+        pass
+
+
+class HashDedup:
+    """
+    Keeps the 64-bit hash of every unique sentence in an open-addressing table of uint64,
+    so memory is about 16 bytes per sentence, whatever its length. Two different sentences
+    with the same hash make the second one be dropped; see collision_probability().
+    Single add() calls probe the table from Python, a few times slower than a set; add_batch()
+    and add_hashes() probe whole batches with numpy, about as fast as a set for batches of a
+    thousand sentences.
+    """
+    EMPTY = 0  # Marks free slots; a hash of 0 is stored as 1
+    MAX_LOAD = 0.5
+
+    def __init__(self, capacity=1 << 16):
+        self.table = np.zeros(capacity, dtype=np.uint64)
+        self.mask = capacity - 1
+        self.size = 0
+
+    def add(self, sentence):
+        return self.add_hash(sentence_hash(sentence) or 1)
+
+    def add_hash(self, value):
+        """
+        Inserts a non-zero 64-bit hash, returns False if it was already present.
+        Probes the table one scalar at a time: prefer add_hashes() for many hashes at once.
+        """
+        table = self.table
+        slot = value & self.mask
+        while True:  # linear probing
+            stored = int(table[slot])
+            if stored == value:
+                return False
+            if stored == self.EMPTY:
+                break
+            slot = (slot + 1) & self.mask
+        table[slot] = value
+        self.size += 1
+        if self.size > self.MAX_LOAD * len(table):
+            self.grow()
+        return True
+
+    def add_batch(self, sentences):
+        """
+        Like add() for each of sentences in order, returns a list of booleans
+        """
+        values = np.fromiter((sentence_hash(sentence) or 1 for sentence in sentences), dtype=np.uint64,
+                             count=len(sentences))
+        return self.add_hashes(values).tolist()
+
+    def add_hashes(self, values):
+        """
+        Inserts an array of non-zero 64-bit hashes, probing for all of them at once.
+        Returns a boolean array, True for the hashes that were not present, nor earlier in values.
+        """
+        values = np.asarray(values, dtype=np.uint64)
+        # Probe all values in lockstep until each finds itself or an empty slot
+        present = np.zeros(len(values), dtype=bool)
+        pending = np.arange(len(values))
+        slots = values & np.uint64(self.mask)
+        while len(pending):
+            stored = self.table[slots]
+            present[pending[stored == values[pending]]] = True
+            probing = (stored != self.EMPTY) & (stored != values[pending])
+            pending = pending[probing]
+            slots = (slots[probing] + np.uint64(1)) & np.uint64(self.mask)
+        new = ~present
+        # Only the first occurrence of a value in the batch is new
+        candidates = np.flatnonzero(new)
+        _, first = np.unique(values[candidates], return_index=True)
+        new[candidates] = False
+        new[candidates[first]] = True
+        added = values[new]
+        while self.size + len(added) > self.MAX_LOAD * len(self.table):
+            self.grow()
+        self.insert_absent(added)
+        return new
+
+    def grow(self):
+        """
+        Doubles the table size and reinserts all hashes
+        """
+        values = self.table[self.table != self.EMPTY]
+        self.table = np.zeros(2 * len(self.table), dtype=np.uint64)
+        self.mask = len(self.table) - 1
+        self.size = 0
+        self.insert_absent(values)
+
+    def insert_absent(self, values):
+        """
+        Inserts an array of distinct non-zero hashes that are not in the table, in vectorized rounds:
+        each round, every value probing a free slot is written there, one of those sharing a slot wins it,
+        and the others move on to the next slot. The table must have room for all of them.
+        """
+        table = self.table
+        mask = np.uint64(self.mask)
+        slots = values & mask
+        while len(values):
+            free = table[slots] == self.EMPTY
+            table[slots[free]] = values[free]
+            placed = table[slots] == values
+            self.size += int(np.count_nonzero(placed))
+            waiting = ~placed
+            values = values[waiting]
+            slots = (slots[waiting] + np.uint64(1)) & mask  # all taken now
+
+    def __len__(self):
+        return self.size
+
+    def memory_bytes(self):
+        return self.table.nbytes
+
+    def collision_probability(self):
+        return collision_probability(self.size)
+
+    def report(self):
+        return (f"hash dedup: {len(self)} sentences, {self.memory_bytes() / 2 ** 20:.1f} MiB, "
+                f"collision probability {self.collision_probability():.2e}")
+
+    def save(self, path):
+        """
+        Saves the hash table as it is, so loading it needs no rehashing
+        """
+        with open(path, 'wb') as fo:
+            np.save(fo, self.table)
+
+    @classmethod
+    def load(cls, path):
+        dedup = cls()
+        with open(path, 'rb') as fi:
+            dedup.table = np.load(fi)
+        dedup.mask = len(dedup.table) - 1
+        dedup.size = int(np.count_nonzero(dedup.table != cls.EMPTY))
+        return dedup
+
+    def close(self):
+        pass
+
+
+class DiskDedup:
+    """
+    Keeps 64-bit sentence hashes in sharded on-disk SQLite indexes, for corpora bigger than RAM.
+    Memory use is bounded by the page cache of each shard. Every hash is stored with its insertion
+    number, so that the index can be rolled back to a saved state.
+    """
+    def __init__(self, path=None, num_shards=16, cache_pages=2000, commit_every=100000, reuse=False):
+        """
+        :param reuse:   Keep the hashes of the shards found in path, e.g. to resume a run; otherwise
+                        they are removed, so every run starts from an empty index
+        """
+        self.temporary = path is None
+        self.path = tempfile.mkdtemp(prefix="rangram_dedup_") if path is None else path
+        os.makedirs(self.path, exist_ok=True)
+        if not reuse:
+            for name in os.listdir(self.path):
+                if name.startswith("shard") and ".db" in name:
+                    os.remove(os.path.join(self.path, name))
+        self.num_shards = num_shards
+        self.commit_every = commit_every
+        self.pending = 0
+        self.size = 0
+        self.shards = []
+        for shard in range(num_shards):
+            conn = sqlite3.connect(os.path.join(self.path, f"shard{shard:03d}.db"))
+            conn.execute("PRAGMA journal_mode=OFF")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(f"PRAGMA cache_size={cache_pages}")
+            conn.execute("CREATE TABLE IF NOT EXISTS hashes (h INTEGER PRIMARY KEY, n INTEGER)")
+            self.size += conn.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+            self.shards.append(conn)
+
+    def add(self, sentence):
+        value = sentence_hash(sentence)
+        shard = self.shards[value % self.num_shards]
+        # SQLite integers are signed
+        inserted = shard.execute("INSERT OR IGNORE INTO hashes VALUES (?, ?)",
+                                 (value - (1 << 64) if value >= 1 << 63 else value, self.size)).rowcount
+        if inserted:
+            self.size += 1
+            self.pending += 1
+            if self.pending >= self.commit_every:
+                self.commit()
+        return bool(inserted)
+
+    def add_batch(self, sentences):
+        """
+        Like add() for each of sentences in order, returns a list of booleans
+        """
+        return [self.add(sentence) for sentence in sentences]
+
+    def commit(self):
+        for shard in self.shards:
+            shard.commit()
+        self.pending = 0
+
+    def __len__(self):
+        return self.size
+
+    def memory_bytes(self):
+        """
+        Size of the on-disk index; memory itself is bounded by the SQLite page caches
+        """
+        self.commit()
+        return sum(os.path.getsize(os.path.join(self.path, f)) for f in os.listdir(self.path))
+
+    def collision_probability(self):
+        return collision_probability(self.size)
+
+    def report(self):
+        return (f"disk dedup: {len(self)} sentences, {self.memory_bytes() / 2 ** 20:.1f} MiB on disk "
+                f"in {self.path}, collision probability {self.collision_probability():.2e}")
+
+    def save(self, path):
+        """
+        Commits the index, and saves its location and size. The index must not be temporary.
+        """
+        if self.temporary:
+            raise ValueError("Can't save a temporary disk dedup index, give it a path")
+        self.commit()
+        with open(path, 'w') as fo:
+            json.dump({"path": os.path.abspath(self.path), "num_shards": self.num_shards, "size": self.size}, fo)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reopens a saved index, dropping the hashes added after it was saved
+        """
+        with open(path, 'r') as fi:
+            state = json.load(fi)
+        dedup = cls(state["path"], num_shards=state["num_shards"], reuse=True)
+        dedup.rollback(state["size"])
+        return dedup
+
+    def rollback(self, size):
+        """
+        Removes the hashes inserted after the first size ones
+        """
+        for shard in self.shards:
+            shard.execute("DELETE FROM hashes WHERE n >= ?", (size,))
+        self.commit()
+        self.size = sum(shard.execute("SELECT COUNT(*) FROM hashes").fetchone()[0] for shard in self.shards)
+
+    def close(self):
+        self.commit()
+        for shard in self.shards:
+            shard.close()
+        self.shards = []
+        if self.temporary:
+            shutil.rmtree(self.path, ignore_errors=True)
+
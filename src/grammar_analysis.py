@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Analysis of the sentence space of a Grammar, as produced by GrammarSampler:
+# counts derivations per sentence length with memoized dynamic programming,
+# detects recursive (infinite) grammars, and enumerates finite languages (or their class-level
+# derivations) exactly.
+
+import math
+import sys
+import weakref
+from sentence_generator import Grammar, GrammarSampler, DerivationBudgetError
+
+_analyzers = weakref.WeakKeyDictionary()  # Grammar -> {lexical: GrammarAnalyzer}
+
+
+def analyzer_for(grammar, lexical=True):
+    """
+    Returns the GrammarAnalyzer of grammar, created once per grammar and kind of count, so that
+    its tables are computed only once and shared by every sampler in the process
+    """
+    analyzers = _analyzers.setdefault(grammar, {})
+    if lexical not in analyzers:
+        analyzers[lexical] = GrammarAnalyzer(grammar, lexical)
+    return analyzers[lexical]
+
+
+class GrammarAnalyzer:
+    """
+    Counts the derivations GrammarSampler can produce from a grammar, by number of words.
+
+    A derivation is one full set of sampler choices: starting class and conjunct, the class
+    linked by every connector, the conjunct of every linked class and, when counting words,
+    the word of every node. Different derivations may give the same sentence (polysemous
+    words, or grammars where several derivations lead to the same linkage), so derivation
+    counts are upper bounds for the number of distinct sentences; count_sentences() gives
+    the exact number by enumeration.
+
+    Counts are kept per link entry of the compiled grammar (a connector and a class it links to):
+    T[e][n] is the number of subtrees of n words hanging from link entry e, and F[c][n] the
+    number of subtrees of n words that can fill connector c. Tables are extended lazily
+    to the longest length requested so far.
+    """
+    def __init__(self, grammar, lexical=True):
+        """
+        :param grammar:     Grammar object
+        :param lexical:     Count word choices (True), or only class-level derivations (False)
+        """
+        if grammar.lazy_classes:
+            raise ValueError("Grammar has classes too big to expand, whose derivations can't be counted")
+        self.source = grammar
+        self.grammar = grammar.compiled
+        cg = self.grammar
+        self.lexical = lexical
+        self.conj_conns = cg.conj_conns.tolist()
+        self.conj_offsets = cg.conj_offsets.tolist()
+        self.class_conj_offsets = cg.class_conj_offsets.tolist()
+        self.link_offsets = cg.link_offsets.tolist()
+        self.link_classes = cg.link_classes.tolist()
+        self.link_conj_offsets = cg.link_conj_offsets.tolist()
+        self.link_conjs = cg.link_conjs.tolist()
+        self.link_slots = cg.link_slots.tolist()
+        class_word_offsets = cg.class_word_offsets.tolist()
+        self.class_weight = [class_word_offsets[k + 1] - class_word_offsets[k] if lexical else 1
+                             for k in range(cg.num_classes)]
+
+        # Connector lists to convolve: children of each (conjunct, parent slot) option of every link entry,
+        # and children of every conjunct of each class when it's the root
+        self.entry_options = [[self.children(self.link_conjs[pos], self.link_slots[pos])
+                               for pos in range(self.link_conj_offsets[e], self.link_conj_offsets[e + 1])]
+                              for e in range(len(self.link_classes))]
+        self.root_options = [[self.children(conj, -1) for conj in range(self.class_conj_offsets[k],
+                                                                         self.class_conj_offsets[k + 1])]
+                             for k in range(cg.num_classes)]
+
+        self.max_len = 0
+        self.T = [[0] for _ in self.link_classes]  # T[e][n]; no subtree has 0 words
+        self.F = [[0] for _ in range(cg.num_connectors)]  # F[c][n]
+        self.R = [[0] for _ in range(cg.num_classes)]  # R[k][n]: sentences of n words rooted at class k
+        # Prefix convolutions of every option, P[j][m]: ways to fill its first j connectors with m words
+        self.entry_prefixes = [[[[1]] + [[] for _ in option] for option in options]
+                               for options in self.entry_options]
+        self.root_prefixes = [[[[1]] + [[] for _ in option] for option in options]
+                              for options in self.root_options]
+        self._finite = None
+        self._longest = None
+
+    def children(self, conj, parent_slot):
+        """
+        Connectors of conj that create child nodes, i.e. all but the one linking to the parent
+        """
+        conns = self.conj_conns[self.conj_offsets[conj]:self.conj_offsets[conj + 1]]
+        return [conn for slot, conn in enumerate(conns) if slot != parent_slot]
+
+    def extend(self, max_len):
+        """
+        Extend all count tables up to sentences of max_len words
+        """
+        for n in range(self.max_len + 1, max_len + 1):
+            # Subtrees of n words: root word plus children filling n - 1 words, which only
+            # needs tables for smaller sizes
+            for e, options in enumerate(self.entry_options):
+                total = 0
+                for option, prefixes in zip(options, self.entry_prefixes[e]):
+                    total += self.extend_prefix(option, prefixes, n - 1)
+                self.T[e].append(self.class_weight[self.link_classes[e]] * total)
+            for k, options in enumerate(self.root_options):
+                total = 0
+                for option, prefixes in zip(options, self.root_prefixes[k]):
+                    total += self.extend_prefix(option, prefixes, n - 1)
+                self.R[k].append(self.class_weight[k] * total)
+            for conn in range(len(self.F)):
+                self.F[conn].append(sum(self.T[e][n] for e in range(self.link_offsets[conn],
+                                                                      self.link_offsets[conn + 1])))
+        self.max_len = max(self.max_len, max_len)
+
+    def extend_prefix(self, option, prefixes, m):
+        """
+        Append size m to the prefix convolutions of an option, and return the count of filling
+        all its connectors with m words. F must be known up to size m.
+        """
+        if m == len(prefixes[0]):
+            prefixes[0].append(0)  # no connectors fill exactly 0 words
+        for j, conn in enumerate(option, 1):
+            prev = prefixes[j - 1]
+            fill = self.F[conn]
+            # subtrees have at least one word, so fill[0] == 0
+            prefixes[j].append(sum(prev[a] * fill[m - a] for a in range(m) if prev[a]))
+        return prefixes[-1][m]
+
+    def count_by_length(self, max_len):
+        """
+        Returns a list whose n-th element is the number of derivations of n-word sentences, up to max_len
+        """
+        self.extend(max_len)
+        return [sum(self.R[k][n] for k in range(len(self.R))) for n in range(max_len + 1)]
+
+    def count_derivations(self, max_len=None, limit=None):
+        """
+        Number of derivations with at most max_len words. If max_len is None, counts all
+        derivations, which is math.inf for recursive grammars.
+        If limit is given, tables are extended one length at a time, and counting stops as
+        soon as the total exceeds limit (the returned partial total is then > limit).
+        """
+        if self.is_finite():
+            max_len = self.longest_sentence() if max_len is None else min(max_len, self.longest_sentence())
+        elif max_len is None:
+            return math.inf
+        if limit is None:
+            return sum(self.count_by_length(max_len))
+        total = 0
+        for length in range(1, max_len + 1):
+            self.extend(length)
+            total += sum(self.R[k][length] for k in range(len(self.R)))
+            if total > limit:
+                break
+        return total
+
+    def is_finite(self):
+        """
+        True if the grammar only admits a finite number of sentences, i.e. no productive
+        link entry can appear inside its own subtree
+        """
+        if self._finite is None:
+            productive = self.productive_entries()
+            # Graph of productive entries that can appear as children of each other
+            edges = [set() for _ in self.link_classes]
+            for e, options in enumerate(self.entry_options):
+                for option in options:
+                    if productive[e] and self.option_productive(option, productive):
+                        for conn in option:
+                            edges[e].update(f for f in range(self.link_offsets[conn], self.link_offsets[conn + 1])
+                                            if productive[f])
+            reachable = set()
+            for options in self.root_options:
+                for option in options:
+                    if self.option_productive(option, productive):
+                        for conn in option:
+                            reachable.update(f for f in range(self.link_offsets[conn], self.link_offsets[conn + 1])
+                                             if productive[f])
+            self._finite = not self.has_cycle(edges, reachable)
+        return self._finite
+
+    def productive_entries(self):
+        """
+        Marks link entries that admit at least one finite subtree
+        """
+        productive = [False] * len(self.link_classes)
+        changed = True
+        while changed:
+            changed = False
+            for e, options in enumerate(self.entry_options):
+                if not productive[e] and any(self.option_productive(o, productive) for o in options):
+                    productive[e] = True
+                    changed = True
+        return productive
+
+    def option_productive(self, option, productive):
+        return all(any(productive[f] for f in range(self.link_offsets[conn], self.link_offsets[conn + 1]))
+                   for conn in option)
+
+    @staticmethod
+    def has_cycle(edges, starts):
+        """
+        Iterative depth-first search for a cycle reachable from starts
+        """
+        WHITE, GREY, BLACK = 0, 1, 2
+        color = [WHITE] * len(edges)
+        for start in starts:
+            if color[start] != WHITE:
+                continue
+            color[start] = GREY
+            stack = [(start, iter(edges[start]))]
+            while stack:
+                node, children = stack[-1]
+                child = next(children, None)
+                if child is None:
+                    color[node] = BLACK
+                    stack.pop()
+                elif color[child] == GREY:
+                    return True
+                elif color[child] == WHITE:
+                    color[child] = GREY
+                    stack.append((child, iter(edges[child])))
+        return False
+
+    def longest_sentence(self):
+        """
+        Number of words of the longest sentence of a finite grammar (math.inf if recursive)
+        """
+        if not self.is_finite():
+            return math.inf
+        if self._longest is None:
+            productive = self.productive_entries()
+            longest = {}  # longest subtree of each productive entry; the entry graph is acyclic
+
+            def option_longest(option):
+                return sum(max(entry_longest(f) for f in range(self.link_offsets[conn], self.link_offsets[conn + 1])
+                               if productive[f]) for conn in option)
+
+            def entry_longest(e):
+                if e not in longest:
+                    longest[e] = 1 + max(option_longest(o) for o in self.entry_options[e]
+                                         if self.option_productive(o, productive))
+                return longest[e]
+
+            # Subtree depth is bounded by the number of entries; keep recursion within limits
+            limit = sys.getrecursionlimit()
+            sys.setrecursionlimit(max(limit, 4 * len(self.link_classes) + 100))
+            try:
+                self._longest = max(1 + option_longest(o) for options in self.root_options for o in options
+                                    if self.option_productive(o, productive))
+            finally:
+                sys.setrecursionlimit(limit)
+        return self._longest
+
+    def count_sentences(self, max_len=None, limit=10 ** 6):
+        """
+        Exact number of distinct sentences with at most max_len words (all of them if None),
+        found by enumerating every derivation. Returns None if there are more than limit
+        derivations, and math.inf for recursive grammars without max_len.
+        """
+        if max_len is None and not self.is_finite():
+            return math.inf
+        if self.count_derivations(max_len, limit) > limit:
+            return None
+        return len({sentence for sentence, parse in enumerate_parses(self.source, max_len)})
+
+
+class _ScriptedRandom:
+    """
+    Random source that replays a script of choices, extending it with the first option
+    of every new choice point. next_path() moves the script to the next leaf of the
+    decision tree, so replaying until it returns False visits every derivation once.
+    """
+    def __init__(self):
+        self.choices = []  # [chosen index, number of options] of every choice point
+        self.pos = 0
+
+    def randrange(self, start, stop):
+        if self.pos == len(self.choices):
+            if stop <= start:
+                raise ValueError("empty range for randrange()")
+            self.choices.append([0, stop - start])
+        value = self.choices[self.pos][0]
+        self.pos += 1
+        return start + value
+
+    def randint(self, a, b):
+        return self.randrange(a, b + 1)
+
+    def probability(self):
+        """
+        Probability that a random.Random draws the choices of the current path
+        """
+        return math.prod(1 / options for _, options in self.choices[:self.pos])
+
+    def next_path(self):
+        del self.choices[self.pos:]  # choice points of an aborted derivation
+        while self.choices and self.choices[-1][0] + 1 >= self.choices[-1][1]:
+            self.choices.pop()
+        self.pos = 0
+        if not self.choices:
+            return False
+        self.choices[-1][0] += 1
+        return True
+
+
+def enumerate_parses(grammar, max_len=None):
+    """
+    Yields the (sentence, parse) pair of every derivation of grammar with at most max_len words,
+    laid out exactly as GrammarSampler.generate_parse() does. Repeats sentences reached by
+    several derivations. Only terminates for finite grammars when max_len is None.
+    """
+    rng = _ScriptedRandom()
+    sampler = GrammarSampler(grammar, max_length=max_len, max_resamples=0, rng=rng, use_weights=False)
+    while True:
+        try:
+            yield sampler.generate_parse()
+        except DerivationBudgetError:
+            pass
+        if not rng.next_path():
+            return
+
+
+def enumerate_skeletons(grammar, max_len=None):
+    """
+    Yields the classes and heads (see SentenceBatch), in sentence order, of every class-level derivation
+    of grammar with at most max_len words, with the probability that GrammarSampler (without sampling
+    weights) draws it. Words are not drawn, so the choices of words don't multiply the derivations.
+    Only terminates for finite grammars when max_len is None.
+    """
+    rng = _ScriptedRandom()
+    sampler = GrammarSampler(grammar, max_length=max_len, max_resamples=0, rng=rng, use_weights=False)
+    sampler.defer_words = True
+    while True:
+        try:
+            sampler.generate_derivation()
+            yield [sampler.node_class[node] for node in sampler.tree], sampler.tree_heads(), rng.probability()
+        except DerivationBudgetError:
+            pass
+        if not rng.next_path():
+            return
+
+
+def main(argv):
+    """
+    Prints the number of derivations and distinct sentences of a grammar, per sentence length.
+
+    Usage: python grammar_analysis.py <grammar_file> [<max_length>]
+
+    grammar_file        Grammar in Link Grammar format
+    max_length          Count sentences up to this number of words (default: longest sentence of
+                        a finite grammar, 20 for recursive ones)
+    """
+    if len(argv) < 1:
+        print("Usage: python grammar_analysis.py <grammar_file> [<max_length>]")
+        sys.exit(2)
+    grammar = Grammar(argv[0])
+    analyzer = GrammarAnalyzer(grammar)
+    finite = analyzer.is_finite()
+    print(f"Grammar is {'finite' if finite else 'recursive (infinite language)'}")
+    max_len = int(argv[1]) if len(argv) > 1 else (analyzer.longest_sentence() if finite else 20)
+    structures = GrammarAnalyzer(grammar, lexical=False).count_by_length(max_len)
+    counts = analyzer.count_by_length(max_len)
+    print("LENGTH\tSTRUCTURES\tDERIVATIONS")
+    for length in range(1, max_len + 1):
+        if counts[length]:
+            print(f"{length}\t{structures[length]}\t{counts[length]}")
+    print(f"Total derivations up to {max_len} words: {sum(counts)}")
+    print(f"Total derivations: {analyzer.count_derivations()}")
+    distinct = analyzer.count_sentences(max_len)
+    if distinct is not None:
+        print(f"Distinct sentences up to {max_len} words: {distinct}")
+    else:
+        print("Too many derivations to count distinct sentences by enumeration")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
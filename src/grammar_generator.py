@@ -5,116 +5,198 @@
 # # Creates a scale-free random grammar with specified parameters
 
 import sys
-from fractions import Fraction
+import getopt
 import numpy as np
-import random as rand
+from sentence_generator import Grammar
 
-# We start by obtaining the parameters of the grammar
-num_words = 20
-num_classes = 8
-num_class_connectors = 20
-connectors_limit = 3
-outfile = "rand.grammar"
+# Default parameters of the grammar
+NUM_WORDS = 20
+NUM_CLASSES = 8
+NUM_CLASS_CONNECTORS = 20
+CONNECTORS_LIMIT = 3
+GRAMMAR_PARAMS = {"num_words": NUM_WORDS, "num_classes": NUM_CLASSES,
+                  "num_class_connectors": NUM_CLASS_CONNECTORS, "connectors_limit": CONNECTORS_LIMIT}
 
 
 def main(argv):
-    # Populate grammar classes following a Zipf distribution
-    harmonic_number = sum(Fraction(1, d) for d in range(1, num_classes + 1))
-    zipf_fracs = [1 / x / harmonic_number for x in range(1, num_classes + 1)]
-    words_per_class = np.array(np.round(np.array(zipf_fracs) * num_words), dtype="int")
-    cumul_words = np.cumsum(words_per_class)  # boundaries for class words
+    """
+        Grammar_generator writes a random grammar in Link Grammar format.
+
+        "Usage: grammar_generator.py [-o <outfile> -w <num_words> -c <num_classes>
+                                     -n <num_class_connectors> -l <connectors_limit> --seed <seed>]"
+
+        outfile                 File to write the grammar to (default: 'rand.grammar')
+        num_words               Size of the vocabulary (default: 20)
+        num_classes             Number of grammatical classes, populated with words following a
+                                Zipf distribution (default: 8)
+        num_class_connectors    Number of random links drawn between pairs of different classes;
+                                repeated pairs are dropped, so there can be less (default: 20)
+        connectors_limit        Max number of connectors in a conjunct (default: 3)
+        seed                    Random seed; the same parameters and seed always produce
+                                the same grammar (default: random)
+    """
+    outfile = "rand.grammar"
+    params = dict(GRAMMAR_PARAMS)
+    seed = None
+
+    usage = '''Usage: grammar_generator.py [-o <outfile> -w <num_words> -c <num_classes>
+                                     -n <num_class_connectors> -l <connectors_limit> --seed <seed>]'''
+    try:
+        opts, args = getopt.getopt(argv, "ho:w:c:n:l:", ["outfile=", "num_words=", "num_classes=",
+                                                         "num_class_connectors=", "connectors_limit=", "seed="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-o", "--outfile"):
+            outfile = arg
+        elif opt in ("-w", "--num_words"):
+            params["num_words"] = int(arg)
+        elif opt in ("-c", "--num_classes"):
+            params["num_classes"] = int(arg)
+        elif opt in ("-n", "--num_class_connectors"):
+            params["num_class_connectors"] = int(arg)
+        elif opt in ("-l", "--connectors_limit"):
+            params["connectors_limit"] = int(arg)
+        elif opt == "--seed":
+            seed = int(arg)
+
+    grammar = generate_grammar(**params, seed=seed)
+    with open(outfile, 'w') as fo:
+        fo.write(grammar_text(grammar, params))
+    print(f"Wrote grammar with {grammar.compiled.num_classes} classes, {grammar.compiled.num_words} words "
+          f"and {grammar.compiled.num_conjuncts} conjuncts to {outfile}")
 
-    # Create random connectors between grammar classes
-    connectors = set()
-    for i in range(0, num_class_connectors - 1):
-        randint1 = rand.randint(0, num_classes - 1)
-        randint2 = rand.randint(0, num_classes - 1)
-        if randint1 != randint2:  # avoid classes connecting to themselves; may cause less connections than param
-            connectors.add((randint1, randint2))
-
-    # Assign connectors to classes
-    # Translate connectors into connector labels
-    connectors_dict = {k: [] for k in range(num_classes)}
-    connectors_dict_text = {k: [] for k in range(num_classes)}
-    for connector in connectors:
-        connector_text = "C" + str(connector[0]) + "_" + str(connector[1])
-        connectors_dict[connector[0]].append(connector)
-        connectors_dict[connector[1]].append(connector)
-        connectors_dict_text[connector[0]].append(connector_text + "+")
-        connectors_dict_text[connector[1]].append(connector_text + "-")
-
-    print(connectors_dict_text)
-    print(connectors_dict)
-
-    # Build the disjuncts randomly, with some directives
-    dict_disjuncts = {}
-    for gramm_class, connects in connectors_dict.items():
-        # don't conjunct more connectors than available ones, nor than limit
-        max_connectors = min(connectors_limit, len(connects))
-        disjuncts = []
-
-        for connector in connects:  # create one conjunct per connector; arbitrary choice
-            num_connectors = rand.randint(1, max_connectors)  # determine how many connectors for this conjunct
-            conjunct = [connector]  # current connector always goes in conjunct
-
-            diff_connects = connects[:]  # make independent copy
-            diff_connects.remove(connector)  # don't repeat connector in a conjunct
-            conjunct.extend(
-                rand.sample(diff_connects, num_connectors - 1))  # add random connectors to conjunct; no repeats
-
-            disjuncts.append(conjunct)
-
-        dict_disjuncts[gramm_class] = set(tuple(d) for d in disjuncts)  # set eliminates duplicate disjuncts
-
-    print(dict_disjuncts)
-
-    # Translate grammar to dictionary format
-    grammar_text = f"""
-    %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
-    % RANDOM GRAMMAR generated by rangram (https://github.com/glicerico/rangram)
-    % Grammar parameters:
-    % num_words = {num_words}
-    % num_classes = {num_classes}
-    % num_class_connectors = {num_class_connectors}
-    % connectors_limit = {connectors_limit}
-    %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
 
+def zipf_allocation(num_words: int, num_classes: int):
+    """
+    Returns the number of words of each class, proportional to 1/rank (Zipf's law) and adding
+    up to num_words. Every class gets at least one word, taken from the biggest classes.
     """
+    if num_words < num_classes:
+        raise ValueError(f"Can't populate {num_classes} classes with {num_words} words")
+    zipf_fracs = 1 / np.arange(1, num_classes + 1)
+    words_per_class = _largest_remainder(zipf_fracs / zipf_fracs.sum() * num_words)
+    empty = words_per_class == 0
+    if empty.any():
+        words_per_class[empty] = 1
+        spare = words_per_class - 1
+        words_per_class -= _largest_remainder(spare / spare.sum() * empty.sum())
+    return words_per_class
+
+
+def _largest_remainder(quotas):
+    """
+    Rounds quotas to integers with the same (integer) sum, rounding up those with the largest fractions
+    """
+    counts = np.floor(quotas).astype(np.int64)
+    missing = int(round(quotas.sum())) - counts.sum()
+    counts[np.argsort(counts - quotas, kind="stable")[:missing]] += 1
+    return counts
 
-    dict_vocab = {}  # Vocabulary dict per class
-    for curr_class, disjunct in dict_disjuncts.items():
-        class_entry = f"% Class: {curr_class}\n"  # Description of current disjunct
-        # Calculate initial word_id for class
-        if curr_class == 0:
-            lower_id = 0
-        else:
-            lower_id = cumul_words[curr_class - 1]
-
-        # Add word list to class_entry
-        class_words = [f'w{i}' for i in range(lower_id, cumul_words[curr_class])]
-        dict_vocab[curr_class] = class_words
-        class_entry += " ".join(class_words) + ":\n"
-
-        # Add every conjunct to disjunct
-        curr_disjunct = []
-        for conjunct in disjunct:
-            curr_conjunct = []
-            for connector in conjunct:
-                connector_text = "C" + str(connector[0]) + "_" + str(connector[1])
-                sign = "+" if connector[0] == curr_class else "-"  # choose connector sign
-                curr_conjunct.append(connector_text + sign)
-            curr_disjunct.append(" & ".join(curr_conjunct))
-
-        class_entry += "(" + ") or (".join(curr_disjunct) + ");\n\n"
-        grammar_text += class_entry
-
-    print(grammar_text)
 
-    with open(outfile, 'w') as fo:
-        fo.write(grammar_text)
+def generate_grammar(num_words: int = NUM_WORDS, num_classes: int = NUM_CLASSES,
+                     num_class_connectors: int = NUM_CLASS_CONNECTORS, connectors_limit: int = CONNECTORS_LIMIT,
+                     seed=None, weights: dict = None):
+    """
+    Generates a random grammar and returns it as a Grammar object.
+    Words w0, w1, ... are allocated to classes following a Zipf distribution. Then num_class_connectors
+    random pairs of different classes (i, j) are drawn, and linked by connector Ci_j, with Ci_j+ in
+    class i and Ci_j- in class j (indices are zero-padded so that no connector name extends another).
+    Each connector of a class starts one conjunct, completed with up to connectors_limit - 1 other
+    random connectors of the class. Classes left without connectors, and their words, are dropped.
+    :param seed:    Seed, SeedSequence or numpy Generator to draw from
+    :param weights: Sampling weights of the grammar, as read by read_weights()
+    """
+    rng = np.random.default_rng(seed)
+    words_per_class = zipf_allocation(num_words, num_classes)
+    cumul_words = np.concatenate(([0], np.cumsum(words_per_class)))  # boundaries for class words
 
-    grammar = [dict_disjuncts, dict_vocab]
-    return grammar
+    # Create random connectors between grammar classes
+    pairs = rng.integers(0, num_classes, size=(num_class_connectors, 2))
+    pairs = np.unique(pairs[pairs[:, 0] != pairs[:, 1]], axis=0)  # may cause less connections than param
+
+    # Each connector appears in its two classes. Sort these appearances by class: those of class k
+    # are members[class_offsets[k]:class_offsets[k + 1]], members being ids 2 * pair + (0 if + else 1).
+    num_pairs = len(pairs)
+    members = np.argsort(pairs.ravel(), kind="stable")
+    class_sizes = np.bincount(pairs.ravel(), minlength=num_classes)
+    class_offsets = np.concatenate(([0], np.cumsum(class_sizes)))
+    member_class = np.repeat(np.arange(num_classes), class_sizes)
+    group_size = class_sizes[member_class]
+    rank = np.arange(2 * num_pairs) - class_offsets[member_class]  # position within its class
+
+    # One conjunct per connector: itself, followed by num_connectors - 1 other random connectors of
+    # the class, with no repeats. Draw connector ranks among the class's others, and redraw
+    # the conjuncts with a repeat.
+    max_connectors = np.minimum(connectors_limit, group_size)
+    num_connectors = rng.integers(1, max_connectors + 1)
+    used = np.arange(connectors_limit - 1) < (num_connectors - 1)[:, None]
+    others = np.zeros((2 * num_pairs, connectors_limit - 1), dtype=np.int64)
+    redraw = np.arange(2 * num_pairs)[num_connectors > 1]
+    while len(redraw):
+        draws = (rng.random((len(redraw), connectors_limit - 1)) * (group_size[redraw] - 1)[:, None]).astype(np.int64)
+        others[redraw] = draws + (draws >= rank[redraw, None])  # skip the conjunct's own connector
+        repeated = np.zeros(len(redraw), dtype=bool)
+        for a in range(connectors_limit - 1):
+            for b in range(a + 1, connectors_limit - 1):
+                repeated |= (others[redraw, a] == others[redraw, b]) & used[redraw, b]
+        redraw = redraw[repeated]
+    conjuncts = np.where(used, members[class_offsets[member_class][:, None] + others], -1)
+
+    # Translate connectors into connector labels
+    width = len(str(num_classes - 1))
+    labels = [f"C{i:0{width}d}_{j:0{width}d}{sign}" for i, j in pairs.tolist() for sign in "+-"]
+
+    disj_dict = {k: {} for k in range(num_classes)}
+    for gram_class, member, conjunct in zip(member_class.tolist(), members.tolist(), conjuncts.tolist()):
+        # dict keys eliminate duplicate conjuncts, keeping their order
+        disj_dict[gram_class][(labels[member],) + tuple(labels[c] for c in conjunct if c >= 0)] = None
+    word_dict = {k: [f"w{i}" for i in range(cumul_words[k], cumul_words[k + 1])] for k in range(num_classes)}
+    return Grammar.from_dicts({k: list(disj) for k, disj in disj_dict.items()}, word_dict, weights)
+
+
+def grammar_text(grammar, params: dict = None):
+    """
+    Returns grammar in Link Grammar dictionary format, with the generation parameters in its header,
+    and its sampling weights as annotations of the classes that have any
+    """
+    header = [f"% {name} = {value}" for name, value in (params or {}).items()]
+    text = "\n".join(["", "%" * 49, "% RANDOM GRAMMAR generated by rangram (https://github.com/glicerico/rangram)",
+                      "% Grammar parameters:"] + header + ["%" * 49, "", ""])
+    for curr_class in sorted(grammar.disj_dict):
+        text += f"% Class: {curr_class}\n"
+        text += weights_annotations(grammar, curr_class)
+        text += " ".join(grammar.word_dict[curr_class]) + ":\n"
+        text += "(" + ") or (".join(" & ".join(conj) for conj in grammar.disj_dict[curr_class]) + ");\n\n"
+    return text
+
+
+def weights_annotations(grammar, gram_class):
+    """
+    Returns the "%weights" annotation lines (see lg_dictionary.py) of the sampling weights of gram_class
+    """
+    lines = []
+    word_weights = grammar.word_weights.get(gram_class)
+    if word_weights is not None:
+        lines.append("%weights words: " + " ".join(f"{word}={format_weight(weight)}" for word, weight in
+                                                   zip(grammar.word_dict[gram_class], word_weights) if weight != 1))
+    if gram_class in grammar.disj_weights:
+        lines.append("%weights disjuncts: " + " ".join(map(format_weight, grammar.disj_weights[gram_class])))
+    if gram_class in grammar.class_weights:
+        lines.append(f"%weights class: {format_weight(grammar.class_weights[gram_class])}")
+    return "".join(line + "\n" for line in lines)
+
+
+def format_weight(weight):
+    """
+    Shortest text of weight that reads back as the same number
+    """
+    text = f"{weight:g}"
+    return text if float(text) == weight else repr(float(weight))
 
 
 if __name__ == "__main__":
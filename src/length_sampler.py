@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Length-targeted sampling: draws derivations with an exact number of words, steering every
+# choice of GrammarSampler with the derivation counts of GrammarAnalyzer instead of rejecting
+# off-length sentences. UniformSampler uses the same machinery to draw parse trees uniformly.
+
+import math
+from bisect import bisect_right
+from itertools import accumulate
+from sentence_generator import GrammarSampler
+from grammar_analysis import analyzer_for, _ScriptedRandom
+from lg_dictionary import weighted_choice
+
+
+def parse_length_histogram(spec):
+    """
+    Parses a length histogram given as comma-separated "<length>:<count>" or "<min>-<max>:<count>"
+    items, e.g. "3-25:100,30:10", into a sorted list of (length, count) pairs
+    """
+    histogram = {}
+    for item in spec.split(','):
+        lengths, _, number = item.strip().partition(':')
+        low, _, high = lengths.partition('-')
+        low = int(low)
+        high = int(high) if high else low
+        number = int(number) if number else 1
+        if low < 1 or high < low or number < 0:
+            raise ValueError(f"Invalid length histogram item '{item}'")
+        for length in range(low, high + 1):
+            histogram[length] = histogram.get(length, 0) + number
+    return sorted(histogram.items())
+
+
+class LengthSampler(GrammarSampler):
+    """
+    GrammarSampler that only produces sentences of a requested number of words.
+
+    The root class and conjunct, the class linked by every connector and the conjunct of every
+    linked class are chosen in proportion to the number of ways they can be completed into a
+    derivation of the target size, and the sizes of the subtrees hanging from each node are
+    drawn from the analyzer's prefix convolutions when its conjunct is chosen. Every derivation
+    of the requested length is reached without rejection, with probability proportional to its
+    weight in the analyzer (uniform over class-level derivations by default).
+    Layout and word sampling are those of GrammarSampler, so word sampling weights are followed,
+    but class and disjunct weights are not.
+    """
+    def __init__(self, grammar, length=None, analyzer=None, rng=None, use_weights=True):
+        """
+        :param length:      Number of words of the generated sentences; can be changed per call of generate_parse()
+        :param analyzer:    GrammarAnalyzer with the counts to follow, e.g. shared between samplers.
+                            Defaults to class-level (lexical=False) counts of grammar.
+        :param use_weights: Draw words in proportion to the grammar's sampling weights, if it has any
+        """
+        # No length budget is needed: sizes are fixed before nodes are created
+        super().__init__(grammar, max_length=None, max_resamples=0, rng=rng, use_weights=use_weights)
+        self.analyzer = analyzer_for(grammar, lexical=False) if analyzer is None else analyzer
+        self.length = length
+        self.plans = []  # subtree sizes still to create for the children of open nodes, last one is current
+        self.next_size = 0  # size of the subtree of the last linked class chosen
+
+    def choose(self, weights):
+        """
+        Returns an index of weights, drawn in proportion to them
+        """
+        return weighted_choice(self.rng, weights)
+
+    def count(self, length):
+        """
+        Number of derivations of length words, as weighted by the analyzer
+        """
+        return self.analyzer.count_by_length(length)[length]
+
+    def generate_parse(self, starting_node=None, starting_rule=None, length=None):
+        """
+        Generate a lexical tree of the sampler's length (or the given one) and return its sentence and parse
+        :param: length:  Number of words of the sentence, without final punctuation
+        """
+        if length is not None:
+            self.length = length
+        return super().generate_parse(starting_node, starting_rule)
+
+    def generate_derivation(self, starting_node=None, starting_rule=None):
+        if starting_rule is not None:
+            raise ValueError("LengthSampler can't start from a given rule")
+        if self.length is None or self.length < 1:
+            raise ValueError("LengthSampler needs a target length of at least one word")
+        self.analyzer.extend(self.length)
+        self.plans = []
+        return super().generate_derivation(starting_node, starting_rule)
+
+    def plan_children(self, option, prefixes, size):
+        """
+        Draws the sizes of the subtrees filling the connectors of option with size words,
+        going backwards through its prefix convolutions, and pushes them in option order
+        """
+        sizes = [0] * len(option)
+        for j in range(len(option), 0, -1):
+            prev = prefixes[j - 1]
+            fill = self.analyzer.F[option[j - 1]]
+            # the first j - 1 connectors need at least j - 1 words
+            weights = [prev[size - m] * fill[m] for m in range(1, size - j + 2)]
+            sizes[j - 1] = self.choose(weights) + 1
+            size -= sizes[j - 1]
+        self.plans.append(sizes[::-1])  # consumed from the end
+
+    def choose_root(self, node_class=None, rule=None):
+        analyzer = self.analyzer
+        length = self.length
+        if node_class is None:
+            weights = [analyzer.R[k][length] for k in range(self.grammar.num_classes)]
+            if not any(weights):
+                raise ValueError(f"Grammar has no sentences of {length} words")
+            node_class = self.choose(weights)
+        prefixes = analyzer.root_prefixes[node_class]
+        weights = [p[-1][length - 1] for p in prefixes]
+        if not any(weights):
+            raise ValueError(f"Class {node_class} has no sentences of {length} words")
+        option = self.choose(weights)
+        self.plan_children(analyzer.root_options[node_class][option], prefixes[option], length - 1)
+        conj = self.class_conj_offsets[node_class] + option
+        return node_class, self.conj_conns[self.conj_offsets[conj]:self.conj_offsets[conj + 1]]
+
+    def choose_linked_class(self, connector):
+        while not self.plans[-1]:  # subtrees of the current node are all created
+            self.plans.pop()
+        self.next_size = self.plans[-1].pop()
+        start = self.link_offsets[connector]
+        T = self.analyzer.T
+        return start + self.choose([T[e][self.next_size] for e in range(start, self.link_offsets[connector + 1])])
+
+    def choose_conjunct(self, link_entry):
+        size = self.next_size
+        prefixes = self.analyzer.entry_prefixes[link_entry]
+        option = self.choose([p[-1][size - 1] for p in prefixes])
+        self.plan_children(self.analyzer.entry_options[link_entry][option], prefixes[option], size - 1)
+        pos = self.link_conj_offsets[link_entry] + option
+        conj = self.link_conjs[pos]
+        return self.conj_conns[self.conj_offsets[conj]:self.conj_offsets[conj + 1]], self.link_slots[pos]
+
+
+class _LengthEnumerator(LengthSampler):
+    """
+    LengthSampler whose choices are scripted by a _ScriptedRandom: every choice is made among the
+    options that can still be completed, without regard to their counts, so replaying the script
+    visits every derivation of the target length once, without dead ends.
+    """
+    def choose(self, weights):
+        options = [index for index, weight in enumerate(weights) if weight]
+        return options[self.rng.randrange(0, len(options))]
+
+
+def enumerate_length_parses(grammar, length):
+    """
+    Yields the (sentence, parse) pair of every derivation of grammar with exactly length words,
+    laid out as GrammarSampler.generate_parse() does, without visiting derivations of other lengths.
+    Repeats sentences reached by several derivations.
+    """
+    rng = _ScriptedRandom()
+    sampler = _LengthEnumerator(grammar, length, rng=rng, use_weights=False)
+    if not sampler.count(length):
+        return
+    while True:
+        yield sampler.generate_parse()
+        if not rng.next_path():
+            return
+
+
+class UniformSampler(LengthSampler):
+    """
+    Draws parse trees uniformly at random among all derivations with at most max_length words
+    (or exactly length words, if given), words included: the sentence length is drawn in
+    proportion to the number of derivations of each length, and the tree is then built by
+    LengthSampler with lexical counts.
+
+    Unlike GrammarSampler, short and easy derivations are not favoured, so corpus coverage for a
+    given number of draws is much better. Sentences reached by several derivations (ambiguous
+    words or structures) are drawn in proportion to their number of derivations.
+    Beware that in recursive grammars most derivations are close to max_length words long.
+    Sampling weights of the grammar are ignored, since they would break uniformity.
+    """
+    def __init__(self, grammar, max_length=None, length=None, analyzer=None, rng=None):
+        """
+        :param max_length:  Max number of words in a sentence; required for recursive grammars
+        :param analyzer:    GrammarAnalyzer with lexical counts. Defaults to the cached one of grammar.
+        """
+        analyzer = analyzer_for(grammar, lexical=True) if analyzer is None else analyzer
+        super().__init__(grammar, length, analyzer, rng, use_weights=False)
+        if max_length is None or max_length > analyzer.longest_sentence():
+            max_length = analyzer.longest_sentence()
+        if max_length == math.inf:
+            raise ValueError("Uniform sampling of a recursive grammar needs a max_length")
+        self.max_length = max_length
+        # Cumulative number of derivations up to each length, to draw lengths from
+        self.cumulative = list(accumulate(analyzer.count_by_length(max_length)))
+        if not self.cumulative[-1]:
+            raise ValueError(f"Grammar has no sentences of at most {max_length} words")
+
+    def generate_derivation(self, starting_node=None, starting_rule=None):
+        length = self.length
+        if length is None:
+            if starting_node is not None:
+                raise ValueError("UniformSampler can't start from a given node without a given length")
+            self.length = bisect_right(self.cumulative, self.rng.randrange(self.cumulative[-1]))
+        try:
+            return super().generate_derivation(starting_node, starting_rule)
+        finally:
+            self.length = length
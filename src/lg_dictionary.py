@@ -0,0 +1,434 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Reader for Link Grammar dictionaries: tokenizer and recursive-descent parser for full LG
+# expressions ("&"/"and", "or", {optional}, [cost], (grouping), @multi-connectors, <macros>,
+# rules spanning several lines, quoted words), plus memoized and lazy expansion of expressions
+# into disjuncts, i.e. conjunctions of connectors.
+# Entries can be preceded by sampling weight annotations, which LG reads as comments:
+#   %weights words: kids=5 quite=2.5     weights of words of the entry (default: 1)
+#   %weights disjuncts: 3 1 1 2          weights of every disjunct of the entry, in expansion order
+#   %weights class: 2                    weight of the class, whenever a class is chosen
+
+import re
+from itertools import product
+
+MAX_DISJUNCTS = 10000  # Classes with more disjuncts than this are expanded lazily, while sampling
+MAX_MULTI = 2  # Max number of links drawn from a @multi-connector
+
+IGNORED_ENTRIES = {"ANDABLE-CONNECTORS"}  # Legacy entries that don't define words
+
+_TOKEN_RE = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<annotation>%weights\b[^\n]*)
+  | (?P<comment>%[^\n]*)
+  | (?P<quoted>"(?:[^"\\]|\\.)*")
+  | (?P<punct>[:;(){}\[\]&])
+  | (?P<bare>[^\s:;(){}\[\]&"%]+)
+""", re.VERBOSE)
+_CONNECTOR_RE = re.compile(r"^@?[a-z]?[A-Z][A-Za-z0-9_*]*[+-]$")
+_COST_RE = re.compile(r"^[0-9]*\.?[0-9]+$")
+
+
+class DictionaryError(Exception):
+    """
+    Syntax error in a Link Grammar dictionary
+    """
+    def __init__(self, message, line):
+        super().__init__(f"line {line}: {message}")
+        self.line = line
+
+
+def tokenize(text):
+    """
+    Splits dictionary text into (kind, value, line) tokens, where kind is "quoted", "punct",
+    "bare" (words, connectors, macro names and keywords) or "annotation" (weights comments).
+    Other comments start with "%".
+    """
+    line = 1
+    pos = 0
+    while pos < len(text):
+        match = _TOKEN_RE.match(text, pos)
+        if match is None:
+            raise DictionaryError(f"unexpected character {text[pos]!r}", line)
+        kind = match.lastgroup
+        value = match.group()
+        if kind == "quoted":
+            yield kind, re.sub(r"\\(.)", r"\1", value[1:-1]), line
+        elif kind in ("punct", "bare"):
+            yield kind, value, line
+        elif kind == "annotation":
+            yield kind, value[len("%weights"):].strip(), line
+        line += value.count('\n')
+        pos = match.end()
+
+
+class Expression:
+    """
+    Node of a parsed LG expression. op is one of:
+    "conn"  connector leaf; name is the connector without "@", repeated 1 to repeats times
+            (repeats > 1 for @multi-connectors)
+    "and"   conjunction of args, in order (no args: the empty conjunction, "()")
+    "or"    disjunction of args
+    "opt"   optional args[0], "{...}"
+    Macros are shared nodes, so results memoized in a node are reused by every rule using it.
+    """
+    __slots__ = ("op", "args", "name", "repeats", "_count", "_disjuncts")
+
+    def __init__(self, op, args=(), name=None, repeats=1):
+        self.op = op
+        self.args = tuple(args)
+        self.name = name
+        self.repeats = repeats
+        self._count = None
+        self._disjuncts = None
+
+    def count(self):
+        """
+        Number of disjuncts of the expression, without expanding it
+        """
+        if self._count is None:
+            if self.op == "conn":
+                self._count = self.repeats
+            elif self.op == "and":
+                self._count = 1
+                for arg in self.args:
+                    self._count *= arg.count()
+            elif self.op == "or":
+                self._count = sum(arg.count() for arg in self.args)
+            else:  # opt
+                self._count = 1 + self.args[0].count()
+        return self._count
+
+    def disjuncts(self):
+        """
+        Expands the expression into its list of disjuncts, tuples of connector names in rule order.
+        Expansions are memoized in every node.
+        """
+        if self._disjuncts is None:
+            if self.op == "conn":
+                self._disjuncts = [(self.name,) * times for times in range(1, self.repeats + 1)]
+            elif self.op == "and":
+                self._disjuncts = [sum(parts, ()) for parts in product(*(arg.disjuncts() for arg in self.args))]
+            elif self.op == "or":
+                self._disjuncts = [disj for arg in self.args for disj in arg.disjuncts()]
+            else:  # opt
+                self._disjuncts = [()] + self.args[0].disjuncts()
+        return self._disjuncts
+
+    def iter_disjuncts(self):
+        """
+        Yields the same disjuncts as disjuncts(), in the same order, without storing them
+        """
+        if self._disjuncts is not None:
+            yield from self._disjuncts
+        elif self.op == "conn":
+            for times in range(1, self.repeats + 1):
+                yield (self.name,) * times
+        elif self.op == "and":
+            yield from self._iter_product(0)
+        elif self.op == "or":
+            for arg in self.args:
+                yield from arg.iter_disjuncts()
+        else:  # opt
+            yield ()
+            yield from self.args[0].iter_disjuncts()
+
+    def _iter_product(self, start):
+        if start == len(self.args):
+            yield ()
+            return
+        for head in self.args[start].iter_disjuncts():
+            for tail in self._iter_product(start + 1):
+                yield head + tail
+
+    def connectors(self):
+        """
+        Set of connector names appearing in the expression
+        """
+        if self.op == "conn":
+            return {self.name}
+        return set().union(*(arg.connectors() for arg in self.args))
+
+
+class DictionaryParser:
+    """
+    Recursive-descent parser of Link Grammar dictionaries:
+
+    dictionary  := entry*
+    entry       := name+ ":" expression ";"
+    expression  := conjunction (("or") conjunction)*
+    conjunction := term (("&" | "and") term)*
+    term        := connector | <macro> | "(" [expression] ")" | "{" expression "}" | "[" [expression] "]" [cost]
+
+    Entries named by a single <name> define macros, usable in later expressions; all other
+    entries define a class with the listed words. Costs are parsed and ignored. Weights
+    annotations apply to the entry that follows them.
+    """
+    def __init__(self, text, max_multi=MAX_MULTI):
+        """
+        :param max_multi:   Max number of links drawn from a @multi-connector
+        """
+        self.max_multi = max_multi
+        self.tokens = []
+        self.annotations = {}  # Annotations before each token position
+        for token in tokenize(text):
+            if token[0] == "annotation":
+                self.annotations.setdefault(len(self.tokens), []).append(token)
+            else:
+                self.tokens.append(token)
+        self.pos = 0
+        self.macros = {}
+        self.entries = []  # (words, expression, weights) of every class, in file order
+
+    def parse(self):
+        while self.pos < len(self.tokens):
+            self.parse_entry()
+        return self.entries
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None, self.last_line())
+
+    def last_line(self):
+        return self.tokens[-1][2] if self.tokens else 1
+
+    def next(self):
+        token = self.peek()
+        if token[0] is None:
+            raise DictionaryError("unexpected end of dictionary", token[2])
+        self.pos += 1
+        return token
+
+    def expect(self, value):
+        kind, found, line = self.next()
+        if kind != "punct" or found != value:
+            raise DictionaryError(f"expected '{value}', found '{found}'", line)
+
+    def parse_entry(self):
+        annotations = self.annotations.get(self.pos, [])
+        names = []
+        while self.peek()[:2] != ("punct", ":"):
+            kind, value, line = self.next()
+            if kind == "punct":
+                raise DictionaryError(f"unexpected '{value}' in word list", line)
+            names.append(value)
+        line = self.peek()[2]
+        self.expect(":")
+        if not names:
+            raise DictionaryError("entry without words", line)
+        expression = self.parse_expression()
+        self.expect(";")
+        if len(names) == 1 and names[0].startswith('<') and names[0].endswith('>'):
+            if annotations:
+                raise DictionaryError(f"weights annotation of macro {names[0]}", annotations[0][2])
+            self.macros[names[0]] = expression
+        elif not (len(names) == 1 and names[0] in IGNORED_ENTRIES):
+            self.entries.append((names, expression, self.parse_weights(annotations, names, expression)))
+
+    @staticmethod
+    def parse_weights(annotations, names, expression):
+        """
+        Returns the weights given by the annotations of an entry, as a dictionary with the weight
+        of some "words", of all "disjuncts" (a list) and of the "class", where given
+        """
+        weights = {}
+        for _, text, line in annotations:
+            kind, colon, values = text.partition(':')
+            kind = kind.strip()
+            try:
+                if not colon or kind not in ("words", "disjuncts", "class"):
+                    raise ValueError
+                if kind == "words":
+                    items = [item.split('=') for item in values.split()]
+                    words = weights.setdefault("words", {})
+                    words.update((word, check_weight(float(value))) for word, value in items)
+                    if not words.keys() <= set(names):
+                        raise DictionaryError(f"weights of words not in the entry: {sorted(words.keys() - set(names))}",
+                                              line)
+                elif kind == "disjuncts":
+                    weights["disjuncts"] = [check_weight(float(value)) for value in values.split()]
+                    if len(weights["disjuncts"]) != expression.count():
+                        raise DictionaryError(f"{len(weights['disjuncts'])} disjunct weights for "
+                                              f"{expression.count()} disjuncts", line)
+                else:
+                    weights["class"] = check_weight(float(values))
+            except ValueError:
+                raise DictionaryError(f"invalid weights annotation '%weights {text}'", line)
+        return weights
+
+    def parse_expression(self):
+        args = [self.parse_conjunction()]
+        while self.peek()[:2] == ("bare", "or"):
+            self.next()
+            args.append(self.parse_conjunction())
+        return args[0] if len(args) == 1 else Expression("or", args)
+
+    def parse_conjunction(self):
+        args = [self.parse_term()]
+        while self.peek()[:2] in (("punct", "&"), ("bare", "and")):
+            self.next()
+            args.append(self.parse_term())
+        return args[0] if len(args) == 1 else Expression("and", args)
+
+    def parse_term(self):
+        kind, value, line = self.next()
+        if kind == "punct" and value in "([":
+            closing = ')' if value == '(' else ']'
+            if self.peek()[:2] == ("punct", closing):  # empty conjunction
+                term = Expression("and")
+            else:
+                term = self.parse_expression()
+            self.expect(closing)
+            if value == '[' and _COST_RE.match(str(self.peek()[1])):
+                self.next()  # explicit cost
+            return term
+        if kind == "punct" and value == '{':
+            term = self.parse_expression()
+            self.expect('}')
+            return Expression("opt", [term])
+        if kind == "bare" and value.startswith('<') and value.endswith('>'):
+            if value not in self.macros:
+                raise DictionaryError(f"undefined macro {value}", line)
+            return self.macros[value]
+        if kind == "bare" and _CONNECTOR_RE.match(value):
+            return Expression("conn", name=value.lstrip('@'), repeats=self.max_multi if value[0] == '@' else 1)
+        raise DictionaryError(f"unexpected '{value}' in expression", line)
+
+
+def parse_dictionary(text, max_multi=MAX_MULTI):
+    """
+    Parses the text of a Link Grammar dictionary, and returns the (words, expression, weights)
+    triple of every class, in file order (see DictionaryParser.parse_weights())
+    """
+    return DictionaryParser(text, max_multi).parse()
+
+
+def check_weight(weight):
+    """
+    Returns weight if it is a valid sampling weight, i.e. a positive finite number, else raises ValueError
+    """
+    if not 0 < weight < float("inf"):
+        raise ValueError(f"Invalid sampling weight {weight}, weights must be positive")
+    return weight
+
+
+class LazyDisjuncts:
+    """
+    Disjuncts of an expression too big to expand, sampled uniformly without expanding it.
+    Counts of disjuncts, and of disjuncts with and without connectors of a given set, are
+    computed on the expression tree and memoized per node, so sampling costs time proportional
+    to the size of the expression, not of its expansion.
+    Disjuncts with excluded connectors (see exclude()) are left out of counts and samples.
+    """
+    def __init__(self, expression):
+        self.expression = expression
+        self.excluded = frozenset()
+        self.without_counts = {}  # connector set -> {node id -> number of disjuncts without those connectors}
+
+    def exclude(self, connectors):
+        """
+        Prunes all disjuncts containing any of connectors
+        """
+        self.excluded = self.excluded.union(connectors)
+        self.without_counts = {}
+
+    def __iter__(self):
+        return (disj for disj in self.expression.iter_disjuncts() if not self.excluded.intersection(disj))
+
+    def connectors(self):
+        """
+        Set of connector names appearing in the disjuncts that are not pruned
+        """
+        return {conn for conn in self.expression.connectors() if self.count_with(frozenset([conn]))}
+
+    def count(self, node=None):
+        """
+        Number of disjuncts of the expression, or of its sub-expression node
+        """
+        return self.count_without(self.expression if node is None else node, frozenset())
+
+    def count_without(self, node, matches):
+        """
+        Number of disjuncts of node with no connector in matches (a frozenset)
+        """
+        memo = self.without_counts.setdefault(matches, {})
+        if id(node) not in memo:
+            if node.op == "conn":
+                count = 0 if node.name in matches or node.name in self.excluded else node.repeats
+            elif node.op == "and":
+                count = 1
+                for arg in node.args:
+                    count *= self.count_without(arg, matches)
+            elif node.op == "or":
+                count = sum(self.count_without(arg, matches) for arg in node.args)
+            else:  # opt
+                count = 1 + self.count_without(node.args[0], matches)
+            memo[id(node)] = count
+        return memo[id(node)]
+
+    def count_with(self, matches, node=None):
+        """
+        Number of disjuncts with at least one connector in matches (a frozenset)
+        """
+        node = self.expression if node is None else node
+        return self.count(node) - self.count_without(node, matches)
+
+    def sample(self, rng):
+        """
+        Returns a uniformly random disjunct of the expression
+        """
+        return self.sample_without(rng, frozenset(), self.expression)
+
+    def sample_with(self, rng, matches, node=None):
+        """
+        Returns a uniformly random disjunct among those with at least one connector in matches
+        """
+        node = self.expression if node is None else node
+        if node.op == "conn":
+            return self.sample_without(rng, frozenset(), node)
+        if node.op == "or":
+            weights = [self.count_with(matches, arg) for arg in node.args]
+            return self.sample_with(rng, matches, node.args[weighted_choice(rng, weights)])
+        if node.op == "opt":
+            return self.sample_with(rng, matches, node.args[0])
+        # Choose the first argument contributing a matching connector: the ones before it have none
+        weights = []
+        before = 1
+        for i, arg in enumerate(node.args):
+            after = 1
+            for other in node.args[i + 1:]:
+                after *= self.count(other)
+            weights.append(before * self.count_with(matches, arg) * after)
+            before *= self.count_without(arg, matches)
+        first = weighted_choice(rng, weights)
+        return (sum((self.sample_without(rng, matches, arg) for arg in node.args[:first]), ())
+                + self.sample_with(rng, matches, node.args[first])
+                + sum((self.sample_without(rng, frozenset(), arg) for arg in node.args[first + 1:]), ()))
+
+    def sample_without(self, rng, matches, node):
+        """
+        Returns a uniformly random disjunct of node with no connector in matches
+        """
+        if node.op == "conn":
+            return (node.name,) * (rng.randrange(node.repeats) + 1 if node.repeats > 1 else 1)
+        if node.op == "and":
+            return sum((self.sample_without(rng, matches, arg) for arg in node.args), ())
+        if node.op == "or":
+            weights = [self.count_without(arg, matches) for arg in node.args]
+            return self.sample_without(rng, matches, node.args[weighted_choice(rng, weights)])
+        if rng.randrange(self.count_without(node, matches)) == 0:  # opt: empty, or a disjunct of its argument
+            return ()
+        return self.sample_without(rng, matches, node.args[0])
+
+
+def weighted_choice(rng, weights):
+    """
+    Returns an index of weights chosen with probability proportional to its (integer) weight.
+    Exact for arbitrarily large counts, since it only draws one integer below their sum.
+    """
+    target = rng.randrange(sum(weights))
+    for index, weight in enumerate(weights):
+        if target < weight:
+            return index
+        target -= weight
+    raise ValueError("weights must be non-negative")
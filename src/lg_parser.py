@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Link Grammar parser for the grammars of this repo: tells whether sentences parse, counts their
+# linkages and lists them, with the dynamic programming algorithm of Sleator and Temperley
+# ("Parsing English with a Link Grammar", 1991) over memoized (span, connectors) tables.
+# Linkages follow the conventions of GrammarSampler: no LEFT-WALL, every connector of the chosen
+# disjunct of each word links exactly once, links don't cross, and all words are connected.
+
+import sys
+import getopt
+from contextlib import contextmanager
+from itertools import islice
+from multiprocessing import Pool
+from sentence_generator import Grammar
+from baselines import read_corpus, sentence_words, format_parse
+
+CHUNK_SIZE = 1000  # Sentences sent to a worker at once
+NO_MATCHES = frozenset()
+FRAMES_PER_WORD = 4  # Bound on the recursion depth of the chart per word of the sentence
+
+_worker_parser = None  # Parser of the current worker process
+
+
+def main(argv):
+    """
+        Lg_parser parses a corpus with a grammar, and reports its parseability and ambiguity.
+
+        "Usage: lg_parser.py -g <grammar_file> -i <corpus_file> [-o <counts_file> -u <ull_file>
+                             --workers <num_workers> --grammar_cache <cache_dir>]"
+
+        grammar_file        Grammar in Link Grammar format, e.g. the one a corpus was generated from
+        corpus_file         Corpus to parse, one sentence per line; a final "." is ignored
+        counts_file         File to write the number of linkages of every sentence to, followed by
+                            a tab and the sentence
+        ull_file            File to write the first linkage of every sentence to, in ULL format;
+                            sentences that don't parse have no links
+        num_workers         Number of processes parsing sentences (default: 1)
+        cache_dir           Directory of compiled grammar files (see corpus_generator.py)
+    """
+    grammar_file = ''
+    corpus_file = ''
+    counts_file = None
+    ull_file = None
+    workers = 1
+    grammar_cache = None
+
+    usage = '''Usage: lg_parser.py -g <grammar_file> -i <corpus_file> [-o <counts_file> -u <ull_file>
+                             --workers <num_workers> --grammar_cache <cache_dir>]'''
+    try:
+        opts, args = getopt.getopt(argv, "hg:i:o:u:", ["grammar=", "input=", "outfile=", "ull=", "workers=",
+                                                       "grammar_cache="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-g", "--grammar"):
+            grammar_file = arg
+        elif opt in ("-i", "--input"):
+            corpus_file = arg
+        elif opt in ("-o", "--outfile"):
+            counts_file = arg
+        elif opt in ("-u", "--ull"):
+            ull_file = arg
+        elif opt == "--workers":
+            workers = int(arg)
+        elif opt == "--grammar_cache":
+            grammar_cache = arg
+
+    if grammar_file == '' or corpus_file == '':
+        raise getopt.GetoptError("Grammar and corpus files must be specified")
+
+    parser = LinkParser(Grammar(grammar_file, cache_dir=grammar_cache))
+    summary = parse_corpus(parser, corpus_file, counts_file, ull_file, workers)
+    print(f"{summary['parsed']} of {summary['sentences']} sentences parse "
+          f"(parseability {100 * summary['parseability']:.2f}%), {summary['ambiguous']} have several linkages "
+          f"(up to {summary['max_linkages']})")
+
+
+class LinkParser:
+    """
+    Parser of sentences with the disjuncts of a Grammar. Each disjunct is split into its left and right
+    connectors, listed from the farthest to the nearest word, the order in which the algorithm links them.
+    """
+    def __init__(self, grammar):
+        if grammar.lazy_classes:
+            raise ValueError("Can't parse with classes too big to expand, load the grammar with more max_disjuncts")
+        conn_ids = grammar.compiled.conn_ids
+        # Disjuncts of every word, over all its classes; repeated disjuncts give the same linkages
+        self.word_disjuncts = {}
+        for gram_class, words in grammar.word_dict.items():
+            disjuncts = []
+            for conj in grammar.disj_dict[gram_class]:
+                disjuncts.append((tuple(conn_ids[conn] for conn in reversed(conj) if conn[-1] == '-'),
+                                  tuple(conn_ids[conn] for conn in reversed(conj) if conn[-1] == '+')))
+            for word in words:
+                known = self.word_disjuncts.setdefault(word, [])
+                known.extend(disjunct for disjunct in disjuncts if disjunct not in known)
+        self.conn_names = grammar.compiled.conn_names
+        # Pairs (right connector of the left word, left connector of the right word) that link
+        self.matches = {(conn_ids[conn], conn_ids[linked]) for conn, linked_conns in grammar.link_dict.items()
+                        if conn[-1] == '+' for linked in linked_conns}
+        self.right_matches = {}  # left connectors each right connector links to
+        self.left_matches = {}  # and right connectors each left connector links to
+        for right, left in self.matches:
+            self.right_matches.setdefault(right, set()).add(left)
+            self.left_matches.setdefault(left, set()).add(right)
+
+    def chart(self, words):
+        """
+        Returns the ParseChart of a sentence, given as a list of words
+        """
+        return ParseChart(self, words)
+
+    def count_linkages(self, words):
+        return self.chart(words).count()
+
+    def parses(self, words):
+        """
+        Checks if a sentence, given as a list of words, has any linkage
+        """
+        return self.chart(words).count() > 0
+
+    def linkages(self, words, limit=None):
+        """
+        Returns the linkages of a sentence (at most limit of them), see ParseChart.linkages()
+        """
+        return self.chart(words).linkages(limit)
+
+    def prune(self, disjuncts):
+        """
+        Removes the disjuncts of each position of a sentence with a connector that can't link to any
+        disjunct of the words on its side, or with more connectors than words on a side, until none is
+        left, so that the chart only explores disjuncts that may be used
+        """
+        num_words = len(disjuncts)
+        while True:
+            # Connectors of the disjuncts before (right connectors) and after (left connectors) each position
+            before = [set()]
+            for position in range(num_words - 1):
+                before.append(before[-1].union(*(right for left, right in disjuncts[position])))
+            after = [set()]
+            for position in range(num_words - 1, 0, -1):
+                after.append(after[-1].union(*(left for left, right in disjuncts[position])))
+            after.reverse()
+            pruned = False
+            for position, candidates in enumerate(disjuncts):
+                kept = [(left, right) for left, right in candidates
+                        if len(left) <= position and len(right) < num_words - position
+                        and all(not self.left_matches.get(conn, NO_MATCHES).isdisjoint(before[position])
+                                for conn in left)
+                        and all(not self.right_matches.get(conn, NO_MATCHES).isdisjoint(after[position])
+                                for conn in right)]
+                if len(kept) < len(candidates):
+                    disjuncts[position] = kept
+                    pruned = True
+            if not pruned:
+                return disjuncts
+
+
+class ParseChart:
+    """
+    Memoized parse of one sentence. _count(L, R, l, r) is the number of ways of linking the words strictly
+    between positions L and R, so that the connectors l of L and r of R (farthest first) that are still
+    unlinked link to them, and all of them are connected to L or R. Such a linkage is split at the word W
+    that the farthest connector of l links to, or if l is empty, that the farthest connector of r links to.
+    """
+    def __init__(self, parser, words):
+        self.parser = parser
+        self.words = words
+        self.matches = parser.matches
+        self.memo = {}
+        if all(word in parser.word_disjuncts for word in words):
+            self.disjuncts = parser.prune([list(parser.word_disjuncts[word]) for word in words])
+        else:  # unknown words don't parse
+            self.disjuncts = [[] for _ in words]
+
+    def count(self):
+        """
+        Number of linkages of the sentence. The first word can't have left connectors, and the rest hang
+        from it: they lie between it and a boundary after the last word, which has no connectors.
+        """
+        if not self.words:
+            return 0
+        with self.recursion_limit():
+            return sum(self._count(0, len(self.words), right, ()) for left, right in self.disjuncts[0] if not left)
+
+    @contextmanager
+    def recursion_limit(self):
+        """
+        Raises the recursion limit of the interpreter enough for the chart of long sentences
+        """
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(limit + FRAMES_PER_WORD * len(self.words))
+        try:
+            yield
+        finally:
+            sys.setrecursionlimit(limit)
+
+    def _count(self, left_pos, right_pos, left_conns, right_conns):
+        key = (left_pos, right_pos, left_conns, right_conns)
+        if key in self.memo:
+            return self.memo[key]
+        span = right_pos - left_pos - 1
+        if span == 0:
+            total = int(not left_conns and not right_conns)
+        elif (not left_conns and not right_conns) or len(left_conns) > span or len(right_conns) > span:
+            total = 0  # words left out, or connectors without enough words to link to
+        else:
+            total = 0
+            for word, word_left, word_right in self._splits(left_pos, right_pos, left_conns, right_conns):
+                left_count = self._count(left_pos, word, left_conns[1:], word_left[1:]) \
+                    if self._links(left_conns, word_left) else 0
+                right_count = self._count(word, right_pos, word_right[1:], right_conns[1:]) \
+                    if self._links(word_right, right_conns) else 0
+                total += left_count * right_count
+                if left_count:  # word only links to the left
+                    total += left_count * self._count(word, right_pos, word_right, right_conns)
+                if right_count and not left_conns:  # word only links to the right
+                    total += right_count * self._count(left_pos, word, left_conns, word_left)
+        self.memo[key] = total
+        return total
+
+    def _links(self, left_conns, right_conns):
+        """
+        Checks if the farthest connectors of two lists, of a word and of a word to its right, link
+        """
+        return bool(left_conns) and bool(right_conns) and (left_conns[0], right_conns[0]) in self.matches
+
+    def _splits(self, left_pos, right_pos, left_conns, right_conns):
+        """
+        Yields the words and disjuncts between left_pos and right_pos that can split a linkage of the span:
+        linked to the farthest connector of left_conns, or of right_conns if left_conns is empty
+        """
+        for word in range(left_pos + 1, right_pos):
+            for word_left, word_right in self.disjuncts[word]:
+                if self._links(left_conns, word_left) or (not left_conns and self._links(word_right, right_conns)):
+                    yield word, word_left, word_right
+
+    def linkages(self, limit=None):
+        """
+        Returns the linkages of the sentence (the first limit ones, if given), each as a sorted tuple of its
+        links (left position, right position, left connector, right connector), with positions from 1
+        """
+        if not self.count():
+            return []
+        linkages = (tuple(sorted(links)) for left, right in self.disjuncts[0] if not left
+                    for links in self._linkages(0, len(self.words), right, ()))
+        with self.recursion_limit():
+            return list(islice(linkages, limit))
+
+    def _linkages(self, left_pos, right_pos, left_conns, right_conns):
+        """
+        Yields the links of every linkage counted by _count()
+        """
+        if not self._count(left_pos, right_pos, left_conns, right_conns):
+            return
+        if right_pos - left_pos == 1:
+            yield ()
+            return
+        for word, word_left, word_right in self._splits(left_pos, right_pos, left_conns, right_conns):
+            left_linked = self._links(left_conns, word_left)
+            right_linked = self._links(word_right, right_conns)
+            left_link = (self._link(left_pos, word, left_conns, word_left),) if left_linked else ()
+            right_link = (self._link(word, right_pos, word_right, right_conns),) if right_linked else ()
+            if left_linked and right_linked:
+                for left_links in self._linkages(left_pos, word, left_conns[1:], word_left[1:]):
+                    for right_links in self._linkages(word, right_pos, word_right[1:], right_conns[1:]):
+                        yield left_link + left_links + right_link + right_links
+            if left_linked:
+                for left_links in self._linkages(left_pos, word, left_conns[1:], word_left[1:]):
+                    for right_links in self._linkages(word, right_pos, word_right, right_conns):
+                        yield left_link + left_links + right_links
+            if right_linked and not left_conns:
+                for right_links in self._linkages(word, right_pos, word_right[1:], right_conns[1:]):
+                    for left_links in self._linkages(left_pos, word, left_conns, word_left):
+                        yield left_links + right_link + right_links
+
+    def _link(self, left_pos, right_pos, left_conns, right_conns):
+        names = self.parser.conn_names
+        return left_pos + 1, right_pos + 1, names[left_conns[0]], names[right_conns[0]]
+
+
+def parse_corpus(parser, corpus_file: str, counts_file: str = None, ull_file: str = None, workers: int = 1,
+                 chunk_size: int = CHUNK_SIZE):
+    """
+    Parses every sentence of corpus_file, writes the number of linkages of each one to counts_file and its
+    first linkage to ull_file (if given), and returns a summary: number of sentences, of sentences that
+    parse and their fraction (parseability), of sentences with several linkages, and the most linkages
+    of a sentence
+    """
+    summary = {"sentences": 0, "parsed": 0, "ambiguous": 0, "max_linkages": 0}
+    sentences = read_corpus(corpus_file)
+    chunks = iter(lambda: list(islice(sentences, chunk_size)), [])
+    fcounts = open(counts_file, 'w') if counts_file else None
+    fparses = open(ull_file, 'w') if ull_file else None
+    _init_worker(parser)
+    pool = Pool(workers, initializer=_init_worker, initargs=(parser,)) if workers > 1 else None
+    try:
+        for chunk, results in parse_chunks(chunks, pool, workers):
+            for sentence, (count, links) in zip(chunk, results):
+                summary["sentences"] += 1
+                summary["parsed"] += count > 0
+                summary["ambiguous"] += count > 1
+                summary["max_linkages"] = max(summary["max_linkages"], count)
+                if fcounts:
+                    fcounts.write(f"{count}\t{sentence}\n")
+                if fparses:
+                    fparses.write(sentence + '\n')
+                    fparses.write(format_parse(sentence_words(sentence), links) + '\n\n')
+    finally:
+        for fo in (fcounts, fparses):
+            if fo:
+                fo.close()
+        if pool:
+            pool.terminate()
+    summary["parseability"] = summary["parsed"] / max(summary["sentences"], 1)
+    return summary
+
+
+def parse_chunks(chunks, pool=None, workers: int = 1):
+    """
+    Yields every chunk of sentences with its results, parsed in the current process, or on pool
+    """
+    if pool is None:
+        for chunk in chunks:
+            yield chunk, _parse_chunk(chunk)
+        return
+    # Submit a few chunks per worker at a time, so the corpus isn't read into memory at once
+    while True:
+        batch = list(islice(chunks, 4 * workers))
+        if not batch:
+            break
+        yield from zip(batch, pool.imap(_parse_chunk, batch))
+
+
+def _init_worker(parser):
+    global _worker_parser
+    _worker_parser = parser
+
+
+def _parse_chunk(chunk):
+    """
+    Parsing task run by workers: returns the number of linkages of each sentence of chunk, and the
+    (left, right) positions of the links of its first linkage
+    """
+    results = []
+    for sentence in chunk:
+        chart = _worker_parser.chart(sentence_words(sentence))
+        count = chart.count()
+        links = [(left, right) for left, right, _, _ in chart.linkages(1)[0]] if count else []
+        results.append((count, links))
+    return results
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Evaluation of parses against a gold standard, both in ULL format: precision, recall and F1
+# of the links of each sentence, and over the whole corpus.
+
+import sys
+import getopt
+import json
+import numpy as np
+from ull_reader import read_ull
+
+
+def main(argv):
+    """
+        Parse_evaluator compares candidate parses to gold-standard ones.
+
+        "Usage: parse_evaluator.py -g <gold_file> -t <test_file> [-o <report_file> --keep_wall --per_sentence]"
+
+        gold_file           Gold-standard parses in ULL format, e.g. written by corpus_generator
+        test_file           Parses to evaluate, in ULL format, of the same sentences in the same order
+        report_file         File to write the evaluation report to, in JSON format (default: stdout)
+        keep_wall           Also evaluate links to ###LEFT-WALL### (word 0), which are ignored by default
+        per_sentence        Include the scores of every sentence in the report
+    """
+    gold_file = ''
+    test_file = ''
+    report_file = None
+    ignore_wall = True
+    per_sentence = False
+
+    usage = "Usage: parse_evaluator.py -g <gold_file> -t <test_file> [-o <report_file> --keep_wall --per_sentence]"
+    try:
+        opts, args = getopt.getopt(argv, "hg:t:o:", ["gold=", "test=", "outfile=", "keep_wall", "per_sentence"])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-g", "--gold"):
+            gold_file = arg
+        elif opt in ("-t", "--test"):
+            test_file = arg
+        elif opt in ("-o", "--outfile"):
+            report_file = arg
+        elif opt == "--keep_wall":
+            ignore_wall = False
+        elif opt == "--per_sentence":
+            per_sentence = True
+
+    if gold_file == '' or test_file == '':
+        raise getopt.GetoptError("Gold and test files must be specified")
+
+    report = evaluate_files(gold_file, test_file, ignore_wall, per_sentence)
+    if report_file is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(report_file, 'w') as fo:
+            json.dump(report, fo, indent=2)
+        print(f"F1 score = {100 * report['sentence_average']['f1']:.2f}%")
+
+
+def evaluate_files(gold_file: str, test_file: str, ignore_wall: bool = True, per_sentence: bool = False):
+    """
+    Reads and evaluates test_file against gold_file, and returns the report of evaluate()
+    """
+    report = evaluate(read_ull(gold_file, ignore_wall), read_ull(test_file, ignore_wall), per_sentence)
+    report.update({"gold_file": gold_file, "test_file": test_file, "ignore_wall": ignore_wall})
+    return report
+
+
+def sentence_scores(gold, test):
+    """
+    Returns the number of matched, gold and test links of each sentence of the aligned ParseSets
+    gold and test, as arrays. Repeated links count once.
+    """
+    if len(gold) != len(test):
+        raise ValueError(f"Gold standard has {len(gold)} sentences, but parses to evaluate have {len(test)}")
+    different = np.flatnonzero(np.array(gold.sentences, dtype=object) != np.array(test.sentences, dtype=object))
+    if len(different):
+        raise ValueError(f"{len(different)} sentences differ from the gold standard, first is sentence "
+                         f"{different[0] + 1}: '{gold.sentences[different[0]]}' vs '{test.sentences[different[0]]}'")
+
+    # Every link becomes an integer key (sentence, left, right), and sets are compared on those keys
+    base = int(max(gold.right.max(initial=0), test.right.max(initial=0))) + 1
+    gold_keys = unique_sorted(gold.link_keys(base))
+    test_keys = unique_sorted(test.link_keys(base))
+    matched_keys = np.intersect1d(gold_keys, test_keys, assume_unique=True)
+    sentence_of = base * base
+    return (np.bincount(matched_keys // sentence_of, minlength=len(gold)),
+            np.bincount(gold_keys // sentence_of, minlength=len(gold)),
+            np.bincount(test_keys // sentence_of, minlength=len(gold)))
+
+
+def unique_sorted(keys):
+    """
+    Returns the sorted distinct values of integer array keys; faster than np.unique() on big arrays
+    """
+    keys = np.sort(keys)
+    return keys[np.concatenate(([True], keys[1:] != keys[:-1]))] if len(keys) else keys
+
+
+def f1_score(precision, recall):
+    """
+    Harmonic mean of precision and recall (arrays or numbers), 0 where both are 0
+    """
+    total = precision + recall
+    return np.divide(2 * precision * recall, total, out=np.zeros_like(total, dtype=float), where=total > 0)
+
+
+def evaluate(gold, test, per_sentence: bool = False):
+    """
+    Evaluates the links of ParseSet test against those of ParseSet gold, sentence by sentence.
+    Returns a report dictionary with:
+    - precision, recall and f1 over all links of the corpus
+    - sentence_average: precision and recall averaged over sentences, and their f1. A sentence
+      without test (gold) links has precision (recall) 1 if it has no gold (test) links either, else 0
+    - per_sentence (if requested): list of the precision, recall and f1 of each sentence
+    """
+    matched, gold_links, test_links = sentence_scores(gold, test)
+    precision = np.where(test_links > 0, matched / np.maximum(test_links, 1), (gold_links == 0).astype(float))
+    recall = np.where(gold_links > 0, matched / np.maximum(gold_links, 1), (test_links == 0).astype(float))
+
+    total_precision = matched.sum() / max(test_links.sum(), 1)
+    total_recall = matched.sum() / max(gold_links.sum(), 1)
+    average_precision = precision.mean() if len(gold) else 0.0
+    average_recall = recall.mean() if len(gold) else 0.0
+    report = {
+        "sentences": len(gold),
+        "gold_links": int(gold_links.sum()),
+        "test_links": int(test_links.sum()),
+        "matched_links": int(matched.sum()),
+        "precision": float(total_precision),
+        "recall": float(total_recall),
+        "f1": float(f1_score(np.float64(total_precision), np.float64(total_recall))),
+        "sentence_average": {
+            "precision": float(average_precision),
+            "recall": float(average_recall),
+            "f1": float(f1_score(np.float64(average_precision), np.float64(average_recall))),
+        },
+        "perfect_sentences": int(np.count_nonzero((precision == 1) & (recall == 1))),
+    }
+    if per_sentence:
+        report["per_sentence"] = [{"precision": p, "recall": r, "f1": f} for p, r, f in
+                                  zip(precision.tolist(), recall.tolist(), f1_score(precision, recall).tolist())]
+    return report
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -5,25 +5,235 @@
 # Based on CFG sentence generator at:
 # https://eli.thegreenplace.net/2010/01/28/generating-random-sentences-from-a-context-free-grammar
 
+import hashlib
+import json
+import logging
+import os
 import numpy as np
 import random as rand
-import re
+from bisect import bisect_left
+from compiled_grammar import CompiledGrammar
+from lg_dictionary import parse_dictionary, check_weight, LazyDisjuncts, MAX_DISJUNCTS, MAX_MULTI
+from alias_tables import AliasTables
+
+RESOLVE_REPLAY_SIZE = 16384  # Largest tree whose word order is resolved by replaying list inserts
+MAX_LENGTH = 100  # Default word budget of a derivation; runaway ones are resampled once they reach it
+CACHE_FORMAT = 2  # Version of compiled grammar cache files; changing it invalidates existing ones
+# Grammar dictionaries that are rebuilt from the compiled grammar when it is loaded from a cache file
+DERIVED_ATTRIBUTES = ("disj_dict", "word_dict", "conn_dict", "conj_slots", "link_dict", "linked_classes",
+                      "conj_index", "word_weights", "disj_weights", "class_weights")
+
+logger = logging.getLogger(__name__)
+
+
+def swap_connector(connector):
+    """
+    Change direction of connection to given connector
+    :param connector:
+    :return: Connector in opposite direction
+    """
+    direction = connector[-1]
+    if direction == '+':
+        opposite_direction = '-'
+    elif direction == '-':
+        opposite_direction = '+'
+    else:
+        print("ERROR: Connector missing directionality in grammar file!!!")
+        exit(1)
+    return connector[:-1] + opposite_direction
+
+
+def subscripts_match(body, other):
+    """
+    Checks if two connector bodies (without direction) agree in all the characters they both
+    have, where "*" matches any character, as in LG subscripts
+    """
+    return all(a == b or a == '*' or b == '*' for a, b in zip(body, other))
+
+
+def read_weights(weights_file):
+    """
+    Reads a JSON file of sampling weights, with any of the keys:
+    "words"         weight of each word, in every class listing it, e.g. {"kids": 5, "quite": 2.5}
+    "disjuncts"     weight of each disjunct, by its connectors joined with " & ", in every class having it
+    "classes"       weight of each class, by its number in the grammar file (entries from 0)
+    Weights not given are 1.
+    """
+    with open(weights_file, 'r') as fw:
+        weights = json.load(fw)
+    unknown = set(weights) - {"words", "disjuncts", "classes"}
+    if unknown:
+        raise ValueError(f"Unknown keys in weights file {weights_file}: {sorted(unknown)}")
+    for kind in weights.values():
+        for weight in kind.values():
+            check_weight(weight)
+    return weights
+
+
+def check_match(connector, rule):
+    """
+    Checks if connector (or a LG generalization of it) matches a connector inside rule
+    :param connector:
+    :param rule:
+    :return:
+    """
+    # Check capital letters first
+    connector_caps = [c for c in connector if c.isupper()]
+    for conn in rule:
+        conn_caps = [c for c in conn if c.isupper()]
+        if connector_caps == conn_caps:  # Compare in detail only if capitals match
+            # Shorter connector generalizes the longer one; don't count direction
+            if conn[-1] == connector[-1] and subscripts_match(conn[:-1], connector[:-1]):
+                return True
+
+    return False
 
 
 class Grammar:
     """
     Class containing a link-parser grammar
     """
-    def __init__(self, grammar_file):
+    def __init__(self, grammar_file, max_disjuncts=MAX_DISJUNCTS, max_multi=MAX_MULTI, cache_dir=None,
+                 weights_file=None):
         """
         Initialize grammar. Reads grammar from Link Grammar-formatted file.
         :param grammar_file:
+        :param max_disjuncts:   Classes with more disjuncts than this are not expanded, but sampled lazily
+        :param max_multi:       Max number of links drawn from a @multi-connector
+        :param cache_dir:       Directory of compiled grammar files. If given, the grammar is loaded from the
+                                file compiled from the same source and parameters, skipping parsing, or
+                                compiled and saved there. The dictionaries below are then rebuilt on first use.
+        :param weights_file:    JSON file of sampling weights (see read_weights()), which override the
+                                weights annotations of the grammar file
         """
+        self.lazy_classes = {}  # Stores LazyDisjuncts of classes too big to expand; their disj_dict is empty
+        if cache_dir is not None:
+            with open(grammar_file, 'rb') as fg:
+                source = fg.read()
+            if weights_file is not None:
+                with open(weights_file, 'rb') as fw:
+                    source += b"\0" + fw.read()
+            cache_file = os.path.join(cache_dir, self.cache_key(source, max_disjuncts, max_multi) + ".rgc")
+            if os.path.exists(cache_file):
+                try:
+                    self.compiled = CompiledGrammar.load(cache_file)
+                    return
+                except (ValueError, KeyError, OSError) as error:
+                    logger.warning(f"Ignoring unreadable grammar cache {cache_file}: {error}")
+
         self.disj_dict = {}  # Stores disjuncts for each class
         self.word_dict = {}  # Stores vocab for each class
         self.conn_dict = {}  # Stores which classes contain each connector
-        self.grammar_parser(grammar_file)
+        self.conj_slots = {}  # Stores which conjuncts of a class contain a connector, and where
+        self.link_dict = {}  # Stores which connectors can link to each connector
+        self.linked_classes = {}  # Stores which classes can link to each connector
+        self.conj_index = {}  # Stores valid conjuncts for each (class, incoming connector) pair
+        self.word_weights = {}  # Stores sampling weights of the words of each class, if not all 1
+        self.disj_weights = {}  # Stores sampling weights of the disjuncts of each class, if not all 1
+        self.class_weights = {}  # Stores sampling weight of each class, if not 1
+        self.grammar_parser(grammar_file, max_disjuncts, max_multi)
+        if weights_file is not None:
+            self.apply_weights(read_weights(weights_file))
+        self.build_index()
+        if cache_dir is not None and not self.lazy_classes:  # expressions of lazy classes can't be cached
+            os.makedirs(cache_dir, exist_ok=True)
+            self.compiled.save(cache_file, {"source": os.path.abspath(grammar_file), "format": CACHE_FORMAT,
+                                            "max_disjuncts": max_disjuncts, "max_multi": max_multi})
+
+    @classmethod
+    def from_dicts(cls, disj_dict, word_dict, weights=None):
+        """
+        Builds a grammar from its dictionaries instead of a file, e.g. a randomly generated one
+        :param disj_dict:   Conjuncts (lists of connector strings) of each class number
+        :param word_dict:   Words of each class number
+        :param weights:     Sampling weights, as read by read_weights()
+        """
+        grammar = cls.__new__(cls)
+        grammar.lazy_classes = {}
+        grammar.disj_dict = {k: [list(conj) for conj in disj] for k, disj in disj_dict.items()}
+        grammar.word_dict = {k: list(words) for k, words in word_dict.items()}
+        grammar.conn_dict, grammar.conj_slots, grammar.link_dict, grammar.linked_classes, grammar.conj_index = \
+            {}, {}, {}, {}, {}
+        grammar.word_weights, grammar.disj_weights, grammar.class_weights = {}, {}, {}
+        if weights is not None:
+            grammar.apply_weights(weights)
+        grammar.build_index()
+        return grammar
+
+    def apply_weights(self, weights):
+        """
+        Sets the sampling weights given by name in weights (see read_weights()), before the grammar is indexed
+        """
+        words = weights.get("words", {})
+        disjuncts = weights.get("disjuncts", {})
+        classes = weights.get("classes", {})
+        for gram_class in self.disj_dict:
+            word_weights = self.word_weights.get(gram_class, [1] * len(self.word_dict[gram_class]))
+            disj_weights = self.disj_weights.get(gram_class, [1] * len(self.disj_dict[gram_class]))
+            self.set_weights(gram_class,
+                             [words.get(word, weight)
+                              for word, weight in zip(self.word_dict[gram_class], word_weights)],
+                             [disjuncts.get(" & ".join(conj), weight)
+                              for conj, weight in zip(self.disj_dict[gram_class], disj_weights)],
+                             classes.get(str(gram_class), self.class_weights.get(gram_class, 1)))
+
+    def set_weights(self, gram_class, word_weights=None, disj_weights=None, class_weight=1):
+        """
+        Sets the sampling weights of the words, disjuncts and class gram_class, only kept if not all 1
+        """
+        for weights, values in ((self.word_weights, word_weights), (self.disj_weights, disj_weights)):
+            if values is not None and any(value != 1 for value in values):
+                weights[gram_class] = list(values)
+            else:
+                weights.pop(gram_class, None)
+        if class_weight != 1:
+            self.class_weights[gram_class] = class_weight
+        else:
+            self.class_weights.pop(gram_class, None)
+
+    def build_index(self):
+        """
+        Builds the matching index of the parsed dictionaries, prunes them and compiles the grammar
+        """
         self.build_conn_dict()
+        self.build_match_index()
+        self.prune_disjuncts()
+        self.compiled = CompiledGrammar(self)  # Integer-interned form used by samplers
+
+    @staticmethod
+    def cache_key(source, max_disjuncts=MAX_DISJUNCTS, max_multi=MAX_MULTI):
+        """
+        Name of the compiled grammar file of source (the bytes of a grammar file) and parsing parameters
+        """
+        key = hashlib.sha256(source)
+        key.update(f"|{max_disjuncts}|{max_multi}|{CACHE_FORMAT}".encode())
+        return key.hexdigest()
+
+    def __getattr__(self, name):
+        # Only called for missing attributes: dictionaries of a grammar loaded from a cache file
+        if name in DERIVED_ATTRIBUTES and "compiled" in self.__dict__:
+            self.decompile()
+            return self.__dict__[name]
+        raise AttributeError(f"'Grammar' object has no attribute '{name}'")
+
+    def decompile(self):
+        """
+        Rebuilds the string dictionaries and matching index from the compiled grammar
+        """
+        cg = self.compiled
+        self.disj_dict = {k: [cg.conjunct_names(conj) for conj in cg.class_conjuncts(k)]
+                          for k in range(cg.num_classes)}
+        self.word_dict = {k: [cg.vocab[word] for word in cg.class_words[cg.class_word_offsets[k]:
+                                                                          cg.class_word_offsets[k + 1]]]
+                          for k in range(cg.num_classes)}
+        self.word_weights, self.disj_weights, self.class_weights = {}, {}, {}
+        for k in range(cg.num_classes):
+            self.set_weights(k, cg.word_weights[cg.class_word_offsets[k]:cg.class_word_offsets[k + 1]].tolist(),
+                             cg.conj_weights[cg.class_conj_offsets[k]:cg.class_conj_offsets[k + 1]].tolist(),
+                             float(cg.class_weights[k]))
+        self.conn_dict, self.conj_slots, self.link_dict, self.linked_classes, self.conj_index = {}, {}, {}, {}, {}
+        self.build_conn_dict()
+        self.build_match_index()
 
     def set_disj_dict(self, disj_dict):
         self.disj_dict = disj_dict
@@ -34,67 +244,363 @@ class Grammar:
     def set_word_dict(self, word_dict):
         self.word_dict = word_dict
 
-    def grammar_parser(self, grammar_file):
+    def grammar_parser(self, grammar_file, max_disjuncts=MAX_DISJUNCTS, max_multi=MAX_MULTI):
         """
         Opens a given grammar file and parses both vocabulary
         and disjuncts from each class, then puts them in the
         proper class variables.
         """
         with open(grammar_file, 'r') as fg:
-            data = fg.readlines()
-
-        # Read content in grammar file
-        # File format is very specific:
-        # a) All comments start with % or <
-        # b) For each rule, vocabulary comes in a single line, which ends in colon.
-        # c) Rules come in a single line, which ends in semi-colon, and each rule has
-        # to be an explicit conjunction of connectors, surrounded by parenthesis or not. "&" operator has priority
-        # over "or" operator.
-        class_num = 0
-        rules = {}
-        for line in data:
-            line = re.sub(r"[)(\n]", "", line)  # remove all parenthesis and newlines
-            if re.search(r"^[^%<]*: *$", line):  # Lines that contain vocabulary list
-                line = re.sub(r"\"", "", line)  # remove all quotes from vocabulary
-                self.word_dict[class_num] = line.split()  # parse vocabulary
-                self.word_dict[class_num][-1] = self.word_dict[class_num][-1].rstrip(':')  # remove final ":"
-            elif re.search(r"^[^%<]*; *$", line):  # Lines that contain rules list
-                rules[class_num] = line.split(" or ")
-                rules[class_num][-1] = rules[class_num][-1].rstrip(';')  # remove final ";"
-                class_num += 1
-
-        # Parse disjuncts. The file format must show a disjunction of explicit conjunctions (no short-hand notation)
-        # E.g.  (AB+ & CD-) or (CD-) or (CD- & AE+ & AB+);
-        for key, value in rules.items():
-            self.disj_dict[key] = [conn.split(" & ") for conn in value]
+            data = fg.read()
+
+        # Any Link Grammar dictionary is accepted (see lg_dictionary.py): each entry, i.e. a word list
+        # followed by a colon and a rule ending in semi-colon, is a class. Rules can span several lines and
+        # use the full LG notation, e.g.  {@A-} & Ds- & (Ss+ or O-);  Entries named <macro> define macros.
+        # Rules are expanded into disjuncts (conjunctions of connectors), e.g.  (AB+ & CD-) or (CD-), in
+        # which the first connector of each direction is the nearest.
+        # Weights annotations of lazy classes' disjuncts are ignored, since those are sampled from the expression.
+        for class_num, (words, expression, weights) in enumerate(parse_dictionary(data, max_multi)):
+            self.word_dict[class_num] = words
+            if expression.count() <= max_disjuncts:
+                self.disj_dict[class_num] = [list(disj) for disj in expression.disjuncts()]
+            else:
+                self.disj_dict[class_num] = []
+                self.lazy_classes[class_num] = LazyDisjuncts(expression)
+                weights.pop("disjuncts", None)
+            word_weights = weights.get("words", {})
+            self.set_weights(class_num, [word_weights.get(word, 1) for word in words], weights.get("disjuncts"),
+                             weights.get("class", 1))
 
     def build_conn_dict(self):
         """
-        Build structure storing which grammar classes contain each different connector
+        Build structure storing which grammar classes contain each different connector, and
+        conj_slots: (position in disjunct, position in conjunct) of the first occurrence of a
+        connector in each conjunct of a class containing it
         """
         for gram_class, disj in self.disj_dict.items():
-            for rule in disj:
-                for conn in rule:
+            for pos, rule in enumerate(disj):
+                for slot, conn in enumerate(rule):
                     if conn not in self.conn_dict:
                         self.conn_dict[conn] = set()  # Alternative: use list for weighting relative to conn frequency
                     self.conn_dict[conn].add(gram_class)
+                    positions = self.conj_slots.setdefault((gram_class, conn), [])
+                    if not positions or positions[-1][0] != pos:
+                        positions.append((pos, slot))
+        for gram_class, disj in self.lazy_classes.items():
+            for conn in disj.connectors():
+                self.conn_dict.setdefault(conn, set()).add(gram_class)
+
+    def build_match_index(self):
+        """
+        Precompute the connector matching done by check_match, so that sampling doesn't need to
+        compare strings. Builds:
+        link_dict: connectors in the grammar that each connector can link to (opposite direction)
+        linked_classes: sorted tuple of classes that each connector can link to
+        conj_index: conjuncts of a class that can accept a link from a given connector
+        """
+        # check_match() only pairs connectors with the same capital letters and direction,
+        # whose bodies (direction excluded) are prefixes of one another. Group connectors by
+        # those keys, and keep each group's bodies sorted to find prefix extensions by bisection.
+        # Bodies with "*" wildcards are kept apart, and compared one by one.
+        groups = {}
+        wildcards = {}
+        for conn in self.conn_dict:
+            (wildcards if '*' in conn else groups).setdefault(self._match_key(conn), []).append(conn[:-1])
+        for bodies in groups.values():
+            bodies.sort()
+
+        for conn in self.conn_dict:
+            self.link_dict[conn] = self._find_matches(swap_connector(conn), groups, wildcards)
+            classes = set()
+            for linked_conn in self.link_dict[conn]:
+                classes.update(self.conn_dict[linked_conn])
+            self.linked_classes[conn] = tuple(sorted(classes))
+
+            accepting = self.accepting_conjuncts(conn)
+            for gram_class in self.linked_classes[conn]:
+                self.conj_index[(gram_class, conn)] = \
+                    tuple(self.disj_dict[gram_class][pos] for pos, slot in accepting.get(gram_class, ()))
+
+    def accepting_conjuncts(self, connector):
+        """
+        Returns the conjuncts that can accept a link from connector, as a dictionary of sorted lists
+        of (position in disjunct, slot) pairs per class, where slot is the position in the conjunct of
+        its accepting connector: the first one that links to connector
+        """
+        accepting = {}
+        for linked_conn in self.link_dict[connector]:
+            for gram_class in self.conn_dict[linked_conn]:
+                slots = accepting.setdefault(gram_class, {})
+                for pos, slot in self.conj_slots.get((gram_class, linked_conn), ()):
+                    if slot < slots.get(pos, len(self.disj_dict[gram_class][pos])):
+                        slots[pos] = slot
+        return {gram_class: sorted(slots.items()) for gram_class, slots in accepting.items()}
+
+    def prune_disjuncts(self):
+        """
+        Removes disjuncts with connectors that can't link to any class (e.g. connectors of LG
+        dictionaries that link to words not listed), and then classes left without disjuncts,
+        until every connector can link. Sentences couldn't be completed from those disjuncts.
+        """
+        while True:
+            dead = {conn for conn, classes in self.linked_classes.items() if not classes}
+            if dead:
+                for gram_class, disj in self.disj_dict.items():
+                    if gram_class in self.disj_weights:
+                        self.disj_weights[gram_class] = [weight for conj, weight in
+                                                         zip(disj, self.disj_weights[gram_class])
+                                                         if dead.isdisjoint(conj)]
+                    if gram_class not in self.lazy_classes:
+                        self.disj_dict[gram_class] = [conj for conj in disj if dead.isdisjoint(conj)]
+                for disj in self.lazy_classes.values():
+                    disj.exclude(dead)
+            # Renumber the classes left
+            kept = [gram_class for gram_class in sorted(self.disj_dict)
+                    if self.disj_dict[gram_class] or (gram_class in self.lazy_classes
+                                                      and self.lazy_classes[gram_class].count())]
+            if not dead and len(kept) == len(self.disj_dict):
+                return
+            self.word_dict = {new: self.word_dict[old] for new, old in enumerate(kept)}
+            self.lazy_classes = {new: self.lazy_classes[old] for new, old in enumerate(kept)
+                                 if old in self.lazy_classes}
+            self.disj_dict = {new: self.disj_dict[old] for new, old in enumerate(kept)}
+            for weights in (self.word_weights, self.disj_weights, self.class_weights):
+                renumbered = {new: weights[old] for new, old in enumerate(kept) if old in weights}
+                weights.clear()
+                weights.update(renumbered)
+            self.conn_dict, self.conj_slots, self.link_dict, self.linked_classes, self.conj_index = {}, {}, {}, {}, {}
+            self.build_conn_dict()
+            self.build_match_index()
+
+    @staticmethod
+    def _match_key(connector):
+        return tuple(c for c in connector if c.isupper()), connector[-1]
+
+    def _find_matches(self, connector, groups, wildcards):
+        """
+        Returns the set of grammar connectors that check_match(connector, [conn]) accepts
+        """
+        direction = connector[-1]
+        body = connector[:-1]
+        bodies = groups.get(self._match_key(connector), [])
+        matches = {other + direction for other in wildcards.get(self._match_key(connector), [])
+                   if subscripts_match(body, other)}
+        if '*' in body:
+            matches.update(other + direction for other in bodies if subscripts_match(body, other))
+            return frozenset(matches)
+        # Grammar connectors whose body is a prefix of this body
+        for size in range(len(body) + 1):
+            pos = bisect_left(bodies, body[:size])
+            if pos < len(bodies) and bodies[pos] == body[:size]:
+                matches.add(body[:size] + direction)
+        # Grammar connectors whose body extends this body
+        pos = bisect_left(bodies, body)
+        while pos < len(bodies) and bodies[pos].startswith(body):
+            matches.add(bodies[pos] + direction)
+            pos += 1
+        return frozenset(matches)
+
+
+def resolve_insertions(positions):
+    """
+    Returns the final order of items inserted one by one into a list, where item k
+    was inserted at index positions[k] (0 <= positions[k] <= k).
+    """
+    size = len(positions)
+    if size <= RESOLVE_REPLAY_SIZE:
+        # For sentence-sized lists, replaying the inserts in C is faster than the Python loop below
+        order = []
+        for item, pos in enumerate(positions):
+            order.insert(pos, item)
+        return order
+
+    # Visit items from last to first: each one takes the (positions[k] + 1)-th slot still free.
+    # A Fenwick tree counts free slots, so the whole order is resolved in O(n log n).
+    tree = [0] * (size + 1)
+    for i in range(1, size + 1):
+        tree[i] += 1
+        parent = i + (i & -i)
+        if parent <= size:
+            tree[parent] += tree[i]
+    top = 1 << (size.bit_length() - 1)
+    order = [0] * size
+    for item in range(size - 1, -1, -1):
+        rank = positions[item] + 1
+        slot = 0
+        step = top
+        while step:  # descend the tree to the slot with the wanted rank
+            nxt = slot + step
+            if nxt <= size and tree[nxt] < rank:
+                slot = nxt
+                rank -= tree[nxt]
+            step >>= 1
+        order[slot] = item
+        i = slot + 1
+        while i <= size:  # mark slot as taken
+            tree[i] -= 1
+            i += i & -i
+    return order
+
+
+class DerivationBudgetError(Exception):
+    """
+    Raised when a derivation grows beyond the length or depth budget of the sampler
+    """
+    pass
+
+
+class _Frame:
+    """
+    Expansion state of one node in GrammarSampler.generate_tree()
+    """
+    __slots__ = ("node", "rule", "parent_slot", "parent_size", "slot", "size_r", "size_l",
+                 "insert_pos_r", "insert_pos_l", "child_right")
+
+    def __init__(self, node, rule, parent_slot, parent_size, node_pos):
+        self.node = node
+        self.rule = rule  # connector ids of the node's conjunct
+        self.parent_slot = parent_slot  # position in rule of the connector linking to parent node
+        self.parent_size = parent_size
+        self.slot = 0  # next connector of rule to expand
+        self.size_r = 0  # words inserted to the right by this node
+        self.size_l = 0  # words inserted to the left by this node
+        self.insert_pos_r = node_pos + 1  # position to insert on the right of current node
+        self.insert_pos_l = node_pos  # position to insert on the left of current node
+        self.child_right = True  # direction of the child being expanded
+
+    def close_branch(self, size_branch):
+        """
+        Account for the words added by the branch of the child that was just expanded
+        """
+        if self.child_right:
+            self.size_r += size_branch
+        else:
+            self.size_l += size_branch
+        self.insert_pos_r += 1 + size_branch  # update for added word and branch
+
+
+class SentenceBatch:
+    """
+    Batch of generated sentences as ragged id arrays. Tokens of sentence i are
+    the range offsets[i]:offsets[i + 1] of the flat token arrays.
+
+    words       Word id of each token; vocab[word_id] gives its text
+    classes     Grammar class of each token
+    heads       Position, inside its sentence (0-based), of the token each token hangs from
+                in the generation tree; -1 for the root
+    lengths     Number of tokens of each sentence
+    offsets     Start of each sentence in the flat token arrays, plus the total size
+    links       (num_links, 2) array with the sentence positions (0-based, left < right) of every link
+    link_offsets  Links of sentence i are links[link_offsets[i]:link_offsets[i + 1]]
+    vocab       List of word strings, indexed by word id
+    """
+    def __init__(self, words, classes, heads, lengths, vocab):
+        self.words = np.asarray(words, dtype=np.int32)
+        self.classes = np.asarray(classes, dtype=np.int32)
+        self.heads = np.asarray(heads, dtype=np.int32)
+        self.lengths = np.asarray(lengths, dtype=np.int32)
+        self.offsets = np.zeros(len(self.lengths) + 1, dtype=np.int64)
+        np.cumsum(self.lengths, out=self.offsets[1:])
+        self.vocab = vocab
+
+        # Every non-root token links to its head
+        dependents = np.flatnonzero(self.heads >= 0)
+        token_pos = dependents - np.repeat(self.offsets[:-1], self.lengths)[dependents]
+        head_pos = self.heads[dependents]
+        self.links = np.stack([np.minimum(token_pos, head_pos), np.maximum(token_pos, head_pos)], axis=1)
+        self.link_offsets = self.offsets - np.arange(len(self.offsets))  # trees have one link less than tokens
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def padded(self, pad_value=-1):
+        """
+        Returns words, classes and heads as (num_sentences, max_length) arrays, filled with pad_value
+        after the end of each sentence
+        """
+        max_length = int(self.lengths.max()) if len(self.lengths) else 0
+        mask = np.arange(max_length) < self.lengths[:, None]
+        padded = []
+        for values in (self.words, self.classes, self.heads):
+            array = np.full((len(self.lengths), max_length), pad_value, dtype=np.int32)
+            array[mask] = values
+            padded.append(array)
+        return tuple(padded)
+
+    def sentence(self, index):
+        """
+        Returns the text of sentence index, as in generate_parse() but without final punctuation
+        """
+        return " ".join(self.vocab[word] for word in self.words[self.offsets[index]:self.offsets[index + 1]])
+
+    def parse(self, index):
+        """
+        Returns the sentence and ULL parse of sentence index, as generate_parse() does
+        """
+        words = [self.vocab[word] for word in self.words[self.offsets[index]:self.offsets[index + 1]].tolist()]
+        links = sorted(map(tuple, self.links[self.link_offsets[index]:self.link_offsets[index + 1]].tolist()))
+        ull_links = [f"{left + 1} {words[left]} {right + 1} {words[right]}" for left, right in links]
+        return " ".join(words) + " .", "\n".join(ull_links)
 
 
 class GrammarSampler:
     """
-    Class to generate a random sentence and parse from a given grammar
+    Class to generate a random sentence and parse from a given grammar.
+    Works on the integer ids of the compiled grammar; words are only turned
+    into text when the sentence and parse are written.
     """
-    def __init__(self, grammar):
+    def __init__(self, grammar, max_length=MAX_LENGTH, max_depth=None, max_resamples=100, rng=None, use_weights=True):
         """
         Initialize class object. Takes a grammar object.
+        :param rng:             random.Random instance to draw from; uses the global random state if None
+        :param max_length:      Max number of words in a derivation, or None for no limit
+        :param max_depth:       Max depth of a derivation tree, or None for no limit
+        :param max_resamples:   Times to restart a derivation that exceeds the budgets, before giving up
+        :param use_weights:     Draw words, classes and conjuncts in proportion to the grammar's sampling
+                                weights, if it has any; otherwise all draws are uniform
         """
-        self.disj_dict = grammar.disj_dict  # Local rules dictionary
-        self.word_dict = grammar.word_dict  # Local vocab dictionary
-        self.conn_dict = grammar.conn_dict  # Local connector dictionary
+        self.max_length = max_length
+        self.max_depth = max_depth
+        self.max_resamples = max_resamples
+        self.rng = rand if rng is None else rng
+        self.grammar = grammar.compiled  # Local compiled grammar
+        self.vocab = self.grammar.vocab
+        # Python-list views of the compiled arrays: scalar indexing of lists is faster than of NumPy arrays
+        self.conj_conns = self.grammar.conj_conns.tolist()
+        self.conj_offsets = self.grammar.conj_offsets.tolist()
+        self.class_conj_offsets = self.grammar.class_conj_offsets.tolist()
+        self.conn_dir = self.grammar.conn_dir.tolist()
+        self.class_words = self.grammar.class_words.tolist()
+        self.class_word_offsets = self.grammar.class_word_offsets.tolist()
+        self.link_offsets = self.grammar.link_offsets.tolist()
+        self.link_classes = self.grammar.link_classes.tolist()
+        self.link_conj_offsets = self.grammar.link_conj_offsets.tolist()
+        self.link_conjs = self.grammar.link_conjs.tolist()
+        self.link_slots = self.grammar.link_slots.tolist()
+        # Classes too big to expand draw their conjuncts from their LG expression
+        self.lazy_classes = grammar.lazy_classes
+        self.link_dict = grammar.link_dict if self.lazy_classes else {}
+        self.link_conns = np.repeat(np.arange(self.grammar.num_connectors),
+                                    np.diff(self.grammar.link_offsets)).tolist() if self.lazy_classes else []
+        # Alias tables of weighted grammars, with the positions of every draw done by randrange() otherwise
+        self.weighted = use_weights and self.grammar.weighted
+        self.word_table = self.root_table = self.conj_table = self.link_table = self.link_conj_table = None
+        if self.weighted:
+            cg = self.grammar
+            self.word_table = AliasTables(cg.word_weights, cg.class_word_offsets)
+            self.root_table = AliasTables(cg.class_weights, [0, cg.num_classes])
+            self.conj_table = AliasTables(cg.conj_weights, cg.class_conj_offsets)
+            self.link_table = AliasTables(cg.class_weights[cg.link_classes], cg.link_offsets)
+            self.link_conj_table = AliasTables(cg.conj_weights[cg.link_conjs], cg.link_conj_offsets)
+        self.defer_words = False  # whether word draws are left to the caller, e.g. to draw a whole batch at once
         self.counter = 0  # tracks order of words generation
-        self.links = {}
+        self.node_class = []  # class id of each node, indexed by generation order
+        self.node_word = []  # word id of each node, indexed by generation order
+        self.links = []  # (parent node, child node) pairs
         self.sentence = None
-        self.tree = []
+        self.insert_pos = []  # index of the word list where each node was placed, in generation order
+        self.tree = []  # node ids in sentence order
+        self.positions = []  # sentence position (1-based) of each node
         self.ull_parse = None
         self.ull_links = []
 
@@ -103,188 +609,257 @@ class GrammarSampler:
         MAIN ENTRY POINT
         Generate a lexical tree and return its corresponding sentence and parse
         :param: starting_node:  Node to start the parse tree
-        :param: starting_rule:  Rule to start the parse tree
+        :param: starting_rule:  Rule to start the parse tree, as a list of connector strings
         """
-        # Reset global variables
-        self.counter = 0
-        self.ull_links = []
-        self.links = {}
-
         # First generate a random tree, with optional starting node and rule
-        self.generate_tree(node_class=starting_node, rule=starting_rule)
-
-        sentence_array = np.full(len(self.tree), None)  # initialize empty sentence array
-
-        # Fill sentence array, and create links output in ULL format
-        for key, value in self.links.items():
-            key_word, key_pos = self.return_pos(key)  # search for word-instance position in the tree
-            sentence_array[key_pos - 1] = key_word
-            for val in value:
-                val_word, val_pos = self.return_pos(val)
-                sentence_array[val_pos - 1] = val_word
-                # Fill in the links in ULL format
-                if key_pos < val_pos:
-                    self.ull_links.append(f"{key_pos} {key_word} {val_pos} {val_word}")
-                else:
-                    self.ull_links.append(f"{val_pos} {val_word} {key_pos} {key_word}")
+        self.generate_derivation(starting_node, starting_rule)
+        self.assemble_parse()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"ULL parse: \n{self.sentence}\n{self.ull_parse}\n")
+
+        return self.sentence, self.ull_parse
+
+    def generate_derivation(self, starting_node=None, starting_rule=None):
+        """
+        Generate a random tree, with optional starting node and rule, resampling derivations
+        that exceed the sampler's budgets
+        :param: starting_node:  Node to start the parse tree
+        :param: starting_rule:  Rule to start the parse tree, as a list of connector strings
+        """
+        if starting_rule is not None:
+            starting_rule = self.grammar.rule_ids(starting_rule)
+        for attempt in range(self.max_resamples + 1):
+            # Reset global variables
+            self.counter = 0
+            self.links = []
+            self.node_class = []
+            self.node_word = []
+            try:
+                return self.generate_tree(node_class=starting_node, rule=starting_rule)
+            except DerivationBudgetError:
+                if attempt == self.max_resamples:
+                    raise
+
+    def sample_batch(self, num_sentences, starting_node=None, starting_rule=None, lexicalize=True):
+        """
+        Generate num_sentences random trees and return them as id arrays, without building any text.
+        Sentences don't include the final punctuation added by generate_parse().
+        :param: num_sentences:  Number of sentences to generate
+        :param: starting_node:  Node to start every parse tree
+        :param: starting_rule:  Rule to start every parse tree, as a list of connector strings
+        :param: lexicalize:     If False, no words are drawn (all word ids are -1): only the class-level trees
+        :return: SentenceBatch
+        """
+        words = []
+        classes = []
+        heads = []
+        lengths = []
+        # Weighted words are drawn for the whole batch at once, once the classes are known
+        self.defer_words = self.word_table is not None or not lexicalize
+        try:
+            for _ in range(num_sentences):
+                size = self.generate_derivation(starting_node, starting_rule)
+                words.extend(self.node_word[node] for node in self.tree)
+                classes.extend(self.node_class[node] for node in self.tree)
+                heads.extend(self.tree_heads())
+                lengths.append(size)
+        finally:
+            self.defer_words = False
+        if self.word_table is not None and lexicalize:
+            words = self.grammar.class_words[self.word_table.draw_batch(
+                classes, np.random.default_rng(self.rng.getrandbits(64)))]
+
+        return SentenceBatch(words, classes, heads, lengths, self.vocab)
+
+    def tree_heads(self):
+        """
+        Returns the sentence position (0-based) of the head of every word of the generated tree, in sentence
+        order; -1 for the root
+        """
+        positions = [0] * len(self.tree)
+        for pos, node in enumerate(self.tree):
+            positions[node] = pos
+        head_pos = [-1] * len(self.tree)  # root keeps -1
+        for parent, child in self.links:
+            head_pos[positions[child]] = positions[parent]
+        return head_pos
+
+    def assemble_parse(self):
+        """
+        Builds the sentence and its ULL parse from the generated tree, in linear time
+        (plus sorting the links by position).
+        """
+        # Position map of every node, in one pass over the tree
+        self.positions = [0] * len(self.tree)
+        for pos, node in enumerate(self.tree, 1):
+            self.positions[node] = pos
+        words = [self.vocab[self.node_word[node]] for node in self.tree]
+
+        # Links as (left position, right position) pairs, sorted numerically
+        link_pos = []
+        for parent, child in self.links:
+            parent_pos = self.positions[parent]
+            child_pos = self.positions[child]
+            link_pos.append((parent_pos, child_pos) if parent_pos < child_pos else (child_pos, parent_pos))
+        link_pos.sort()
+        self.ull_links = [f"{left} {words[left - 1]} {right} {words[right - 1]}" for left, right in link_pos]
 
         # Concatenate parse text output
         # TODO: Avoid adding punctuation in the next line, and make it come from the grammars.
-        self.sentence = " ".join(sentence_array) + " ."  # Add final punctuation, better for BERT
-        self.ull_links.sort()
-        sorted_links = "\n".join(self.ull_links)
-        print(f"ULL parse: \n{self.sentence}\n{sorted_links}\n")
+        self.sentence = " ".join(words) + " ."  # Add final punctuation, better for BERT
+        self.ull_parse = "\n".join(self.ull_links)
 
-        return self.sentence, sorted_links
-
-    def return_pos(self, word_string):
+    def return_pos(self, node):
         """
-        Given a word string, find its position in the tree.
+        Given a node id, find its position in the tree.
         Returns actual word, and its position in the sentence
         """
-        split_word = word_string.split("_")
-        word_tuple = (int(split_word[2]), int(split_word[1]))
-        return split_word[0], self.tree.index(word_tuple) + 1
+        return self.vocab[self.node_word[node]], self.positions[node]
 
-    @staticmethod
-    def swap_connector(connector):
-        """
-        Change direction of connection to given connector
-        :param connector:
-        :return: Connector in opposite direction
-        """
-        direction = connector[-1]
-        if direction == '+':
-            opposite_direction = '-'
-        elif direction == '-':
-            opposite_direction = '+'
-        else:
-            print("ERROR: Connector missing directionality in grammar file!!!")
-            exit(1)
-        return connector[:-1] + opposite_direction
+    swap_connector = staticmethod(swap_connector)
+    check_match = staticmethod(check_match)
 
-    @staticmethod
-    def check_match(connector, rule):
+    def choose_root(self, node_class=None, rule=None):
         """
-        Checks if connector (or a LG generalization of it) matches a connector inside rule
-        :param connector:
-        :param rule:
-        :return:
+        Chooses the class and rule of the root node, when not given. Returns the class id and
+        the rule's connector ids.
         """
-        # Check capital letters first
-        connector_caps = [c for c in connector if c.isupper()]
-        for conn in rule:
-            conn_caps = [c for c in conn if c.isupper()]
-            if connector_caps == conn_caps:  # Compare in detail only if capitals match
-                compare_size = min(len(connector[:-1]), len(conn[:-1]))  # Don't count direction
-                if (conn[:compare_size] + conn[-1]) == (connector[:compare_size] + connector[-1]):  # Restore direction
-                    return True
-
-        return False
+        if node_class is None and self.weighted:
+            node_class = self.root_table.draw(0, self.rng)
+        elif node_class is None:
+            node_class = self.rng.randint(0, self.grammar.num_classes - 1)  # choose random class to begin
+        if rule is None and node_class in self.lazy_classes:
+            rule = self.grammar.rule_ids(self.lazy_classes[node_class].sample(self.rng))
+        elif rule is None:
+            if self.weighted:
+                conj = self.conj_table.draw(node_class, self.rng)
+            else:
+                conj = self.rng.randrange(self.class_conj_offsets[node_class], self.class_conj_offsets[node_class + 1])
+            rule = self.conj_conns[self.conj_offsets[conj]:self.conj_offsets[conj + 1]]  # choose random rule
+        return node_class, rule
 
     def choose_linked_class(self, connector):
         """
-        Randomly choose a class that can connect with given connector (opposite directionality)
-        :param connector:
-        :return:
+        Randomly choose a class that can connect with given connector id (opposite directionality).
+        Returns the entry of the grammar's link index, which identifies both class and connector.
         """
-        choose_from = []
-        swapped_connector = self.swap_connector(connector)
-        for conn in self.conn_dict:
-            if self.check_match(swapped_connector, [conn]):
-                choose_from.extend(self.conn_dict[conn])
-        choose_from = set(choose_from)  # Alternative: remove this to weigh samples by number of connector matches
-        return rand.sample(choose_from, 1)[0]
+        # Alternative: weigh samples by number of connector matches
+        if self.weighted:
+            return self.link_table.draw(connector, self.rng)
+        return self.rng.randrange(self.link_offsets[connector], self.link_offsets[connector + 1])
 
-    def choose_conjunct(self, connector, disjunct):
+    def choose_conjunct(self, link_entry):
         """
-        Chooses a random conjunct from the ones in disjunct that contain connector in opposite direction
+        Chooses a random conjunct from the ones in the class of link_entry that contain its connector in
+        opposite direction. Returns the conjunct's connector ids, and the position of the connector linking
+        to the parent.
         """
-        opp_connector = self.swap_connector(connector)
-        valid_conjs = [conj for conj in disjunct if self.check_match(opp_connector, conj)]  # filter wrong connectors
-        return list(rand.choice(valid_conjs))
+        if self.lazy_classes and self.link_classes[link_entry] in self.lazy_classes:
+            return self.choose_lazy_conjunct(link_entry)
+        if self.weighted:
+            pos = self.link_conj_table.draw(link_entry, self.rng)
+        else:
+            pos = self.rng.randrange(self.link_conj_offsets[link_entry], self.link_conj_offsets[link_entry + 1])
+        conj = self.link_conjs[pos]
+        return self.conj_conns[self.conj_offsets[conj]:self.conj_offsets[conj + 1]], self.link_slots[pos]
 
-    def generate_tree(self, node_class=None, rule=None, connector=(), parent_size=0, node_pos=0):
+    def choose_lazy_conjunct(self, link_entry):
         """
-        Recursive method to generate a random tree of class elements from the
-        grammar, starting with the given class and rule.
+        Same as choose_conjunct(), for a class that is not expanded: draws a uniformly random disjunct
+        among the ones of its expression that contain a connector linking to the entry's connector
         """
-        if self.counter == 0:  # handle initial case
-            if node_class is None:
-                node_class = rand.randint(0, len(self.disj_dict) - 1)  # choose random class to begin
-            if rule is None:
-                rule = rand.sample(self.disj_dict[node_class], 1)[0]  # choose random rule
-            self.tree = [(self.counter, node_class)]
-        else:  # select one valid production of this class randomly
-            rule = self.choose_conjunct(connector, self.disj_dict[node_class])
-
-        parent_counter = self.counter  # save current counter for link creation
-        size_r = 0  # words inserted to the right by this call of method
-        size_l = 0  # words inserted to the left by this call of method
-        insert_pos_r = node_pos + 1  # position to insert on the right of current node
-        insert_pos_l = node_pos  # position to insert on the left of current node
+        connector = self.grammar.conn_names[self.link_conns[link_entry]]
+        matches = self.link_dict[connector]
+        conj = self.lazy_classes[self.link_classes[link_entry]].sample_with(self.rng, matches)
+        slot = next(slot for slot, conn in enumerate(conj) if conn in matches)
+        return self.grammar.rule_ids(conj), slot
 
-        # Insert new node, and recurse to expand the node
-        parent_found = False
-        for conn in rule:
-            new_node_class = self.choose_linked_class(conn)
-            direction = conn[-1]
+    def generate_tree(self, node_class=None, rule=None):
+        """
+        Generate a random tree of class elements from the grammar, starting with the given class and rule.
+        Nodes are expanded depth-first from an explicit stack of frames, in the same order a recursive
+        expansion would use. Instead of inserting nodes in a list, the index where each node goes is
+        recorded in self.insert_pos, and the final word order is resolved once the tree is complete.
+        Raises DerivationBudgetError if the tree grows beyond max_length words or max_depth levels.
+        """
+        node_class, rule = self.choose_root(node_class, rule)
+        self.insert_pos = [0]
+        stack = [_Frame(self.add_node(node_class), rule, -1, 0, 0)]
+
+        while stack:
+            frame = stack[-1]
+            if frame.slot == len(frame.rule):  # node fully expanded; report branch size to its parent
+                stack.pop()
+                if stack:
+                    stack[-1].close_branch(frame.size_r + frame.size_l)
+                continue
+            slot = frame.slot
+            frame.slot += 1
+            conn = frame.rule[slot]
+            direction = self.conn_dir[conn]
 
             # don't insert if conn is parent node; adjust insert_pos
-            if not parent_found and self.check_match(self.swap_connector(conn), [connector]):
-                # Alternative to parent_found flag:
-                # remove one occurrence of connector from rule, and adjust insert_pos accordingly.
-                parent_found = True
-                if direction == "+":  # right
-                    insert_pos_r += parent_size
-                elif direction == "-":  # left
-                    insert_pos_l -= parent_size
-                else:
-                    print("ERROR: Connector missing directionality in grammar connector!!!")
-                    exit(1)
-            else:
-                self.counter += 1
-                new_node = (self.counter, new_node_class)
-                self.construct_link((parent_counter, node_class), new_node)  # store link
-                # insert to right or left and recurse
-                if direction == "+":  # right
-                    self.tree.insert(insert_pos_r, new_node)
-                    size_r += 1
-                    size_branch = \
-                        self.generate_tree(node_class=new_node_class, connector=conn,
-                                           parent_size=size_r + size_l + parent_size, node_pos=insert_pos_r)
-                    size_r += size_branch  # add size of newly added branch
+            if slot == frame.parent_slot:
+                if direction > 0:  # right
+                    frame.insert_pos_r += frame.parent_size
                 else:  # left
-                    self.tree.insert(insert_pos_l, new_node)
-                    size_l += 1
-                    size_branch = \
-                        self.generate_tree(node_class=new_node_class, connector=conn,
-                                           parent_size=size_r + size_l + parent_size, node_pos=insert_pos_l)
-                    size_l += size_branch  # add size of newly added branch
+                    frame.insert_pos_l -= frame.parent_size
+                continue
+
+            if self.max_length is not None and self.counter + 1 >= self.max_length:
+                raise DerivationBudgetError(f"Derivation exceeded {self.max_length} words")
+            if self.max_depth is not None and len(stack) >= self.max_depth:
+                raise DerivationBudgetError(f"Derivation exceeded {self.max_depth} levels")
+
+            new_link_entry = self.choose_linked_class(conn)
+            self.counter += 1
+            new_node = self.add_node(self.link_classes[new_link_entry])
+            self.construct_link(frame.node, new_node)  # store link
+            # insert to right or left, and push the new node to be expanded
+            frame.child_right = direction > 0
+            if frame.child_right:
+                node_pos = frame.insert_pos_r
+                frame.size_r += 1
+            else:
+                node_pos = frame.insert_pos_l
+                frame.size_l += 1
+            self.place_node(node_pos)
+            rule, parent_slot = self.choose_conjunct(new_link_entry)
+            stack.append(_Frame(new_node, rule, parent_slot, frame.size_r + frame.size_l + frame.parent_size,
+                                node_pos))
 
-                insert_pos_r += 1 + size_branch  # update for added word and branch
+        self.tree = resolve_insertions(self.insert_pos)
+        return len(self.tree)
 
-        return size_r + size_l  # return num of added words by current iteration
+    def place_node(self, index):
+        """
+        Records that the newest node goes at index of the word list built so far,
+        following list.insert() conventions for out-of-range indexes
+        """
+        size = len(self.insert_pos)
+        if index < 0:
+            index = max(index + size, 0)
+        self.insert_pos.append(min(index, size))
+
+    def sample_word(self, grammar_class):
+        """
+        Samples the id of a word from given grammar_class
+        """
+        if self.word_table is not None:
+            return self.class_words[self.word_table.draw(grammar_class, self.rng)]
+        return self.class_words[self.rng.randrange(self.class_word_offsets[grammar_class],
+                                               self.class_word_offsets[grammar_class + 1])]
 
-    def sample_word(self, pos, grammar_class):
+    def add_node(self, grammar_class):
         """
-        Samples word from given grammar_class, and returns string in format
-        "word_a_b", where a is the word class, b is word's position
-        in the sentence
+        Creates a new node of grammar_class, with its word sampled once, and returns its id
         """
-        chosen_word = rand.choice(self.word_dict[grammar_class])
-        word_string = chosen_word + f"_{grammar_class}_" + str(pos)
-        return word_string
+        self.node_class.append(grammar_class)
+        self.node_word.append(-1 if self.defer_words else self.sample_word(grammar_class))
+        return len(self.node_class) - 1
 
     def construct_link(self, parent_node, child_node):
         """
         Method to form an entry in self.links from a pair of connected nodes
         """
-        # Sample words in string format
-        parent_string = self.sample_word(parent_node[0], parent_node[1])
-        child_string = self.sample_word(child_node[0], child_node[1])
-
-        if parent_string not in self.links:
-            self.links[parent_string] = []
-        self.links[parent_string].append(child_string)
-
+        self.links.append((parent_node, child_node))
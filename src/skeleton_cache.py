@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Skeleton cache: separates the structure of generated sentences from their words.
+# A skeleton is a class-level derivation, i.e. the class of every word and the tree of links
+# between them, in sentence order. Distinct skeletons are sampled with GrammarSampler or
+# enumerated exactly once, stored with their frequencies, and then drawn and filled with
+# words for whole batches at once with vectorized draws, one word per node.
+
+import numpy as np
+from sentence_generator import SentenceBatch
+from grammar_analysis import enumerate_skeletons
+from alias_tables import AliasTables
+
+
+class SkeletonCache:
+    """
+    Distinct skeletons of a grammar with their frequencies, stored like SentenceBatch tokens:
+    node k of skeleton i is position offsets[i] + k of the flat classes and heads arrays.
+
+    classes         Class of every node
+    heads           Position, inside its skeleton (0-based), of the node each node hangs from; -1 for the root
+    lengths         Number of nodes of every skeleton
+    frequencies     Number of times each skeleton was drawn, or its probability if enumerated
+    """
+    def __init__(self, grammar, use_weights=True):
+        """
+        :param use_weights:     Fill skeletons with words in proportion to the grammar's word weights, if it has any
+        """
+        self.grammar = grammar
+        self.index = {}  # (classes, heads) tuples -> skeleton id
+        self.classes = []
+        self.heads = []
+        self.lengths = []
+        self.frequencies = []
+        self.arrays = None  # Array form of the skeletons and table to draw them from, built when first drawn
+        cg = grammar.compiled
+        self.word_table = AliasTables(cg.word_weights, cg.class_word_offsets) \
+            if use_weights and np.any(cg.word_weights != 1) else None
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def add(self, classes, heads, frequency=1):
+        """
+        Adds frequency to the skeleton with the given classes and heads, stored first if new
+        """
+        key = (tuple(classes), tuple(heads))
+        skeleton = self.index.get(key)
+        if skeleton is None:
+            self.index[key] = len(self.lengths)
+            self.classes.extend(classes)
+            self.heads.extend(heads)
+            self.lengths.append(len(classes))
+            self.frequencies.append(frequency)
+        else:
+            self.frequencies[skeleton] += frequency
+        self.arrays = None
+
+    def sample(self, sampler, num_draws):
+        """
+        Adds num_draws skeletons drawn by sampler (a GrammarSampler), without drawing any word
+        """
+        batch = sampler.sample_batch(num_draws, lexicalize=False)
+        classes = batch.classes.tolist()
+        heads = batch.heads.tolist()
+        offsets = batch.offsets.tolist()
+        for start, end in zip(offsets, offsets[1:]):
+            self.add(classes[start:end], heads[start:end])
+
+    def enumerate(self, max_length=None):
+        """
+        Adds every skeleton with at most max_length words, with the probability that GrammarSampler
+        draws it (sampling weights of classes and disjuncts aside)
+        """
+        for classes, heads, probability in enumerate_skeletons(self.grammar, max_length):
+            self.add(classes, heads, probability)
+
+    def draw(self, num_sentences, rng):
+        """
+        Draws num_sentences skeletons in proportion to their frequencies, and fills each of their nodes
+        with a word of its class
+        :param rng:     numpy Generator to draw from
+        :return: SentenceBatch
+        """
+        if not self.lengths:
+            raise ValueError("Skeleton cache is empty")
+        if self.arrays is None:
+            offsets = np.zeros(len(self.lengths) + 1, dtype=np.int64)
+            np.cumsum(self.lengths, out=offsets[1:])
+            self.arrays = (np.array(self.classes, dtype=np.int32), np.array(self.heads, dtype=np.int32),
+                           np.array(self.lengths, dtype=np.int64), offsets,
+                           AliasTables(self.frequencies, [0, len(self.lengths)]))
+        classes, heads, lengths, offsets, table = self.arrays
+        skeletons = table.draw_batch(np.zeros(num_sentences, dtype=np.int64), rng)
+        sizes = lengths[skeletons]
+        # Flat position of every token of the batch in the skeleton arrays
+        token_starts = np.cumsum(sizes) - sizes
+        tokens = np.arange(sizes.sum()) + np.repeat(offsets[skeletons] - token_starts, sizes)
+        batch_classes = classes[tokens]
+        return SentenceBatch(self.lexicalize(batch_classes, rng), batch_classes, heads[tokens], sizes,
+                             self.grammar.compiled.vocab)
+
+    def lexicalize(self, classes, rng):
+        """
+        Returns the id of a word drawn from each class of classes
+        :param rng:     numpy Generator to draw from
+        """
+        cg = self.grammar.compiled
+        if self.word_table is not None:
+            return cg.class_words[self.word_table.draw_batch(classes, rng)]
+        starts = cg.class_word_offsets[classes]
+        sizes = cg.class_word_offsets[classes + 1] - starts
+        return cg.class_words[starts + rng.integers(sizes)]
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Experiment sweeps: generates corpora for a grid of grammars, corpus sizes and seeds, takes
+# subsets of them, parses them with the baselines and evaluates the parses against the gold
+# standard, on a pool of processes. Every artifact is cached under a hash of its inputs, so
+# repeated sweeps only compute what changed. Results are written to one tab-separated table.
+
+import sys
+import os
+import getopt
+import json
+import hashlib
+import shutil
+import tempfile
+from contextlib import redirect_stdout
+from multiprocessing import Pool
+from corpus_generator import generate_corpus
+from baselines import make_parser, parse_corpus
+from parse_evaluator import evaluate_files
+from corpus_index import IndexedCorpus
+
+SWEEP_FORMAT = 1  # Part of every cache key; changing it invalidates cached artifacts
+CORPUS_FILE = "corpus.txt"  # Corpus file in each corpus directory, with its gold standard in CORPUS_FILE.ull
+PARSES_FILE = "parses.ull"
+REPORT_FILE = "report.json"
+GRID_DEFAULTS = {
+    "grammars": [],
+    "sizes": [100],
+    "seeds": [0],
+    "fractions": [1],
+    "methods": [{"method": "sequential"}, {"method": "random"}],
+    "corpus_args": {"shuffle": True},
+    "cache_dir": "sweep_cache",
+    "results": "sweep_results.tsv",
+}
+RESULT_COLUMNS = ("grammar", "size", "seed", "fraction", "method", "sentences", "precision", "recall", "f1",
+                  "average_precision", "average_recall", "average_f1")
+SCORE_COLUMNS = RESULT_COLUMNS[6:]
+
+
+def main(argv):
+    """
+        Sweep_runner runs the experiments of a grid, given in a JSON file.
+
+        "Usage: sweep_runner.py -c <grid_file> [--workers <num_workers>]"
+
+        grid_file       JSON object with the following keys (all optional but grammars):
+                        grammars: list of grammar files, or of {"generate": {<grammar_generator params>}}
+                                  for random grammars, drawn from each seed
+                        sizes: corpus sizes (default: [100])
+                        seeds: corpus_generator seeds (default: [0])
+                        fractions: fractions of each corpus to evaluate on, taken from its start
+                                   (default: [1])
+                        methods: parsers, as {"method": <baselines.py method>, <its options>}
+                                 (default: sequential and random)
+                        corpus_args: other generate_corpus() options (default: {"shuffle": true},
+                                     so that corpus subsets are random samples); jobs run
+                                     with one worker each
+                        cache_dir: directory of cached artifacts (default: 'sweep_cache')
+                        results: table of results (default: 'sweep_results.tsv')
+        num_workers     Number of processes running jobs (default: one per core)
+    """
+    grid_file = ''
+    workers = None
+
+    usage = "Usage: sweep_runner.py -c <grid_file> [--workers <num_workers>]"
+    try:
+        opts, args = getopt.getopt(argv, "hc:", ["grid=", "workers="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-c", "--grid"):
+            grid_file = arg
+        elif opt == "--workers":
+            workers = int(arg)
+
+    if grid_file == '':
+        raise getopt.GetoptError("No grid file specified")
+
+    with open(grid_file, 'r') as fg:
+        grid = json.load(fg)
+    rows = run_sweep(grid, workers)
+    print(format_table(rows))
+
+
+def run_sweep(grid: dict, workers: int = None):
+    """
+    Runs every experiment of grid (see main()), writes the results table and returns its rows
+    """
+    grid = {**GRID_DEFAULTS, **grid}
+    if not grid["grammars"]:
+        raise ValueError("The grid has no grammars")
+    cache_dir = grid["cache_dir"]
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # One experiment per grammar, size, seed, fraction and method, each needing a corpus, a subset of
+    # it and its parses. Jobs sharing an artifact (e.g. all methods of a subset) only run once.
+    corpus_args = {name: value for name, value in grid["corpus_args"].items() if name != "workers"}
+    experiments = []
+    for grammar in grid["grammars"]:
+        source = grammar_source(grammar)
+        for size in grid["sizes"]:
+            for seed in grid["seeds"]:
+                corpus_key = cache_key("corpus", source, size, seed, corpus_args)
+                for fraction in grid["fractions"]:
+                    subset_key = cache_key("subset", corpus_key, fraction)
+                    for method in grid["methods"]:
+                        experiments.append((grammar, size, seed, fraction, method, corpus_key, subset_key,
+                                            cache_key("parse", subset_key, method, seed)))
+    corpus_jobs = unique_jobs([(cache_dir, corpus_key, grammar, size, seed, corpus_args)
+                               for grammar, size, seed, _, _, corpus_key, _, _ in experiments])
+    subset_jobs = unique_jobs([(cache_dir, subset_key, corpus_key, fraction)
+                               for _, _, _, fraction, _, corpus_key, subset_key, _ in experiments])
+    parse_jobs = unique_jobs([(cache_dir, parse_key, subset_key, method, seed)
+                              for _, _, seed, _, method, _, subset_key, parse_key in experiments])
+
+    # Each stage only needs the artifacts of the previous one
+    with Pool(workers) as pool:
+        pool.starmap(generate_job, corpus_jobs, chunksize=1)
+        pool.starmap(subset_job, subset_jobs, chunksize=1)
+        reports = dict(zip((job[1] for job in parse_jobs), pool.starmap(parse_job, parse_jobs, chunksize=1)))
+
+    rows = []
+    for grammar, size, seed, fraction, method, _, _, parse_key in experiments:
+        report = reports[parse_key]
+        rows.append({"grammar": grammar_name(grammar), "size": size, "seed": seed, "fraction": fraction,
+                     "method": method_name(method), "sentences": report["sentences"],
+                     "precision": report["precision"], "recall": report["recall"], "f1": report["f1"],
+                     "average_precision": report["sentence_average"]["precision"],
+                     "average_recall": report["sentence_average"]["recall"],
+                     "average_f1": report["sentence_average"]["f1"]})
+    with open(grid["results"], 'w') as fo:
+        fo.write(format_table(rows) + "\n")
+    return rows
+
+
+def grammar_source(grammar):
+    """
+    Returns what identifies the content of a grammar of the grid: the hash of its file, or its parameters
+    """
+    if isinstance(grammar, dict):
+        return grammar
+    with open(grammar, 'rb') as fg:
+        return hashlib.sha256(fg.read()).hexdigest()
+
+
+def grammar_name(grammar):
+    if isinstance(grammar, dict):
+        return "generate:" + ",".join(f"{name}={value}" for name, value in sorted(grammar["generate"].items()))
+    return os.path.basename(grammar)
+
+
+def method_name(method: dict):
+    options = ",".join(f"{name}={value}" for name, value in sorted(method.items()) if name != "method")
+    return method["method"] + (f"({options})" if options else "")
+
+
+def cache_key(kind: str, *inputs):
+    """
+    Name of the cached artifact of kind computed from inputs (JSON-serializable)
+    """
+    content = json.dumps([SWEEP_FORMAT, kind, *inputs], sort_keys=True)
+    return f"{kind}-{hashlib.sha256(content.encode()).hexdigest()[:20]}"
+
+
+def unique_jobs(jobs):
+    """
+    Jobs with distinct keys (their second item), in order
+    """
+    return list({job[1]: job for job in jobs}.values())
+
+
+def cached_artifact(cache_dir: str, key: str, build):
+    """
+    Returns the directory of artifact key in cache_dir, calling build(directory) to create it if needed.
+    Artifacts are built in a temporary directory and then renamed, so incomplete ones are never used.
+    """
+    path = os.path.join(cache_dir, key)
+    if not os.path.isdir(path):
+        tmp_dir = tempfile.mkdtemp(prefix=f".{key}-", dir=cache_dir)
+        try:
+            build(tmp_dir)
+            os.rename(tmp_dir, path)
+        except OSError:
+            if not os.path.isdir(path):  # else built meanwhile by another sweep
+                raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    return path
+
+
+def generate_job(cache_dir, key, grammar, size, seed, corpus_args):
+    def build(directory):
+        with open(os.path.join(directory, "generate.log"), 'w') as log, redirect_stdout(log):
+            if isinstance(grammar, dict):
+                generate_corpus('generate', size, os.path.join(directory, CORPUS_FILE), '', seed=seed,
+                                grammar_params=grammar["generate"],
+                                save_grammar=os.path.join(directory, "generated.grammar"), **corpus_args)
+            else:
+                generate_corpus('existing', size, os.path.join(directory, CORPUS_FILE), grammar, seed=seed,
+                                **corpus_args)
+    return cached_artifact(cache_dir, key, build)
+
+
+def subset_job(cache_dir, key, corpus_key, fraction):
+    """
+    Writes the first fraction of the sentences of a corpus, and of its gold standard
+    """
+    corpus = os.path.join(cache_dir, corpus_key, CORPUS_FILE)
+
+    def build(directory):
+        sentences = IndexedCorpus(corpus)
+        sentences.write_subset(range(max(1, round(len(sentences) * fraction))), os.path.join(directory, CORPUS_FILE))
+    return cached_artifact(cache_dir, key, build)
+
+
+def parse_job(cache_dir, key, subset_key, method, seed):
+    """
+    Parses a corpus subset with a baseline method, evaluates it and returns its report
+    """
+    corpus = os.path.join(cache_dir, subset_key, CORPUS_FILE)
+
+    def build(directory):
+        options = {name: value for name, value in method.items() if name != "method"}
+        parser = make_parser(method["method"], corpus, seed=seed, **options)
+        parse_corpus(parser, corpus, os.path.join(directory, PARSES_FILE))
+        report = evaluate_files(corpus + ".ull", os.path.join(directory, PARSES_FILE))
+        with open(os.path.join(directory, REPORT_FILE), 'w') as fo:
+            json.dump(report, fo, indent=2)
+
+    with open(os.path.join(cached_artifact(cache_dir, key, build), REPORT_FILE), 'r') as fr:
+        return json.load(fr)
+
+
+def format_table(rows):
+    """
+    Returns rows (dictionaries of RESULT_COLUMNS) as a tab-separated table with a header
+    """
+    lines = ["\t".join(RESULT_COLUMNS)]
+    for row in rows:
+        lines.append("\t".join(f"{row[column]:.4f}" if column in SCORE_COLUMNS else str(row[column])
+                               for column in RESULT_COLUMNS))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
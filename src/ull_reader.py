@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Reader of parse files in ULL format, as written by corpus_generator for its gold standard:
+# each sentence on a line, followed by one line per link "<index> <word> <index> <word>"
+# (words are numbered from 1; 0 is ###LEFT-WALL###, if present) and a blank line.
+
+import numpy as np
+
+INDEX_TYPE = np.int32  # word indexes of links
+WALL_INDEX = 0
+
+
+class ParseSet:
+    """
+    Links of all sentences of a ULL file, stored in flat arrays: link k joins words left[k] < right[k]
+    of sentence link_sentence[k], and the links of sentence i are those in link_offsets[i]:link_offsets[i + 1]
+    """
+    def __init__(self, sentences, link_sentence, left, right):
+        """
+        :param sentences:       Sentence strings
+        :param link_sentence:   Sentence index of each link, in non-decreasing order
+        """
+        self.sentences = sentences
+        self.link_sentence = np.asarray(link_sentence, dtype=np.int64)
+        self.left = np.asarray(left, dtype=INDEX_TYPE)
+        self.right = np.asarray(right, dtype=INDEX_TYPE)
+        self.link_offsets = np.searchsorted(self.link_sentence, np.arange(len(sentences) + 1))
+
+    def __len__(self):
+        return len(self.sentences)
+
+    @property
+    def num_links(self):
+        return len(self.left)
+
+    def links_per_sentence(self):
+        return np.diff(self.link_offsets)
+
+    def sentence_links(self, index):
+        """
+        Returns the (left, right) word indexes of the links of sentence index
+        """
+        start, end = self.link_offsets[index], self.link_offsets[index + 1]
+        return list(zip(self.left[start:end].tolist(), self.right[start:end].tolist()))
+
+    def without_wall(self):
+        """
+        Returns a ParseSet without the links to the LEFT-WALL
+        """
+        keep = self.left != WALL_INDEX
+        return ParseSet(self.sentences, self.link_sentence[keep], self.left[keep], self.right[keep])
+
+    def link_keys(self, base):
+        """
+        Returns one int64 key per link, identifying its sentence and words, for words indexed below base
+        """
+        return (self.link_sentence * base + self.left) * base + self.right
+
+
+def read_ull(ull_file, ignore_wall=False):
+    """
+    Reads the parses of a ULL file into a ParseSet. Links are normalized so that left < right.
+    :param ignore_wall:     Drop links to the LEFT-WALL (word 0)
+    """
+    with open(ull_file, 'r') as fi:
+        lines = [line.strip() for line in fi]
+    # The first non-blank line after a blank one (or the file start) is a sentence, the others are links
+    nonblank = np.array([bool(line) for line in lines], dtype=bool)
+    starts = nonblank & ~np.concatenate(([False], nonblank[:-1]))
+    is_link = nonblank & ~starts
+    line_sentence = np.cumsum(starts) - 1
+    sentences = [line for line, start in zip(lines, starts.tolist()) if start]
+    link_lines = [line for line, link in zip(lines, is_link.tolist()) if link]
+
+    fields = " ".join(link_lines).split()
+    if len(fields) != 4 * len(link_lines):
+        for line, sentence in zip(link_lines, line_sentence[is_link].tolist()):
+            if len(line.split()) != 4:
+                raise ValueError(f"Invalid link in {ull_file}, sentence {sentence + 1}: '{line}'")
+    try:
+        indexes = np.array(fields[0::2], dtype=np.int64).reshape(-1, 2)
+    except ValueError as error:
+        raise ValueError(f"Invalid link index in {ull_file}: {error}")
+    parses = ParseSet(sentences, line_sentence[is_link], indexes.min(axis=1), indexes.max(axis=1))
+    return parses.without_wall() if ignore_wall else parses
@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Structural validation of parse files in ULL format, e.g. the gold standard written by corpus_generator.
+# The file is streamed by blocks of records, and each block is checked at once with array operations
+# on the link endpoints, numbered across the block (word i of the sentence starting at base b is b + i):
+# format          every link line is "<index> <word> <index> <word>", with non-negative integer indexes
+# tokens          link indexes are in the sentence, and link words are the sentence words at them
+# link_count      no link joins a word to itself, and no two links join the same words
+# connected       links join all words, except ###LEFT-WALL### and final punctuation when they're unlinked
+# tree            links have no cycles: a connected sentence of n words has n - 1 links
+# crossing        no two links cross (l1 < l2 < r1 < r2), i.e. the parse is projective
+# corpus          the sentence is the same as in the corpus file, if given
+# Sentences that fail format or have link indexes out of range aren't checked further.
+
+import sys
+import os
+import time
+import getopt
+import json
+from contextlib import nullcontext
+from itertools import islice
+import numpy as np
+from baselines import FINAL_PUNCTUATION, read_corpus
+
+WALL_TOKEN = b"###LEFT-WALL###"
+CHECKS = ("format", "tokens", "link_count", "connected", "tree", "crossing")
+BLOCK_SIZE = 1 << 22  # Bytes read at once; a block is extended to the end of its last record
+SPACE = ord(' ')  # Bytes up to this one separate tokens
+NEWLINE = ord('\n')
+MAX_DIGITS = 18  # Longer link indexes are out of range of any sentence
+MAX_EXAMPLES = 10  # Offending sentences listed per check in the report
+
+
+def main(argv):
+    """
+        Ull_validator checks the structure of the parses of a ULL file.
+
+        "Usage: ull_validator.py -i <ull_file> [-c <corpus_file> -o <report_file> -x <indexes_file>
+                                 --examples <max_examples>]"
+
+        ull_file            Parses in ULL format, e.g. the gold standard written by corpus_generator
+        corpus_file         Corpus the parses should be of, in the same order (e.g. the corpus of ull_file)
+        report_file         File to write the validation report to, in JSON format (default: stdout)
+        indexes_file        File to write the index (from 0) of every invalid sentence to, with its failed checks
+        max_examples        Number of offending sentence indexes listed per check in the report (default: 10)
+    """
+    ull_file = ''
+    corpus_file = None
+    report_file = None
+    indexes_file = None
+    max_examples = MAX_EXAMPLES
+
+    usage = '''Usage: ull_validator.py -i <ull_file> [-c <corpus_file> -o <report_file> -x <indexes_file>
+                                 --examples <max_examples>]'''
+    try:
+        opts, args = getopt.getopt(argv, "hi:c:o:x:", ["input=", "corpus=", "outfile=", "indexes=", "examples="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-i", "--input"):
+            ull_file = arg
+        elif opt in ("-c", "--corpus"):
+            corpus_file = arg
+        elif opt in ("-o", "--outfile"):
+            report_file = arg
+        elif opt in ("-x", "--indexes"):
+            indexes_file = arg
+        elif opt == "--examples":
+            max_examples = int(arg)
+
+    if ull_file == '':
+        raise getopt.GetoptError("No ULL file specified")
+
+    report = validate_file(ull_file, corpus_file, indexes_file, max_examples)
+    if report_file is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(report_file, 'w') as fo:
+            json.dump(report, fo, indent=2)
+        print(f"{report['valid']} of {report['sentences']} sentences are valid")
+
+
+def validate_file(ull_file: str, corpus_file: str = None, indexes_file: str = None,
+                  max_examples: int = MAX_EXAMPLES, block_size: int = BLOCK_SIZE):
+    """
+    Validates every parse of ull_file, block by block, and returns a report dictionary with the number
+    of sentences, links and valid sentences, and for each check the number of sentences failing it
+    and the indexes (from 0) of the first max_examples of them
+    :param corpus_file:     Also check that the sentences are those of corpus_file
+    :param indexes_file:    File to write "<index>\t<failed checks>" to, for every invalid sentence
+    """
+    checks = CHECKS + (("corpus",) if corpus_file is not None else ())
+    report = {"ull_file": ull_file, "corpus_file": corpus_file, "sentences": 0, "links": 0, "valid": 0,
+              "checks": {check: {"failed": 0, "examples": []} for check in checks}}
+    corpus = read_corpus(corpus_file) if corpus_file is not None else None
+    start_time = time.perf_counter()
+    with open(ull_file, 'rb') as fi, open(indexes_file, 'w') if indexes_file else nullcontext() as fx:
+        for block in read_blocks(fi, block_size):
+            records = UllBlock(block)
+            failed = check_block(records)
+            if corpus is not None:
+                expected = list(islice(corpus, records.num_sentences))
+                expected += [None] * (records.num_sentences - len(expected))
+                failed["corpus"] = np.array(records.sentences(), dtype=object) != np.array(expected, dtype=object)
+            first = report["sentences"]
+            invalid = np.zeros(records.num_sentences, dtype=bool)
+            for check in checks:
+                report_check = report["checks"][check]
+                offending = np.flatnonzero(failed[check]) + first
+                report_check["failed"] += len(offending)
+                report_check["examples"].extend(offending[:max_examples - len(report_check["examples"])].tolist())
+                invalid |= failed[check]
+            if indexes_file is not None:
+                for index in np.flatnonzero(invalid).tolist():
+                    fx.write(f"{first + index}\t{','.join(c for c in checks if failed[c][index])}\n")
+            report["sentences"] += records.num_sentences
+            report["links"] += records.num_links
+            report["valid"] += int(records.num_sentences - invalid.sum())
+    if corpus is not None:
+        report["checks"]["corpus"]["extra_corpus_sentences"] = sum(1 for _ in corpus)
+    report["seconds"] = time.perf_counter() - start_time
+    report["megabytes_per_second"] = os.path.getsize(ull_file) / 2 ** 20 / max(report["seconds"], 1e-9)
+    return report
+
+
+def read_blocks(fi, block_size: int = BLOCK_SIZE):
+    """
+    Yields the contents of a ULL file open in binary mode by blocks of whole records,
+    of about block_size bytes
+    """
+    carry = b""
+    while True:
+        data = fi.read(block_size)
+        block = carry + data
+        if not data:
+            if block.strip():
+                yield block
+            return
+        end = records_end(block)
+        if end < 0:
+            carry = block
+            continue
+        carry = block[end:]
+        yield block[:end]
+
+
+def records_end(block):
+    """
+    Returns the offset in block after its last blank line, where a record can start, or -1
+    """
+    end = block.rfind(b"\n")  # Text after the last line end may be an incomplete line
+    while end >= 0:
+        start = block.rfind(b"\n", 0, end)
+        if not block[start + 1:end].strip():
+            return end + 1
+        end = start
+    return -1
+
+
+class UllBlock:
+    """
+    Tokens of a block of ULL records, found with array operations on its bytes: token k is
+    data[starts[k]:ends[k]]. The first non-blank line after a blank one (or the block start)
+    is a sentence, the others are links.
+    """
+    def __init__(self, block):
+        self.block = block
+        self.data = np.frombuffer(block, dtype=np.uint8)
+        space = self.data <= SPACE
+        word = ~space
+        self.starts = np.flatnonzero(word & np.concatenate(([True], space[:-1])))
+        self.ends = np.flatnonzero(word & np.concatenate((space[1:], [True]))) + 1
+        line_ends = np.flatnonzero(self.data == NEWLINE)
+        line_tokens = np.diff(np.searchsorted(self.starts, line_ends), prepend=0, append=len(self.starts))
+        first_token = np.cumsum(line_tokens) - line_tokens
+
+        nonblank = line_tokens > 0
+        is_sentence = nonblank & ~np.concatenate(([False], nonblank[:-1]))
+        is_link = nonblank & ~is_sentence
+        line_sentence = np.cumsum(is_sentence) - 1
+        self.num_sentences = int(is_sentence.sum())
+
+        # Words of sentence s are its tokens sentence_first[s]:sentence_first[s] + lengths[s]
+        self.sentence_first = first_token[is_sentence]
+        self.lengths = line_tokens[is_sentence]
+        link_lines = np.flatnonzero(is_link)
+        self.num_links = len(link_lines)
+        self.link_sentence = line_sentence[link_lines]
+        self.link_first = first_token[link_lines]
+        self.link_fields = line_tokens[link_lines]
+
+    def sentences(self):
+        """
+        Returns the sentence strings of the block
+        """
+        last = self.sentence_first + self.lengths - 1
+        return [self.block[start:end].decode() for start, end in zip(self.starts[self.sentence_first].tolist(),
+                                                                      self.ends[last].tolist())]
+
+    def integers(self, tokens):
+        """
+        Returns the values of tokens that are non-negative integers, and the mask of them.
+        Integers too long for an int64 are given the largest value.
+        """
+        lengths = self.ends[tokens] - self.starts[tokens]
+        values = np.zeros(len(tokens), dtype=np.int64)
+        valid = np.ones(len(tokens), dtype=bool)
+        for k in range(min(int(lengths.max(initial=0)), MAX_DIGITS)):
+            digit = self.data[self.starts[tokens] + np.minimum(k, lengths - 1)].astype(np.int64) - ord('0')
+            more = lengths > k
+            valid &= ~more | ((digit >= 0) & (digit <= 9))
+            values = np.where(more, 10 * values + digit, values)
+        long = lengths > MAX_DIGITS
+        values[long] = np.iinfo(np.int64).max
+        valid[long] &= np.array([self.block[start:end].isdigit() for start, end in
+                                 zip(self.starts[tokens[long]].tolist(), self.ends[tokens[long]].tolist())], dtype=bool)
+        return values, valid
+
+    def tokens_equal(self, tokens, others):
+        """
+        Returns the mask of tokens equal to the token at the same position in others
+        """
+        lengths = self.ends[tokens] - self.starts[tokens]
+        equal = lengths == self.ends[others] - self.starts[others]
+        active = np.flatnonzero(equal)
+        k = 0
+        while len(active):
+            same = self.data[self.starts[tokens[active]] + k] == self.data[self.starts[others[active]] + k]
+            equal[active[~same]] = False
+            k += 1
+            active = active[same & (lengths[active] > k)]
+        return equal
+
+    def tokens_are(self, tokens, value: bytes):
+        """
+        Returns the mask of tokens equal to value
+        """
+        equal = self.ends[tokens] - self.starts[tokens] == len(value)
+        if len(value) and equal.any():
+            window = self.starts[tokens[equal]][:, None] + np.arange(len(value))
+            equal[equal] = (self.data[window] == np.frombuffer(value, dtype=np.uint8)).all(axis=1)
+        return equal
+
+
+def check_block(records):
+    """
+    Runs every check but corpus on the UllBlock records, and returns a dictionary with the mask of
+    sentences failing each check
+    """
+    num_sentences = records.num_sentences
+    link_sentence = records.link_sentence
+    failed = {}
+    index_tokens = records.link_first[:, None] + np.array([0, 2])
+    word_tokens = records.link_first[:, None] + np.array([1, 3])
+    well_formed = records.link_fields == 4
+    indexes, numeric = records.integers(np.where(well_formed[:, None], index_tokens, 0).ravel())
+    indexes = indexes.reshape(-1, 2)
+    well_formed &= numeric.reshape(-1, 2).all(axis=1)
+    failed["format"] = np.bincount(link_sentence[~well_formed], minlength=num_sentences) > 0
+
+    # Words of all sentences in one array of token numbers, each sentence preceded by the
+    # LEFT-WALL (-1): word i of sentence s is at base[s] + i
+    lengths = records.lengths
+    base = np.cumsum(lengths + 1) - (lengths + 1)
+    size = int((lengths + 1).sum())
+    block_words = np.full(size, -1, dtype=np.int64)
+    is_word = np.ones(size, dtype=bool)
+    is_word[base] = False
+    first_word = records.sentence_first - base + np.arange(num_sentences)
+    block_words[is_word] = np.arange(lengths.sum()) + np.repeat(first_word, lengths)
+
+    in_range = well_formed[:, None] & (indexes <= lengths[link_sentence][:, None])
+    out_of_range = np.bincount(link_sentence[well_formed & ~in_range.all(axis=1)], minlength=num_sentences) > 0
+    position = base[link_sentence][:, None] + np.where(in_range, indexes, 0)
+    expected = block_words[position[in_range]]
+    right_word = np.where(expected >= 0,
+                          records.tokens_equal(word_tokens[in_range], np.maximum(expected, 0)),
+                          records.tokens_are(word_tokens[in_range], WALL_TOKEN))
+    wrong_word = link_sentence[np.flatnonzero(in_range)[~right_word] // 2]
+    failed["tokens"] = out_of_range | (np.bincount(wrong_word, minlength=num_sentences) > 0)
+
+    # Structural checks, on the sentences whose links all have valid indexes
+    checked = ~(failed["format"] | out_of_range)
+    keep = checked[link_sentence]
+    left = position[keep].min(axis=1)
+    right = position[keep].max(axis=1)
+
+    # Distinct links, sorted by left and right ends
+    word_sentence = np.repeat(np.arange(num_sentences), lengths + 1)
+    key = np.sort(left * size + right)
+    repeated = np.zeros(len(key), dtype=bool)
+    repeated[1:] = key[1:] == key[:-1]
+    bad_links = np.concatenate((left[left == right], key[repeated] // size))
+    failed["link_count"] = np.bincount(word_sentence[bad_links], minlength=num_sentences) > 0
+    key = key[~repeated]
+    left, right = key // size, key % size
+    left, right = left[left != right], right[left != right]
+    sentence = word_sentence[left]
+
+    # Words that must be linked
+    linked = np.zeros(size, dtype=bool)
+    linked[left] = True
+    linked[right] = True
+    required = np.ones(size, dtype=bool)
+    required[base] = linked[base]
+    last = base + lengths
+    punctuation = (lengths > 1) & records.tokens_are(block_words[last], FINAL_PUNCTUATION.encode())
+    required[last[punctuation]] = linked[last[punctuation]]
+
+    # Connected components, as the smallest word of each
+    label = connected_components(size, left, right)
+    roots = required & (label == np.arange(size))
+    components = np.bincount(word_sentence[roots], minlength=num_sentences)
+    num_words = np.bincount(word_sentence[required], minlength=num_sentences)
+    num_links = np.bincount(sentence, minlength=num_sentences)
+    failed["connected"] = checked & (components > 1)
+    failed["tree"] = checked & (num_links > num_words - components)
+
+    failed["crossing"] = np.bincount(sentence[crossing_links(left, right)], minlength=num_sentences) > 0
+    return failed
+
+
+def connected_components(num_nodes: int, left, right):
+    """
+    Returns the smallest node of the connected component of each node of the graph with edges
+    (left[k], right[k]). Each round hooks the larger of two linked component labels to the smaller,
+    then compresses label chains to their root.
+    """
+    label = np.arange(num_nodes)
+    while True:
+        left_label, right_label = label[left], label[right]
+        different = left_label != right_label
+        if not different.any():
+            return label
+        np.minimum.at(label, np.maximum(left_label, right_label)[different],
+                      np.minimum(left_label, right_label)[different])
+        while True:
+            root = label[label]
+            if np.array_equal(root, label):
+                break
+            label = root
+
+
+def crossing_links(left, right):
+    """
+    Returns the mask of links (left[k] < right[k], sorted by left end) crossed by a link starting
+    inside them. Links starting strictly inside link k are a contiguous range, and one of them
+    crosses it iff it ends after right[k].
+    """
+    crossed = np.zeros(len(left), dtype=bool)
+    first = np.searchsorted(left, left, side='right')
+    stop = np.searchsorted(left, right, side='left')
+    inside = np.flatnonzero(stop > first)
+    if len(inside):
+        # Maximum right end over each range [first, stop), from reductions over the interleaved bounds
+        bounds = np.column_stack((first[inside], stop[inside])).ravel()
+        farthest = np.maximum.reduceat(np.append(right, -1), bounds)[0::2]
+        crossed[inside] = farthest > right[inside]
+    return crossed
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,25 @@
+# coding: utf-8
+
+# The modules of src/ are scripts importing each other by name, so tests import them the same way.
+
+import os
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src")
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "data")
+sys.path.insert(0, SRC_DIR)
+
+# Adjectives can be chained before a noun, so sentences have no length bound
+RECURSIVE_GRAMMAR = """
+% Class: 0
+kids:
+(C0_1+ & C2_0-) or (C0_1+);
+
+% Class: 1
+run:
+(C0_1-);
+
+% Class: 2
+red big:
+(C2_0+) or (C2_0+ & C2_2-) or (C2_2+) or (C2_2+ & C2_2-);
+"""
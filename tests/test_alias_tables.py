@@ -0,0 +1,75 @@
+# coding: utf-8
+
+# Tests of the alias tables of weighted sampling: exact distributions of the tables, and draws.
+
+import random
+from collections import Counter
+import numpy as np
+import pytest
+from alias_tables import AliasTables
+
+
+def table_distribution(tables, segment):
+    """
+    Exact probability of drawing each position of segment: each column is chosen with probability 1/size,
+    and then gives its own position with probability prob, or its alias
+    """
+    start, stop = tables.offsets[segment], tables.offsets[segment + 1]
+    probabilities = np.zeros(len(tables.prob))
+    for pos in range(start, stop):
+        probabilities[pos] += tables.prob[pos] / (stop - start)
+        probabilities[tables.alias[pos]] += (1 - tables.prob[pos]) / (stop - start)
+    return probabilities[start:stop]
+
+
+WEIGHTS = [1, 2, 3, 4, 5, 0.5, 7, 1, 1, 1, 1, 100, 0.001, 3, 3]
+OFFSETS = [0, 5, 5, 6, 11, 15]  # includes an empty and a single-option distribution
+
+
+@pytest.mark.parametrize("segment", [0, 2, 3, 4])
+def test_tables_give_weights(segment):
+    tables = AliasTables(WEIGHTS, OFFSETS)
+    weights = np.array(WEIGHTS[OFFSETS[segment]:OFFSETS[segment + 1]])
+    assert np.allclose(table_distribution(tables, segment), weights / weights.sum())
+
+
+def test_random_weights():
+    rng = np.random.default_rng(0)
+    sizes = rng.integers(1, 50, size=200)
+    offsets = np.concatenate(([0], np.cumsum(sizes)))
+    weights = rng.pareto(1.0, size=offsets[-1]) + 1e-6
+    tables = AliasTables(weights, offsets)
+    for segment in range(len(sizes)):
+        segment_weights = weights[offsets[segment]:offsets[segment + 1]]
+        assert np.allclose(table_distribution(tables, segment), segment_weights / segment_weights.sum())
+
+
+def test_draws_stay_in_their_segment():
+    tables = AliasTables(WEIGHTS, OFFSETS)
+    rng = random.Random(1)
+    segments = np.array([0, 2, 3, 4] * 1000)
+    batch = tables.draw_batch(segments, np.random.default_rng(1))
+    for segment, pos in zip(segments.tolist(), batch.tolist()):
+        assert OFFSETS[segment] <= pos < OFFSETS[segment + 1]
+        assert OFFSETS[segment] <= tables.draw(segment, rng) < OFFSETS[segment + 1]
+
+
+def test_draw_frequencies():
+    tables = AliasTables(WEIGHTS, OFFSETS)
+    num_draws = 100000
+    probabilities = np.array(WEIGHTS[6:11]) / sum(WEIGHTS[6:11])
+    observed = Counter(tables.draw_batch(np.full(num_draws, 3), np.random.default_rng(2)).tolist())
+    rng = random.Random(2)
+    scalar = Counter(tables.draw(3, rng) for _ in range(num_draws))
+    for counts in (observed, scalar):
+        frequencies = np.array([counts[pos] for pos in range(6, 11)]) / num_draws
+        # 4 standard deviations of each frequency
+        assert np.all(np.abs(frequencies - probabilities) < 4 * np.sqrt(probabilities / num_draws))
+
+
+def test_empty_distribution():
+    tables = AliasTables(WEIGHTS, OFFSETS)
+    with pytest.raises(ValueError):
+        tables.draw(1, random.Random(0))
+    with pytest.raises(ValueError):
+        tables.draw_batch([0, 1], np.random.default_rng(0))
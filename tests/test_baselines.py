@@ -0,0 +1,88 @@
+# coding: utf-8
+
+# Tests of the exact maximum spanning tree parser against brute-force search on short sentences.
+
+import itertools
+import random
+import numpy as np
+import pytest
+from baselines import MSTParser, PairScores, projective_trees, WORD_BITS
+
+
+def is_projective_tree(heads):
+    """
+    Whether heads (-1 for word 0, the root) form a tree without crossing arcs
+    """
+    for word in range(1, len(heads)):
+        seen, node = set(), word
+        while node != 0:
+            if node in seen:
+                return False
+            seen.add(node)
+            node = heads[node]
+    arcs = [tuple(sorted((head, dep))) for dep, head in enumerate(heads) if head >= 0]
+    return not any(a < c < b < d for a, b in arcs for c, d in arcs)
+
+
+def brute_force_tree(arcs):
+    n = len(arcs)
+    trees = ([-1] + list(rest) for rest in itertools.product(range(n), repeat=n - 1))
+    return max(sum(arcs[head, dep] for dep, head in enumerate(heads) if head >= 0)
+               for heads in trees if is_projective_tree(heads))
+
+
+@pytest.mark.parametrize("n", [1, 2, 3, 4, 5])
+def test_projective_trees_are_optimal(n):
+    rng = np.random.default_rng(n)
+    arcs = rng.normal(size=(40, n, n))
+    arcs[:, :, 0] = -np.inf
+    for sentence_arcs, heads in zip(arcs, projective_trees(arcs)):
+        assert is_projective_tree(heads)
+        value = sum(sentence_arcs[head, dep] for dep, head in enumerate(heads) if head >= 0)
+        assert value == pytest.approx(brute_force_tree(sentence_arcs))
+
+
+def brute_force_forest(num_words, scores):
+    """
+    Most links, then highest score, of a forest without crossing links over the scored pairs
+    """
+    pairs = list(scores)
+    for size in range(min(len(pairs), num_words - 1), -1, -1):
+        best = None
+        for links in itertools.combinations(pairs, size):
+            parent = list(range(num_words + 1))
+
+            def find(x):
+                while parent[x] != x:
+                    x = parent[x]
+                return x
+            acyclic = True
+            for a, b in links:
+                if find(a) == find(b):
+                    acyclic = False
+                    break
+                parent[find(a)] = find(b)
+            if acyclic and not any(a < c < b < d for a, b in links for c, d in links):
+                value = sum(scores[link] for link in links)
+                best = value if best is None else max(best, value)
+        if best is not None:
+            return size, best
+
+
+def test_mst_parser_matches_brute_force():
+    rng = random.Random(0)
+    for _ in range(100):
+        num_words, window = rng.randint(1, 6), rng.randint(1, 6)
+        words = [f"w{i}" for i in range(num_words)]
+        pairs = {(a << WORD_BITS) | b: rng.uniform(-3, 5)
+                 for a in range(num_words) for b in range(a + 1, num_words) if rng.random() < 0.8}
+        keys = np.array(sorted(pairs), dtype=np.int64)
+        parser = MSTParser(PairScores({word: i for i, word in enumerate(words)}, keys,
+                                      np.array([pairs[key] for key in keys.tolist()])), window)
+        # Links are 1-based word positions, like the ones of the parse output
+        scores = {((key >> WORD_BITS) + 1, (key & ((1 << WORD_BITS) - 1)) + 1): value for key, value in pairs.items()
+                  if (key & ((1 << WORD_BITS) - 1)) - (key >> WORD_BITS) <= window}
+        links = parser.parse(words)
+        size, value = brute_force_forest(num_words, scores)
+        assert len(links) == size
+        assert sum(scores[link] for link in links) == pytest.approx(value)
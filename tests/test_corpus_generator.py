@@ -0,0 +1,49 @@
+# coding: utf-8
+
+# Tests of the reproducibility of corpus_generator: per-chunk random streams derived from the master seed.
+
+import os
+import pytest
+from conftest import DATA_DIR
+from corpus_generator import generate_corpus, sample_chunks, make_grammar, CHUNK_SIZE
+
+GRAMMAR = os.path.join(DATA_DIR, "handgram8.grammar")
+CORPUS_SIZE = 2 * CHUNK_SIZE + 500  # more than one chunk, with a partial last one
+
+
+def read_files(outfile):
+    contents = []
+    for path in (outfile, outfile + ".ull"):
+        with open(path, 'rb') as fi:
+            contents.append(fi.read())
+    return contents
+
+
+def test_corpus_independent_of_workers(tmp_path):
+    outputs = []
+    for workers in (1, 3):
+        outfile = str(tmp_path / f"corpus{workers}.txt")
+        generate_corpus('existing', CORPUS_SIZE, outfile, GRAMMAR, seed=7, workers=workers)
+        outputs.append(read_files(outfile))
+    assert outputs[0] == outputs[1]
+    assert outputs[0][0]
+
+
+def test_corpus_depends_on_seed(tmp_path):
+    outputs = []
+    for seed in (7, 8):
+        outfile = str(tmp_path / f"corpus{seed}.txt")
+        generate_corpus('existing', CHUNK_SIZE, outfile, GRAMMAR, seed=seed)
+        outputs.append(read_files(outfile))
+    assert outputs[0] != outputs[1]
+
+
+@pytest.mark.parametrize("first_chunk", [1, 2])
+def test_chunks_drawn_from_their_own_streams(first_chunk):
+    # Starting from a later chunk gives the same chunks as drawing all of them
+    grammar = make_grammar('existing', GRAMMAR, 7)
+    sampler_args = {"max_length": 100, "max_depth": None}
+    chunks = list(sample_chunks(grammar, CORPUS_SIZE, 7, sampler_args=sampler_args))
+    assert len(chunks) == 3
+    assert list(sample_chunks(grammar, CORPUS_SIZE, 7, sampler_args=sampler_args,
+                              first_chunk=first_chunk)) == chunks[first_chunk:]
@@ -0,0 +1,68 @@
+# coding: utf-8
+
+# Tests of the deduplication backends: agreement with a set, batched inserts, and saved states.
+
+import numpy as np
+import pytest
+from dedup import make_dedup, load_dedup, HashDedup, DEDUP_BACKENDS
+
+
+def sentences(num, num_distinct, seed=0):
+    rng = np.random.default_rng(seed)
+    return [f"sentence {n}" for n in rng.integers(0, num_distinct, size=num).tolist()]
+
+
+def first_occurrences(items):
+    seen = set()
+    new = []
+    for item in items:
+        new.append(item not in seen)
+        seen.add(item)
+    return new
+
+
+@pytest.mark.parametrize("backend", DEDUP_BACKENDS)
+def test_backends_agree_with_set(backend, tmp_path):
+    items = sentences(20000, 12000)
+    dedup = make_dedup(backend, str(tmp_path / "dedup") if backend == "disk" else None)
+    half = len(items) // 2
+    new = [dedup.add(item) for item in items[:half]] + dedup.add_batch(items[half:])
+    assert new == first_occurrences(items)
+    assert len(dedup) == len(set(items))
+    dedup.close()
+
+
+def test_hash_batches_grow_table():
+    rng = np.random.default_rng(1)
+    values = rng.integers(1, 2 ** 63, size=300000, dtype=np.uint64)
+    values = np.concatenate((values, values[:50000], rng.integers(1, 100, size=1000, dtype=np.uint64)))
+    rng.shuffle(values)
+    dedup = HashDedup(capacity=16)
+    new = np.concatenate([dedup.add_hashes(values[start:start + 1000]) for start in range(0, len(values), 1000)])
+    assert new.tolist() == first_occurrences(values.tolist())
+    assert len(dedup) == np.count_nonzero(dedup.table) == len(set(values.tolist()))
+    assert len(dedup) <= HashDedup.MAX_LOAD * len(dedup.table)
+    # Every stored hash is found again by the scalar path
+    assert not any(dedup.add_hash(value) for value in values[:2000].tolist())
+
+
+@pytest.mark.parametrize("backend", DEDUP_BACKENDS)
+def test_saved_state(backend, tmp_path):
+    items = sentences(5000, 3000)
+    dedup = make_dedup(backend, str(tmp_path / "dedup") if backend == "disk" else None)
+    dedup.add_batch(items[:2500])
+    dedup.save(str(tmp_path / "state"))
+    dedup.add_batch(items[2500:])  # dropped when the saved state is loaded
+    if backend == "disk":
+        dedup.commit()
+    restored = load_dedup(backend, str(tmp_path / "state"))
+    assert restored.add_batch(items[2500:]) == first_occurrences(items)[2500:]
+    restored.close()
+
+
+def test_fresh_disk_index_ignores_old_shards(tmp_path):
+    path = str(tmp_path / "dedup")
+    dedup = make_dedup("disk", path)
+    dedup.add_batch(["a", "b"])
+    dedup.commit()
+    assert make_dedup("disk", path).add_batch(["a", "b"]) == [True, True]
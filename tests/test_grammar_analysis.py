@@ -0,0 +1,72 @@
+# coding: utf-8
+
+# Tests of the derivation counts of GrammarAnalyzer against exhaustive enumeration.
+
+import math
+import os
+import pytest
+from conftest import DATA_DIR, RECURSIVE_GRAMMAR
+from sentence_generator import Grammar
+from grammar_analysis import analyzer_for, enumerate_parses, enumerate_skeletons
+
+MAX_LEN = 6  # Enumerating longer sentences of the bigger grammars takes too long for a test
+
+
+def load(name):
+    return Grammar(os.path.join(DATA_DIR, name))
+
+
+def length_histogram(sentences, max_len):
+    histogram = [0] * (max_len + 1)
+    for sentence in sentences:
+        histogram[len(sentence.split()) - 1] += 1  # without the final punctuation
+    return histogram
+
+
+@pytest.mark.parametrize("name", ["handgram0.grammar", "handgram1.grammar", "handgram2.grammar",
+                                  "handgram3.grammar", "handgram4.grammar", "rangram1.grammar"])
+def test_lexical_counts_match_enumeration(name):
+    grammar = load(name)
+    parses = enumerate_parses(grammar, MAX_LEN)
+    assert analyzer_for(grammar).count_by_length(MAX_LEN) == length_histogram((s for s, _ in parses), MAX_LEN)
+
+
+@pytest.mark.parametrize("name", ["handgram1.grammar", "handgram4.grammar", "handgram8.grammar"])
+def test_class_counts_match_skeletons(name):
+    grammar = load(name)
+    histogram = [0] * (MAX_LEN + 1)
+    for classes, heads, probability in enumerate_skeletons(grammar, MAX_LEN):
+        histogram[len(classes)] += 1
+    assert analyzer_for(grammar, lexical=False).count_by_length(MAX_LEN) == histogram
+
+
+@pytest.mark.parametrize("name", ["handgram0.grammar", "handgram1.grammar", "test.grammar"])
+def test_finite_language(name):
+    grammar = load(name)
+    analyzer = analyzer_for(grammar)
+    sentences = [sentence for sentence, _ in enumerate_parses(grammar)]
+    assert analyzer.is_finite()
+    assert analyzer.longest_sentence() == max(len(sentence.split()) - 1 for sentence in sentences)
+    assert analyzer.count_derivations() == len(sentences)
+    assert analyzer.count_sentences() == len(set(sentences))
+    # Skeleton probabilities are those of the sampler, so they add up to 1 over the whole language
+    assert math.isclose(sum(p for _, _, p in enumerate_skeletons(grammar)), 1)
+
+
+def test_recursive_grammar(tmp_path):
+    path = tmp_path / "recursive.grammar"
+    path.write_text(RECURSIVE_GRAMMAR)
+    grammar = Grammar(str(path))
+    analyzer = analyzer_for(grammar)
+    assert not analyzer.is_finite()
+    assert analyzer.longest_sentence() == math.inf
+    assert analyzer.count_derivations() == math.inf
+    assert analyzer.count_by_length(8) == length_histogram((s for s, _ in enumerate_parses(grammar, 8)), 8)
+
+
+def test_count_stops_over_limit():
+    analyzer = analyzer_for(load("handgram8.grammar"))
+    total = analyzer.count_derivations(12)
+    assert analyzer.count_derivations(12, limit=total) == total
+    assert total > analyzer.count_derivations(12, limit=1000) > 1000
+
@@ -0,0 +1,103 @@
+# coding: utf-8
+
+# Tests of length-targeted sampling and enumeration, and of uniform sampling over derivations.
+
+import math
+import os
+import random
+from collections import Counter
+import pytest
+from conftest import DATA_DIR, RECURSIVE_GRAMMAR
+from sentence_generator import Grammar
+from grammar_analysis import analyzer_for, enumerate_parses
+from length_sampler import LengthSampler, UniformSampler, enumerate_length_parses, parse_length_histogram
+
+
+def load(name):
+    return Grammar(os.path.join(DATA_DIR, name))
+
+
+def num_words(sentence):
+    return len(sentence.split()) - 1  # without the final punctuation
+
+
+def chi_square_bound(dof, z=3.09):
+    """
+    Wilson-Hilferty approximation of the chi-square quantile of dof degrees of freedom at normal score z
+    (3.09: the test fails by chance once in a thousand runs, i.e. never for the fixed seeds used here)
+    """
+    return dof * (1 - 2 / (9 * dof) + z * math.sqrt(2 / (9 * dof))) ** 3
+
+
+def chi_square(observed, expected_probabilities, num_draws):
+    return sum((observed.get(outcome, 0) - num_draws * p) ** 2 / (num_draws * p)
+               for outcome, p in expected_probabilities.items())
+
+
+def test_parse_length_histogram():
+    assert parse_length_histogram("3-5:10, 4:2,7") == [(3, 10), (4, 12), (5, 10), (7, 1)]
+    with pytest.raises(ValueError):
+        parse_length_histogram("5-3:10")
+
+
+@pytest.mark.parametrize("length", range(1, 7))
+def test_length_enumeration(length):
+    grammar = load("handgram4.grammar")
+    expected = Counter(parse for parse in enumerate_parses(grammar, length) if num_words(parse[0]) == length)
+    assert Counter(enumerate_length_parses(grammar, length)) == expected
+
+
+@pytest.mark.parametrize("length", [2, 5, 9, 12])
+def test_length_sampler_lengths(length):
+    sampler = LengthSampler(load("handgram8.grammar"), length, rng=random.Random(length))
+    for _ in range(200):
+        sentence, parse = sampler.generate_parse()
+        assert num_words(sentence) == length
+        assert len(parse.splitlines()) == length - 1  # trees have one link less than words
+
+
+def test_length_sampler_follows_counts():
+    # With lexical counts, every derivation of the length is equally likely
+    grammar = load("handgram1.grammar")
+    length = 4
+    derivations = Counter(parse for parse in enumerate_parses(grammar, length) if num_words(parse[0]) == length)
+    total = sum(derivations.values())
+    sampler = LengthSampler(grammar, length, analyzer=analyzer_for(grammar), rng=random.Random(3),
+                            use_weights=False)
+    num_draws = 200 * len(derivations)
+    observed = Counter(sampler.generate_parse() for _ in range(num_draws))
+    assert set(observed) <= set(derivations)
+    expected = {parse: count / total for parse, count in derivations.items()}
+    assert chi_square(observed, expected, num_draws) < chi_square_bound(len(expected) - 1)
+
+
+@pytest.mark.parametrize("name, max_length", [("handgram1.grammar", None), ("handgram4.grammar", 4)])
+def test_uniform_sampler(name, max_length):
+    grammar = load(name)
+    derivations = Counter(enumerate_parses(grammar, max_length))
+    total = sum(derivations.values())
+    sampler = UniformSampler(grammar, max_length, rng=random.Random(5))
+    num_draws = 50 * len(derivations)
+    observed = Counter(sampler.generate_parse() for _ in range(num_draws))
+    assert set(observed) <= set(derivations)
+    expected = {parse: count / total for parse, count in derivations.items()}
+    assert chi_square(observed, expected, num_draws) < chi_square_bound(len(expected) - 1)
+
+
+def test_uniform_sampler_lengths():
+    # Lengths are drawn in proportion to their number of derivations
+    grammar = load("handgram8.grammar")
+    counts = analyzer_for(grammar).count_by_length(7)
+    sampler = UniformSampler(grammar, 7, rng=random.Random(6))
+    num_draws = 20000
+    observed = Counter(num_words(sampler.generate_parse()[0]) for _ in range(num_draws))
+    expected = {length: count / sum(counts) for length, count in enumerate(counts) if count}
+    assert set(observed) <= set(expected)
+    assert chi_square(observed, expected, num_draws) < chi_square_bound(len(expected) - 1)
+
+
+def test_uniform_sampler_needs_max_length_of_recursive_grammars(tmp_path):
+    path = tmp_path / "recursive.grammar"
+    path.write_text(RECURSIVE_GRAMMAR)
+    with pytest.raises(ValueError):
+        UniformSampler(Grammar(str(path)))
@@ -0,0 +1,67 @@
+# coding: utf-8
+
+# Tests of the Link Grammar chart parser on sentences generated from the same grammars.
+
+import os
+import random
+import pytest
+from conftest import DATA_DIR
+from sentence_generator import Grammar, GrammarSampler
+from grammar_analysis import enumerate_parses
+from lg_parser import LinkParser
+
+
+def load(name):
+    return Grammar(os.path.join(DATA_DIR, name))
+
+
+def parse_links(parse):
+    """
+    (left, right) positions of the links of a ULL parse
+    """
+    return {(int(line.split()[0]), int(line.split()[2])) for line in parse.splitlines()}
+
+
+@pytest.mark.parametrize("name", ["handgram1.grammar", "handgram4.grammar", "handgram8.grammar",
+                                  "rangram1.grammar"])
+def test_generated_sentences_parse(name):
+    grammar = load(name)
+    parser = LinkParser(grammar)
+    sampler = GrammarSampler(grammar, max_length=12, rng=random.Random(2))
+    for _ in range(100):
+        sentence, parse = sampler.generate_parse()
+        words = sentence.split()[:-1]
+        linkages = parser.linkages(words)
+        assert parser.count_linkages(words) == len(linkages) > 0
+        # The generated tree is one of the linkages
+        assert parse_links(parse) in [{(left, right) for left, right, _, _ in links} for links in linkages]
+
+
+def test_linkages_are_trees():
+    parser = LinkParser(load("handgram8.grammar"))
+    words = "my nachos kids shall ignore kids sporadically".split()
+    linkages = parser.linkages(words)
+    assert linkages
+    for links in linkages:
+        assert len(links) == len(words) - 1
+        assert not any(a < c < b < d for a, b, _, _ in links for c, d, _, _ in links)
+
+
+def test_linkages_of_whole_language():
+    # Each linkage of a sentence is the tree of at least one of its derivations, and vice versa
+    grammar = load("handgram1.grammar")
+    parser = LinkParser(grammar)
+    trees = {}
+    for sentence, parse in enumerate_parses(grammar):
+        trees.setdefault(sentence, set()).add(frozenset(parse_links(parse)))
+    for sentence, sentence_trees in trees.items():
+        linkages = parser.linkages(sentence.split()[:-1])
+        assert {frozenset((left, right) for left, right, _, _ in links) for links in linkages} == sentence_trees
+
+
+def test_unparseable_sentences():
+    parser = LinkParser(load("handgram8.grammar"))
+    assert parser.count_linkages(["unknown"]) == 0
+    words = "sporadically kids ignore kids shall nachos my".split()  # a parseable sentence, reversed
+    assert not parser.parses(words)
+    assert parser.linkages(words) == []
@@ -0,0 +1,46 @@
+# coding: utf-8
+
+# Tests of the bounded iterative engine of GrammarSampler: word order resolution and derivation budgets.
+
+import os
+import random
+import pytest
+from conftest import DATA_DIR
+from sentence_generator import Grammar, GrammarSampler, DerivationBudgetError, resolve_insertions, \
+    RESOLVE_REPLAY_SIZE
+
+
+def replay_insertions(positions):
+    order = []
+    for item, pos in enumerate(positions):
+        order.insert(pos, item)
+    return order
+
+
+@pytest.mark.parametrize("size", [0, 1, 2, 7, 100, RESOLVE_REPLAY_SIZE, RESOLVE_REPLAY_SIZE + 1,
+                                  3 * RESOLVE_REPLAY_SIZE + 5])
+def test_resolve_insertions_matches_list_inserts(size):
+    rng = random.Random(size)
+    positions = [rng.randint(0, k) for k in range(size)]
+    assert resolve_insertions(positions) == replay_insertions(positions)
+
+
+@pytest.mark.parametrize("positions", [[0] * 20000, list(range(20000))])
+def test_resolve_insertions_extremes(positions):
+    # Always inserting at the front reverses the items, always appending keeps them in order
+    assert resolve_insertions(positions) == replay_insertions(positions)
+
+
+def test_sentences_fit_in_budgets():
+    grammar = Grammar(os.path.join(DATA_DIR, "handgram8.grammar"))
+    sampler = GrammarSampler(grammar, max_length=6, max_depth=4, rng=random.Random(1))
+    for _ in range(500):
+        sentence, parse = sampler.generate_parse()
+        assert len(sentence.split()) - 1 <= 6  # without the final punctuation
+
+
+def test_budget_error_after_resamples():
+    grammar = Grammar(os.path.join(DATA_DIR, "handgram8.grammar"))
+    sampler = GrammarSampler(grammar, max_length=1, max_resamples=3, rng=random.Random(1))
+    with pytest.raises(DerivationBudgetError):
+        sampler.generate_parse()
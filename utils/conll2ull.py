@@ -4,6 +4,7 @@
 
 import sys
 import os
+from conll_reader import read_conll, list_files, convert_files, PUNCTUATION_TAGS
 
 ROOT_WORD = "###LEFT-WALL###"
 IGNORED_WORD = "###PUNCTUATION###"
@@ -20,7 +21,7 @@ def tag_punctuation(sentence, pos_list):
     mapping = []
 
     for cnt, word in enumerate(sentence):
-        if pos_list[cnt][1] in ['p', 'PUNCT', 'punct']:  # punctuation token
+        if pos_list[cnt][1] in PUNCTUATION_TAGS:  # punctuation token
             tagged_sentence.append(IGNORED_WORD)
             num_punctuations += 1
             mapping.append(IGNORED_FLAG)
@@ -51,20 +52,51 @@ def create_links(sentence, mapping, link_ids):
     return links
 
 
+def convert_file(conll_path, newdir, punct_flag, max_length, lower_caps):
+    """
+    Converts one CoNLL file into a ULL parses file in newdir/GS and a corpus file in newdir/corpus.
+    Returns the number of converted parses.
+    """
+    num_parses = 0  # Num of parses in output file
+    name = os.path.basename(conll_path)
+    with open(newdir + 'GS/' + name + ".txt.ull", 'w') as fo, open(newdir + 'corpus/' + name + ".txt", 'w') as fc:
+        for record in read_conll(conll_path, lower_caps):
+            sentence = [ROOT_WORD] + record.words
+            pos_list = [('ROOT', 'ROOT')] + record.pos  # List with POS for each word, to detect punctuation
+            link_ids = [[head, cnt + 1] for cnt, head in enumerate(record.heads)]  # word ids for each link
+            if punct_flag:  # Punctuation removal is an option
+                tagged_sent, tagged_len, mapping = tag_punctuation(sentence, pos_list)
+            else:
+                tagged_sent = sentence
+                tagged_len = len(sentence) - 1  # Do not count ROOT_WORD
+                mapping = [i for i in range(len(sentence))]
+
+            # Only print sentences within desired length
+            if 0 < tagged_len <= max_length:
+                links = create_links(tagged_sent, mapping, link_ids)
+                clean_sent = [word for word in tagged_sent[1:] if word != IGNORED_WORD]
+                fc.write(" ".join(clean_sent) + "\n\n")  # print to corpus file
+                fo.write(" ".join(clean_sent) + "\n")  # print to parses file
+                fo.write("\n".join(links) + "\n\n")
+                num_parses += 1
+    return num_parses
+
+
 def main(argv):
     """
     Transforms dependency parses in CoNLL format to ULL format
 
-    Usage: python conll2ull.py <dirpath> <punct_flag> <max_length> <lower_caps>
+    Usage: python conll2ull.py <dirpath> <punct_flag> <max_length> <lower_caps> [<workers>]
 
     dirpath:            (str) Directory path with CONLL files
     punct_flag:         (int) Boolean flag to remove or not remove punctuation
     max_length:         (int) Ignore sentences longer than this parameter, after punctuation removal
     lower_caps:         (int) Boolean flag to convert to lowercaps
+    workers:            (int) Number of files converted in parallel (default: number of cores)
     """
 
     if len(argv) < 4:
-        print("Usage: python conll2ull.py <dirpath> <punct_flag> <max_length> <lower_caps>")
+        print("Usage: python conll2ull.py <dirpath> <punct_flag> <max_length> <lower_caps> [<workers>]")
 
     dirpath = argv[0]
     punct_flag = bool(int(argv[1]))  # Flag to remove punctuation
@@ -72,13 +104,9 @@ def main(argv):
     max_length = int(argv[2])  # max length of sentences to process after punctuation removal (if any)
     lower_caps = bool(int(argv[3]))  # Flag to convert to lowercaps
     lower_str = lower_caps * 'lower'
+    workers = int(argv[4]) if len(argv) > 4 else None
     print(f"\nProcessing files in {dirpath}\npunct_flag={punct_flag}\nmax_length={max_length}\n")
 
-    num_parses = 0  # Num of parses in output file
-    sentence = [ROOT_WORD]
-    pos_list = [('ROOT', 'ROOT')]  # List with POS for each word, to detect punctuation
-    link_ids = []  # List with word ids for each link
-
     # Build directory structure for converted corpus parses
     newdir = dirpath + '_ull_' + punct_str + '_' + str(max_length) + '_' + lower_str + '/'
     if not os.path.isdir(newdir):
@@ -86,51 +114,8 @@ def main(argv):
         os.mkdir(newdir + 'GS')
         os.mkdir(newdir + 'corpus')
 
-    for conll_filename in os.scandir(dirpath):
-        if conll_filename.path.endswith(('.conll', '.conllu')) and conll_filename.is_file():
-            with open(conll_filename, 'r') as fi:
-                with open(newdir+'GS/'+conll_filename.name + ".txt.ull", 'w') as fo:
-                    with open(newdir+'corpus/'+conll_filename.name + ".txt", 'w') as fc:
-                        lines = fi.readlines()
-                        for line in lines:
-                            split_line = line.split('\t')
-                            chars = '.-'  # Chars that signal specially processed words in field 0 in UD corpora
-                            # Skip comments
-                            if line.startswith("#"):
-                                pass
-                            # Process parse when newline is found
-                            elif line == "\n":
-                                if punct_flag:  # Punctuation removal is an option
-                                    tagged_sent, tagged_len, mapping = tag_punctuation(sentence, pos_list)
-                                else:
-                                    tagged_sent = sentence
-                                    tagged_len = len(sentence) - 1  # Do not count ROOT_WORD
-                                    mapping = [i for i in range(len(sentence))]
-
-                                # Only print sentences within desired length
-                                if 0 < tagged_len <= max_length:
-                                    links = create_links(tagged_sent, mapping, link_ids)
-                                    clean_sent = [word for word in tagged_sent[1:] if word != IGNORED_WORD]
-                                    fc.write(" ".join(clean_sent) + "\n\n")  # print to corpus file
-                                    fo.write(" ".join(clean_sent) + "\n")  # print to parses file
-                                    fo.write("\n".join(links) + "\n\n")
-                                    num_parses += 1
-
-                                # reset arrays
-                                sentence = [ROOT_WORD]
-                                link_ids = []
-                                pos_list = [('ROOT', 'ROOT')]
-
-                            # Links are still being processed
-                            # Discards words processed in a special way in UD corpora
-                            elif all((c not in chars) for c in split_line[0]):
-                                if lower_caps:
-                                    split_line[1] = split_line[1].lower()
-                                # store ordered links indexes
-                                link_ids.append([int(split_line[6]), int(split_line[0])])
-                                pos_list.append((split_line[3], split_line[7]))
-                                sentence.append(split_line[1])  # build sentence array
-
+    num_parses = convert_files(convert_file, list_files(dirpath, ('.conll', '.conllu')),
+                               (newdir, punct_flag, max_length, lower_caps), workers)
     print(f"Converted a total of {num_parses} parses with len <= {max_length}")
 
 
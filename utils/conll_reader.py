@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# coding=utf-8
+# runs on python3
+
+# Streaming readers of dependency parse files, shared by the converters in this folder,
+# and a helper to convert many files in parallel.
+
+import os
+from collections import namedtuple
+from multiprocessing import Pool
+
+SPECIAL_ID_CHARS = '.-'  # Chars that signal specially processed words in field 0 in UD corpora
+PUNCTUATION_TAGS = ('p', 'PUNCT', 'punct')
+
+# One parsed sentence: words, (POS, relation) pairs and head indexes of each word, where 0 is the root
+ConllSentence = namedtuple("ConllSentence", ["words", "pos", "heads"])
+
+
+def read_conll(conll_file, lower_caps=False):
+    """
+    Yields the sentences of a CoNLL or CoNLL-U file one at a time, reading it line by line,
+    so that memory use doesn't depend on the file size. Comments, multiword tokens and
+    empty nodes (ids with '-' or '.') are skipped.
+    :param lower_caps:  Convert words to lowercaps
+    """
+    sentence = ConllSentence([], [], [])
+    with open(conll_file, 'r') as fi:
+        for line in fi:
+            if line.startswith("#"):
+                continue
+            if not line.strip():  # a blank line ends the sentence
+                if sentence.words:
+                    yield sentence
+                    sentence = ConllSentence([], [], [])
+                continue
+            fields = line.rstrip("\n").split('\t')
+            if any(c in SPECIAL_ID_CHARS for c in fields[0]):
+                continue
+            sentence.words.append(fields[1].lower() if lower_caps else fields[1])
+            sentence.pos.append((fields[3], fields[7]))
+            sentence.heads.append(int(fields[6]))
+    if sentence.words:  # file doesn't end in a blank line
+        yield sentence
+
+
+def read_crfae(crfae_file):
+    """
+    Yields the sentences of a file in CRFAE parser format (tab-separated lines of words, POS tags twice,
+    and heads, followed by a blank line) one at a time. POS relations are not available, and set to None.
+    """
+    lines = []
+    with open(crfae_file, 'r') as fi:
+        for line in fi:
+            if line.strip():
+                lines.append(line.rstrip("\n").split('\t'))
+                continue
+            if lines:
+                yield _crfae_sentence(lines)
+                lines = []
+    if lines:
+        yield _crfae_sentence(lines)
+
+
+def _crfae_sentence(lines):
+    if len(lines) != 4:
+        raise ValueError(f"CRFAE sentence should have 4 lines, found {len(lines)}: {lines}")
+    words, pos, _, heads = lines
+    return ConllSentence(words, [(tag, None) for tag in pos], [int(head) for head in heads])
+
+
+def list_files(dirpath, extensions):
+    """
+    Returns the sorted paths of the files in dirpath ending with any of extensions
+    """
+    return sorted(entry.path for entry in os.scandir(dirpath) if entry.path.endswith(extensions) and entry.is_file())
+
+
+def convert_files(convert, paths, args=(), workers=None):
+    """
+    Calls convert(path, *args) for each path in a pool of workers processes (default: one per core),
+    and returns the sum of the results, e.g. the number of converted sentences
+    """
+    tasks = [(path,) + tuple(args) for path in paths]
+    if workers == 1 or len(tasks) <= 1:
+        return sum(convert(*task) for task in tasks)
+    with Pool(min(workers or os.cpu_count(), len(tasks))) as pool:
+        return sum(pool.starmap(convert, tasks, chunksize=1))
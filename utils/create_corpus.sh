@@ -23,14 +23,11 @@ mkdir -p "$grammarname"
 cd "$grammarname" || exit
 mkdir -p corpus GS
 
-# generate corpus and GS
-python "${rangram_repo}/src/corpus_generator.py" -i "../grammars/${grammarname}.grammar" -o "${grammarname}.txt" -s "$corpus_size"
-
-# Sort corpus and GS alphabetically (to avoid unlikely-sentence bias, see journal)
-vim -T dumb --noplugin -n -es -S "${rangram_repo}/utils/sort_ull.ex" "${grammarname}.txt"
-vim -T dumb --noplugin -n -es -S "${rangram_repo}/utils/sort_ull.ex" "${grammarname}.txt.ull"
+# generate corpus and GS, in random order (to avoid unlikely-sentence bias, see journal)
+python "${rangram_repo}/src/corpus_generator.py" -i "../grammars/${grammarname}.grammar" -o "${grammarname}.txt" -s "$corpus_size" --shuffle
 
 mv "${grammarname}.txt" corpus
+mv "${grammarname}.txt.idx" corpus  # offsets of the corpus and GS sentences (see corpus_index.py)
 mv "${grammarname}.txt.ull" GS
 
 
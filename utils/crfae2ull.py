@@ -4,17 +4,9 @@
 
 import sys
 import os
+from conll_reader import read_crfae, list_files, convert_files
 
 ROOT_WORD = "###LEFT-WALL###"
-IGNORED_WORD = "###PUNCTUATION###"
-IGNORED_FLAG = -1
-
-from itertools import zip_longest
-
-
-def grouper(iterable, n, fillvalue=None):
-    args = [iter(iterable)] * n
-    return zip_longest(*args, fillvalue=fillvalue)
 
 
 def build_links(sentence, heads):
@@ -34,52 +26,50 @@ def build_links(sentence, heads):
     return links
 
 
+def convert_file(crfae_path, newdir, max_length):
+    """
+    Converts one CRFAE file into a ULL parses file in newdir. Returns the number of converted parses.
+    """
+    num_parses = 0  # Num of parses in output file
+    with open(newdir + os.path.basename(crfae_path) + ".txt.ull", 'w') as fo:
+        for record in read_crfae(crfae_path):
+            sentence = [ROOT_WORD] + record.words
+            sent_len = len(sentence) - 1  # Do not count ROOT_WORD
+
+            # Only print sentences within desired lengths
+            if 0 < sent_len <= max_length:
+                links = build_links(sentence, record.heads)
+                fo.write(" ".join(sentence[1:]) + "\n")  # print to parses file
+                fo.write("\n".join(links) + "\n\n")
+                num_parses += 1
+    return num_parses
+
+
 def main(argv):
     """
     Transforms dependency parses in CRFAE format to ULL format
 
-    Usage: python crfae2ull.py <dirpath> <max_length>
+    Usage: python crfae2ull.py <dirpath> <max_length> [<workers>]
 
     dirpath:            (str) Directory path with CRFAE files
     max_length:         (int) Ignore sentences longer than this parameter
+    workers:            (int) Number of files converted in parallel (default: number of cores)
     """
 
-    if len(argv) != 2:
-        print("Usage: python conll2ull.py <dirpath> <max_length>")
+    if len(argv) not in (2, 3):
+        print("Usage: python crfae2ull.py <dirpath> <max_length> [<workers>]")
 
     dirpath = argv[0]
     max_length = int(argv[1])  # max length of sentences to process after punctuation removal (if any)
+    workers = int(argv[2]) if len(argv) > 2 else None
     print(f"\nProcessing files in {dirpath}\nmax_length={max_length}\n")
 
-    num_parses = 0  # Num of parses in output file
-    sentence = [ROOT_WORD]
-
     # Build directory structure for converted corpus parses
     newdir = dirpath + '_ull_' + str(max_length) + '/'
     if not os.path.isdir(newdir):
         os.mkdir(newdir)
 
-    for crfae_filename in os.scandir(dirpath):
-        if crfae_filename.path.endswith('.crfae') and crfae_filename.is_file():
-            with open(crfae_filename, 'r') as fi:
-                with open(newdir+crfae_filename.name + ".txt.ull", 'w') as fo:
-                    for lines in grouper(fi, 5, ''):
-                        assert len(lines) == 5
-                        sentence = sentence + lines[0].split('\t')
-                        sentence[-1] = sentence[-1][:-1]  # Get rid of final EOL in sentence
-                        sent_len = len(sentence) - 1  # Do not count ROOT_WORD
-                        heads = lines[3].split('\t')
-
-                        # Only print sentences within desired lengths
-                        if 0 < sent_len <= max_length:
-                            links = build_links(sentence, heads)
-                            fo.write(" ".join(sentence[1:]) + "\n")  # print to parses file
-                            fo.write("\n".join(links) + "\n\n")
-                            num_parses += 1
-
-                            # reset arrays
-                            sentence = [ROOT_WORD]
-
+    num_parses = convert_files(convert_file, list_files(dirpath, '.crfae'), (newdir, max_length), workers)
     print(f"Converted a total of {num_parses} parses with len <= {max_length}")
 
 